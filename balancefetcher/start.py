@@ -3,23 +3,40 @@
 from __future__ import annotations
 
 import argparse
-import base64
-import hashlib
-import hmac
+import functools
+import importlib
+import itertools
 import json
 import logging
+import math
 import os
+import re
+import threading
 import time
-from dataclasses import dataclass, field
+from contextlib import ExitStack, contextmanager, suppress
+from dataclasses import dataclass, field, replace
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
 
-from filelock import FileLock
+# Heavy third-party modules (requests, yaml, frontmatter, dotenv, filelock) and
+# sqlite3 are imported inside the functions that need them so that runs ending
+# at ``already_logged`` stay fast. They remain reachable as module attributes
+# through ``__getattr__`` below.
+if TYPE_CHECKING:  # pragma: no cover - typing only
+    import sqlite3
 
-import requests
-import yaml
-import frontmatter
-from dotenv import load_dotenv
+    import numpy
+    import requests
+
+_LAZY_MODULES = {"requests", "yaml", "frontmatter", "sqlite3", "filelock"}
+
+
+def __getattr__(name: str):
+    """Import heavy modules on first attribute access (PEP 562)."""
+
+    if name in _LAZY_MODULES:
+        return importlib.import_module(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ---------------------------------------------------------------------------
@@ -27,6 +44,16 @@ from dotenv import load_dotenv
 # ---------------------------------------------------------------------------
 
 
+def _today() -> str:
+    """Return the current local date as ``YYYY-MM-DD``."""
+
+    return datetime.today().strftime("%Y-%m-%d")
+
+
+DEFAULT_CACHE_FILE = "~/.kucoin_balance_log.sqlite3"
+LEGACY_CACHE_FILE = "~/.kucoin_balance_log.json"  # default before the ledger
+
+
 @dataclass
 class Config:
     """Runtime configuration for balance logging."""
@@ -35,15 +62,30 @@ class Config:
     api_secret: str
     api_passphrase: str
     currency: str = "USDT"
+    currencies: list[str] = field(default_factory=list)
+    base_currency: str = ""
+    price_ttl: float = 60.0
     vault_path: str = ""
     balance_folder: str = "Trading/Balances/KuCoin"
+    vault_layout: str = "flat"
     cache_file: str = field(
-        default_factory=lambda: os.path.expanduser("~/.kucoin_balance_log.json")
+        default_factory=lambda: os.path.expanduser(DEFAULT_CACHE_FILE)
     )
     api_timeout: float = 10.0
     api_max_retries: int = 3
     api_retry_wait: float = 1.0
-    today: str = field(default_factory=lambda: datetime.today().strftime("%Y-%m-%d"))
+    api_rate_limit: float = 5.0
+    api_deadline: float = 30.0
+    circuit_threshold: int = 5
+    circuit_cooldown: float = 60.0
+    account: str = "default"
+    max_workers: int = 8
+    poll_interval: float = 300.0
+    sample_interval: float = 60.0
+    stream_debounce: float = 5.0
+    response_ttl: float = 30.0
+    response_cache_dir: str = ""
+    today: str = field(default_factory=_today)
 
 
 logger = logging.getLogger(__name__)
@@ -57,71 +99,442 @@ def setup_logging() -> None:
     logging.basicConfig(level=level, format="%(asctime)s %(levelname)s: %(message)s")
 
 
-def load_config() -> Config:
-    """Load configuration from environment variables."""
+# ---------------------------------------------------------------------------
+# Run metrics
+# ---------------------------------------------------------------------------
+
+
+class RunMetrics:
+    """Per-stage wall-clock timings and event counts for one run.
+
+    Stage times are summed across threads and may nest (``lock_wait`` is also
+    part of the stage that waited). After a run the figures can be exported
+    as a node_exporter textfile and/or appended as one JSON line.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.textfile: Optional[str] = None
+        self.json_path: Optional[str] = None
+        self.reset()
+
+    def reset(self, mode: str = "single") -> None:
+        with self._lock:
+            self.mode = mode
+            self.started = time.time()
+            self._start = time.perf_counter()
+            self.stages: dict[str, float] = {}
+            self.counters: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """Decorate a function so each call is timed as stage ``name``."""
+
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add ``seconds`` to stage ``name`` without timing a block."""
+
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self, success: bool) -> dict:
+        with self._lock:
+            return {
+                "timestamp": self.started,
+                "mode": self.mode,
+                "success": success,
+                "duration_seconds": time.perf_counter() - self._start,
+                "stages": dict(sorted(self.stages.items())),
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def export(self, success: bool) -> None:
+        """Write the configured textfile and/or JSON line for this run."""
+
+        if not (self.textfile or self.json_path):
+            return
+        snap = self.snapshot(success)
+        try:
+            if self.textfile:
+                _write_prometheus_textfile(self.textfile, snap)
+            if self.json_path:
+                os.makedirs(os.path.dirname(self.json_path) or ".", exist_ok=True)
+                with open(self.json_path, "a") as f:
+                    f.write(json.dumps(snap, sort_keys=True) + "\n")
+        except OSError as e:
+            logger.warning("Failed to export run metrics: %s", e)
+
+
+def _write_prometheus_textfile(path: str, snap: dict) -> None:
+    """Atomically write ``snap`` in the node_exporter textfile format."""
+
+    mode = f'mode="{snap["mode"]}"'
+    metrics = [
+        (
+            "stage_seconds",
+            "Seconds spent per stage in the last run.",
+            [(f'{mode},stage="{k}"', f"{v:.6f}") for k, v in snap["stages"].items()],
+        ),
+        (
+            "events",
+            "Events counted during the last run.",
+            [(f'{mode},event="{k}"', str(v)) for k, v in snap["counters"].items()],
+        ),
+        (
+            "run_seconds",
+            "Wall-clock duration of the last run.",
+            [(mode, f"{snap['duration_seconds']:.6f}")],
+        ),
+        (
+            "run_success",
+            "Whether the last run succeeded.",
+            [(mode, str(int(snap["success"])))],
+        ),
+        (
+            "run_timestamp_seconds",
+            "Start time of the last run.",
+            [(mode, f"{snap['timestamp']:.3f}")],
+        ),
+    ]
+    lines = []
+    for name, help_text, samples in metrics:
+        lines.append(f"# HELP balancefetcher_{name} {help_text}")
+        lines.append(f"# TYPE balancefetcher_{name} gauge")
+        lines += [
+            f"balancefetcher_{name}{{{labels}}} {value}" for labels, value in samples
+        ]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, path)
+
+
+METRICS = RunMetrics()
+
+ALLOC_TRACE_FRAMES = 10
+
+
+def _profile_all_threads(profilers: list) -> None:
+    """Give each thread started from now on its own enabled profiler.
+
+    Before Python 3.12 a :class:`cProfile.Profile` only sees the thread that
+    enabled it; from 3.12 one profiler already covers every thread.
+    """
+
+    import cProfile
+    import sys
+
+    if sys.version_info >= (3, 12):
+        return
+
+    def start_profiler(*_) -> None:
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()  # replaces this hook for the thread
+
+    threading.setprofile(start_profiler)
+
+
+@contextmanager
+def run_diagnostics(
+    mode: str,
+    profile_dir: Optional[str] = None,
+    alloc_dir: Optional[str] = None,
+    top: int = 25,
+) -> Iterator[None]:
+    """Capture a profile and/or allocation snapshot of the enclosed run.
+
+    With ``profile_dir`` a cProfile dump of every thread is written as
+    ``balancefetcher-<mode>-<time>-<pid>.pstats`` (open it with ``pstats`` or
+    snakeviz). With ``alloc_dir`` tracemalloc runs for the whole block and the
+    ``top`` allocation sites plus current and peak traced memory are written
+    to a ``.alloc.txt`` file of the same name. Files are written even if the
+    run fails.
+    """
+
+    if not (profile_dir or alloc_dir):
+        yield
+        return
+    import tracemalloc
+
+    stem = f"balancefetcher-{mode}-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+    profilers: list = []
+    if profile_dir:
+        import cProfile
+
+        profilers.append(cProfile.Profile())
+        _profile_all_threads(profilers)
+        profilers[0].enable()
+    if alloc_dir:
+        tracemalloc.start(ALLOC_TRACE_FRAMES)
+    try:
+        yield
+    finally:
+        if profile_dir:
+            import pstats
+
+            profilers[0].disable()
+            threading.setprofile(None)
+            path = os.path.join(profile_dir, f"{stem}.pstats")
+            os.makedirs(profile_dir, exist_ok=True)
+            pstats.Stats(*profilers).dump_stats(path)
+            logger.info("🧪 Profile written to %s", path)
+        if alloc_dir:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap*"),
+                ]
+            )
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [
+                f"# {mode} run, pid {os.getpid()}",
+                f"# traced memory: current {current / 1024:.1f} KiB, "
+                f"peak {peak / 1024:.1f} KiB",
+                f"# top {top} allocation sites by size",
+            ]
+            lines += [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+            path = os.path.join(alloc_dir, f"{stem}.alloc.txt")
+            os.makedirs(alloc_dir, exist_ok=True)
+            with open(path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            logger.info("🧪 Allocation snapshot written to %s", path)
+
+
+def load_config(require_credentials: bool = True) -> Config:
+    """Load configuration from environment variables.
+
+    ``require_credentials`` may be disabled when API keys are supplied by a
+    profiles file instead of the environment.
+    """
+
+    from dotenv import load_dotenv
 
     load_dotenv()
     api_key = os.getenv("KUCOIN_API_KEY", "")
     api_secret = os.getenv("KUCOIN_API_SECRET", "")
     api_passphrase = os.getenv("KUCOIN_API_PASSPHRASE", "")
     currency = os.getenv("KUCOIN_BALANCE_CURRENCY", "USDT")
+    currencies = [
+        c.strip().upper()
+        for c in os.getenv("KUCOIN_BALANCE_CURRENCIES", "").split(",")
+        if c.strip()
+    ]
+    base_currency = os.getenv("BALANCE_BASE_CURRENCY", "").strip().upper()
+    price_ttl = float(os.getenv("BALANCE_PRICE_TTL", "60"))
     vault_path = os.getenv("OBSIDIAN_VAULT_PATH", "")
     balance_folder = os.getenv("BALANCE_FOLDER", "Trading/Balances/KuCoin")
-    cache_file = os.path.expanduser(
-        os.getenv("BALANCE_CACHE_FILE", "~/.kucoin_balance_log.json")
-    )
+    vault_layout = os.getenv("BALANCE_VAULT_LAYOUT", "flat").lower()
+    cache_file = os.path.expanduser(os.getenv("BALANCE_CACHE_FILE", DEFAULT_CACHE_FILE))
     api_timeout = float(os.getenv("KUCOIN_API_TIMEOUT", "10"))
     api_max_retries = int(os.getenv("KUCOIN_API_MAX_RETRIES", "3"))
     api_retry_wait = float(os.getenv("KUCOIN_API_RETRY_WAIT", "1"))
+    api_rate_limit = float(os.getenv("KUCOIN_API_RATE_LIMIT", "5"))
+    api_deadline = float(os.getenv("KUCOIN_API_DEADLINE", "30"))
+    circuit_threshold = int(os.getenv("KUCOIN_CIRCUIT_THRESHOLD", "5"))
+    circuit_cooldown = float(os.getenv("KUCOIN_CIRCUIT_COOLDOWN", "60"))
+    max_workers = int(os.getenv("BALANCE_MAX_WORKERS", "8"))
+    poll_interval = float(os.getenv("BALANCE_POLL_INTERVAL", "300"))
+    sample_interval = float(os.getenv("BALANCE_SAMPLE_INTERVAL", "60"))
+    stream_debounce = float(os.getenv("BALANCE_STREAM_DEBOUNCE", "5"))
+    response_ttl = float(os.getenv("BALANCE_RESPONSE_TTL", "30"))
+    response_cache_dir = os.path.expanduser(os.getenv("BALANCE_RESPONSE_CACHE_DIR", ""))
 
-    required_env = {
-        "KUCOIN_API_KEY": api_key,
-        "KUCOIN_API_SECRET": api_secret,
-        "KUCOIN_API_PASSPHRASE": api_passphrase,
-        "OBSIDIAN_VAULT_PATH": vault_path,
-    }
+    required_env = {"OBSIDIAN_VAULT_PATH": vault_path}
+    if require_credentials:
+        required_env = {
+            "KUCOIN_API_KEY": api_key,
+            "KUCOIN_API_SECRET": api_secret,
+            "KUCOIN_API_PASSPHRASE": api_passphrase,
+            **required_env,
+        }
     missing = [name for name, value in required_env.items() if not value]
     if missing:
         raise SystemExit(
             f"Missing required environment variables: {', '.join(missing)}"
         )
+    if vault_layout not in VAULT_LAYOUTS:
+        raise SystemExit(
+            f"Invalid BALANCE_VAULT_LAYOUT {vault_layout!r}, "
+            f"expected one of: {', '.join(VAULT_LAYOUTS)}"
+        )
+
+    if base_currency:
+        currencies = currencies or [currency]
+        currency = base_currency
 
     return Config(
         api_key=api_key,
         api_secret=api_secret,
         api_passphrase=api_passphrase,
         currency=currency,
+        currencies=currencies,
+        base_currency=base_currency,
+        price_ttl=price_ttl,
         vault_path=vault_path,
         balance_folder=balance_folder,
+        vault_layout=vault_layout,
         cache_file=cache_file,
         api_timeout=api_timeout,
         api_max_retries=api_max_retries,
         api_retry_wait=api_retry_wait,
+        api_rate_limit=api_rate_limit,
+        api_deadline=api_deadline,
+        circuit_threshold=circuit_threshold,
+        circuit_cooldown=circuit_cooldown,
+        max_workers=max_workers,
+        poll_interval=poll_interval,
+        sample_interval=sample_interval,
+        stream_debounce=stream_debounce,
+        response_ttl=response_ttl,
+        response_cache_dir=response_cache_dir,
+    )
+
+
+def load_profiles(config: Config, path: str) -> list[Config]:
+    """Expand a profiles file into one :class:`Config` per account and currency.
+
+    The file is YAML of the form::
+
+        currencies: [USDT]          # optional default for every account
+        accounts:
+          - name: main
+            api_key: ${MAIN_KEY}
+            api_secret: ${MAIN_SECRET}
+            api_passphrase: ${MAIN_PASSPHRASE}
+            currencies: [USDT, XBT]
+            balance_folder: Trading/Balances/KuCoin/main  # optional
+
+    ``${VAR}`` references in credentials are expanded from the environment.
+    Unless overridden, notes go to ``<balance_folder>/<name>/<currency>``.
+    With a ``base_currency`` each account instead gets one profile totalling
+    all its currencies, with notes in ``<balance_folder>/<name>``.
+    """
+
+    import yaml
+
+    with open(os.path.expanduser(path), "r") as f:
+        data = yaml.safe_load(f) or {}
+    accounts = data.get("accounts") if isinstance(data, dict) else None
+    if not isinstance(accounts, list) or not accounts:
+        raise SystemExit(f"Profiles file {path} defines no accounts")
+    default_currencies = (
+        data.get("currencies") or config.currencies or [config.currency]
     )
 
+    configs = []
+    for entry in accounts:
+        name = str(entry.get("name", ""))
+        credentials = {
+            key: os.path.expandvars(str(entry.get(key, "")))
+            for key in ("api_key", "api_secret", "api_passphrase")
+        }
+        missing = [key for key, value in credentials.items() if not value]
+        if not name or missing:
+            raise SystemExit(
+                f"Invalid profile {name or '<unnamed>'!r} in {path}: "
+                f"missing {', '.join(['name'] * (not name) + missing)}"
+            )
+        currencies = [
+            str(c).strip().upper()
+            for c in entry.get("currencies") or default_currencies
+        ]
+        if config.base_currency:
+            configs.append(
+                replace(
+                    config,
+                    **credentials,
+                    account=name,
+                    currencies=currencies,
+                    balance_folder=entry.get("balance_folder")
+                    or os.path.join(config.balance_folder, name),
+                )
+            )
+            continue
+        for currency in currencies:
+            folder = entry.get("balance_folder") or os.path.join(
+                config.balance_folder, name
+            )
+            if not entry.get("balance_folder") or len(currencies) > 1:
+                folder = os.path.join(folder, currency)
+            configs.append(
+                replace(
+                    config,
+                    **credentials,
+                    account=name,
+                    currency=currency,
+                    balance_folder=folder,
+                )
+            )
+    return configs
+
 
 # ---------------------------------------------------------------------------
 # KuCoin API helpers
 # ---------------------------------------------------------------------------
 
+KUCOIN_FUTURES_URL = "https://api-futures.kucoin.com"
+HISTORY_WINDOW = timedelta(days=7)
+HISTORY_PAGE_SIZE = 200
+
+
+@functools.lru_cache(maxsize=None)
+def _signed_passphrase(api_secret: str, api_passphrase: str) -> str:
+    """Return the v2 passphrase signature, computed once per credential pair."""
+
+    import base64
+    import hashlib
+    import hmac
+
+    digest = hmac.new(
+        api_secret.encode(), api_passphrase.encode(), hashlib.sha256
+    ).digest()
+    return base64.b64encode(digest).decode()
+
 
 def kucoin_futures_headers(
     config: Config, endpoint: str, method: str = "GET"
 ) -> dict[str, str]:
     """Create authenticated headers for the KuCoin Futures API."""
 
-    now = str(int(time.time() * 1000))
-    str_to_sign = f"{now}{method}{endpoint}"
-    signature = base64.b64encode(
-        hmac.new(
-            config.api_secret.encode(), str_to_sign.encode(), hashlib.sha256
-        ).digest()
-    ).decode()
-    passphrase = base64.b64encode(
-        hmac.new(
-            config.api_secret.encode(), config.api_passphrase.encode(), hashlib.sha256
-        ).digest()
-    ).decode()
+    import base64
+    import hashlib
+    import hmac
+
+    with METRICS.stage("sign"):
+        now = str(int(time.time() * 1000))
+        str_to_sign = f"{now}{method}{endpoint}"
+        signature = base64.b64encode(
+            hmac.new(
+                config.api_secret.encode(), str_to_sign.encode(), hashlib.sha256
+            ).digest()
+        ).decode()
+        passphrase = _signed_passphrase(config.api_secret, config.api_passphrase)
     return {
         "KC-API-KEY": config.api_key,
         "KC-API-SIGN": signature,
@@ -132,175 +545,3449 @@ def kucoin_futures_headers(
     }
 
 
-def fetch_futures_balance(config: Config) -> float:
-    """Retrieve the current futures account equity for ``config.currency``."""
+def new_session(pool_size: int = 1) -> requests.Session:
+    """Return a keep-alive session whose pool can serve ``pool_size`` threads."""
 
-    endpoint = f"/api/v1/account-overview?currency={config.currency}"
-    url = "https://api-futures.kucoin.com" + endpoint
-    headers = kucoin_futures_headers(config, endpoint)
-    with requests.Session() as session:
-        for attempt in range(1, config.api_max_retries + 1):
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=max(pool_size, 1)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RateLimiter:
+    """Token bucket and circuit breaker shared through a JSON state file.
+
+    State is kept per account and updated under a file lock, so every thread
+    and process using the same ledger draws from one bucket of
+    ``config.api_rate_limit`` requests per second. KuCoin's
+    ``gw-ratelimit-remaining``/``gw-ratelimit-reset`` headers cap the bucket
+    and pause all callers until the quota resets. After
+    ``config.circuit_threshold`` consecutive failures the breaker opens and
+    requests fail fast for ``config.circuit_cooldown`` seconds.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _state(self, account: str) -> Iterator[dict]:
+        from filelock import FileLock
+
+        with self._lock, FileLock(self.path + ".lock"):
             try:
-                res = session.get(url, headers=headers, timeout=config.api_timeout)
-                res.raise_for_status()
-                try:
-                    data = res.json()
-                    return float(data["data"]["accountEquity"])
-                except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
-                    logger.error("Failed to parse JSON response: %s", e)
-                    raise RuntimeError(f"Failed to parse JSON: {e}") from e
-            except requests.exceptions.RequestException as e:
-                if attempt < config.api_max_retries:
-                    wait_time = config.api_retry_wait * (2 ** (attempt - 1))
-                    logger.warning(
-                        "Request failed (attempt %s/%s): %s",
-                        attempt,
-                        config.api_max_retries,
-                        e,
+                with open(self.path) as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
+            except ValueError as e:
+                logger.warning("Resetting unreadable rate-limit state: %s", e)
+                data = {}
+            state = data.setdefault(account, {})
+            before = dict(state)
+            yield state
+            if state != before:
+                data = json.dumps(data).encode()
+                os.replace(_stage_note(self.path, data), self.path)
+
+    def acquire(self, config: Config, deadline: float) -> None:
+        """Wait for a request slot, or raise if none is free before ``deadline``.
+
+        ``deadline`` is a :func:`time.monotonic` timestamp.
+        """
+
+        while True:
+            with self._state(config.account) as state:
+                now = time.time()
+                if state.get("open_until", 0) > now:
+                    METRICS.count("circuit_open")
+                    raise RuntimeError(
+                        f"KuCoin API circuit open for {config.account}, retry in "
+                        f"{state['open_until'] - now:.0f}s"
                     )
+                wait = max(state.get("blocked_until", 0) - now, 0)
+                rate = config.api_rate_limit
+                if rate > 0:
+                    elapsed = max(now - state.get("updated", now), 0)
+                    tokens = min(state.get("tokens", rate) + elapsed * rate, rate)
+                    state["updated"] = now
+                    if not wait and tokens >= 1:
+                        tokens -= 1
+                    elif not wait:
+                        wait = (1 - tokens) / rate
+                    state["tokens"] = tokens
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RuntimeError(
+                    f"Rate limit wait of {wait:.1f}s exceeds the request deadline"
+                )
+            with METRICS.stage("rate_wait"):
+                time.sleep(wait)
+
+    def observe(self, config: Config, response) -> None:
+        """Apply the quota headers of ``response`` to the shared bucket."""
+
+        headers = getattr(response, "headers", None) or {}
+        remaining: Optional[float] = None
+        with suppress(TypeError, ValueError):
+            remaining = float(headers.get("gw-ratelimit-remaining"))
+        status = getattr(response, "status_code", None)
+        if remaining is None and status != 429:
+            return
+        try:
+            reset = float(headers.get("gw-ratelimit-reset") or 0) / 1000
+        except ValueError:
+            reset = 0.0
+        with self._state(config.account) as state:
+            now = time.time()
+            if remaining is not None:
+                state["tokens"] = min(
+                    state.get("tokens", config.api_rate_limit), remaining
+                )
+                state["updated"] = now
+            if status == 429 or (remaining is not None and remaining <= 0):
+                until = now + (reset or config.api_retry_wait)
+                state["blocked_until"] = max(state.get("blocked_until", 0), until)
+
+    def record(self, config: Config, ok: bool) -> None:
+        """Close the breaker after a success or count a failure towards it."""
+
+        with self._state(config.account) as state:
+            if ok:
+                state["failures"] = 0
+                state["open_until"] = 0
+                return
+            state["failures"] = state.get("failures", 0) + 1
+            if state["failures"] >= config.circuit_threshold > 0:
+                state["open_until"] = time.time() + config.circuit_cooldown
+                logger.warning(
+                    "⚠️ %s consecutive API failures for %s, pausing requests for %ss",
+                    state["failures"],
+                    config.account,
+                    config.circuit_cooldown,
+                )
+
+
+@functools.lru_cache(maxsize=None)
+def _rate_limiter(path: str) -> RateLimiter:
+    return RateLimiter(path)
+
+
+def rate_limiter(config: Config) -> RateLimiter:
+    """Return the limiter shared by every run using ``config.cache_file``."""
+
+    return _rate_limiter(f"{config.cache_file}.ratelimit.json")
+
+
+def _retryable(error: requests.exceptions.RequestException) -> bool:
+    """Return ``True`` for network errors, 429 and 5xx responses."""
+
+    status = getattr(error.response, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+def request_json(
+    config: Config, session: requests.Session, endpoint: str, method: str = "GET"
+) -> dict:
+    """Call a signed KuCoin Futures ``endpoint``, retrying transient failures.
+
+    Requests draw from the shared :class:`RateLimiter`. Network errors, 429
+    and 5xx responses are retried with fully jittered exponential backoff
+    until ``config.api_max_retries`` attempts or the ``config.api_deadline``
+    budget is used up; other HTTP errors fail at once.
+    """
+
+    import random
+
+    import requests
+
+    url = KUCOIN_FUTURES_URL + endpoint
+    send = session.post if method == "POST" else session.get
+    limiter = rate_limiter(config)
+    deadline = time.monotonic() + config.api_deadline
+    for attempt in range(1, config.api_max_retries + 1):
+        limiter.acquire(config, deadline)
+        headers = kucoin_futures_headers(config, endpoint, method)
+        try:
+            METRICS.count("requests")
+            timeout = max(min(config.api_timeout, deadline - time.monotonic()), 0.1)
+            with METRICS.stage("http"):
+                res = send(url, headers=headers, timeout=timeout)
+            limiter.observe(config, res)
+            res.raise_for_status()
+            try:
+                data = res.json()
+            except json.JSONDecodeError as e:
+                logger.error("Failed to parse JSON response: %s", e)
+                raise RuntimeError(f"Failed to parse JSON: {e}") from e
+            limiter.record(config, ok=True)
+            return data
+        except requests.exceptions.RequestException as e:
+            retryable = _retryable(e)
+            if retryable:
+                limiter.record(config, ok=False)
+            wait_time = random.uniform(0, config.api_retry_wait * 2 ** (attempt - 1))
+            if (
+                retryable
+                and attempt < config.api_max_retries
+                and time.monotonic() + wait_time < deadline
+            ):
+                logger.warning(
+                    "Request failed (attempt %s/%s): %s",
+                    attempt,
+                    config.api_max_retries,
+                    e,
+                )
+                METRICS.count("retries")
+                with METRICS.stage("retry_sleep"):
                     time.sleep(wait_time)
+            else:
+                logger.error(
+                    "Request to %s failed after %s attempts: %s",
+                    endpoint,
+                    attempt,
+                    e,
+                )
+                METRICS.count("request_failures")
+                raise RuntimeError(f"Failed to fetch {endpoint}: {e}") from e
+
+
+def fetch_futures_balance(
+    config: Config, session: Optional[requests.Session] = None
+) -> float:
+    """Retrieve the current futures account equity for ``config.currency``.
+
+    A shared ``session`` may be passed to reuse pooled connections across
+    calls; otherwise a short-lived session is created for this request.
+    """
+
+    if session is None:
+        import requests
+
+        with requests.Session() as own_session:
+            return fetch_futures_balance(config, own_session)
+
+    endpoint = f"/api/v1/account-overview?currency={config.currency}"
+    data = request_json(config, session, endpoint)
+    try:
+        return float(data["data"]["accountEquity"])
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error("Failed to parse JSON response: %s", e)
+        raise RuntimeError(f"Failed to parse JSON: {e}") from e
+
+
+def response_cache_path(config: Config) -> str:
+    """Return the shared response cache file for the profile's balance."""
+
+    folder = config.response_cache_dir or f"{config.cache_file}.responses"
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{config.account}.{config.currency}")
+    return os.path.join(folder, f"{name}.json")
+
+
+def fetch_balance_shared(
+    config: Config, session: Optional[requests.Session] = None
+) -> float:
+    """Return the account equity, reusing another process's recent answer.
+
+    Processes fetching the same account and currency take a file lock on
+    its cache entry, so one of them calls the API while the others wait and
+    reuse the result for ``config.response_ttl`` seconds. A TTL of ``0``
+    always fetches.
+    """
+
+    if config.response_ttl <= 0:
+        return fetch_futures_balance(config, session)
+
+    from filelock import FileLock
+
+    path = response_cache_path(config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = FileLock(path + ".lock")
+    with METRICS.stage("lock_wait"):
+        lock.acquire()
+    try:
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            age = time.time() - float(entry["fetched_at"])
+            if 0 <= age < config.response_ttl:
+                METRICS.count("response_cache_hits")
+                logger.debug("Reusing balance fetched %.1fs ago.", age)
+                return float(entry["balance"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring unreadable response cache %s: %s", path, e)
+        balance = fetch_futures_balance(config, session)
+        data = json.dumps({"balance": balance, "fetched_at": time.time()})
+        os.replace(_stage_note(path, data.encode()), path)
+        return balance
+    finally:
+        lock.release()
+
+
+KUCOIN_SPOT_URL = "https://api.kucoin.com"
+PRICE_ENDPOINT = "/api/v1/prices"
+SPOT_SYMBOLS = {"XBT": "BTC"}  # futures margin currency -> spot symbol
+
+
+def fetch_prices(
+    config: Config, session: requests.Session, currencies: Iterable[str]
+) -> dict[str, float]:
+    """Fetch the USD prices of ``currencies`` in one public ticker request."""
+
+    import requests
+
+    symbols = {c: SPOT_SYMBOLS.get(c, c) for c in currencies}
+    url = (
+        f"{KUCOIN_SPOT_URL}{PRICE_ENDPOINT}?base=USD"
+        f"&currencies={','.join(sorted(set(symbols.values())))}"
+    )
+    METRICS.count("requests")
+    try:
+        with METRICS.stage("http"):
+            res = session.get(url, timeout=config.api_timeout)
+        res.raise_for_status()
+        data = res.json()["data"]
+        prices = {c: float(data[symbol]) for c, symbol in symbols.items()}
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        METRICS.count("request_failures")
+        raise RuntimeError(
+            f"Failed to fetch prices for {', '.join(symbols)}: {e}"
+        ) from e
+    invalid = [c for c, price in prices.items() if price <= 0]
+    if invalid:
+        raise RuntimeError(f"No usable price for {', '.join(invalid)}")
+    return prices
+
+
+class PriceCache:
+    """Thread-safe cache of USD prices with a TTL and LRU eviction.
+
+    Prices stay fresh for ``config.price_ttl`` seconds. Missing or expired
+    prices are fetched together in one batched request while other threads
+    wait, so concurrent profiles never query the same price twice. At most
+    ``max_entries`` currencies are kept; the least recently used go first.
+    """
+
+    def __init__(self, max_entries: int = 256) -> None:
+        from collections import OrderedDict
+
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def _fresh(self, currencies: Iterable[str], ttl: float) -> dict[str, float]:
+        now = time.monotonic()
+        prices = {}
+        with self._lock:
+            for currency in currencies:
+                entry = self._entries.get(currency)
+                if entry is None:
+                    continue
+                if now - entry[1] < ttl:
+                    self._entries.move_to_end(currency)
+                    prices[currency] = entry[0]
                 else:
-                    logger.error(
-                        "Failed to fetch balance after %s attempts: %s",
-                        config.api_max_retries,
-                        e,
-                    )
-                    raise RuntimeError(f"Failed to fetch balance: {e}") from e
+                    del self._entries[currency]
+        return prices
+
+    def get_many(
+        self, config: Config, session: requests.Session, currencies: Iterable[str]
+    ) -> dict[str, float]:
+        """Return USD prices for ``currencies``, fetching only the stale ones."""
+
+        wanted = sorted(set(currencies))
+        prices = self._fresh(wanted, config.price_ttl)
+        if len(prices) < len(wanted):
+            with self._fetch_lock:
+                prices.update(self._fresh(wanted, config.price_ttl))
+                missing = [c for c in wanted if c not in prices]
+                if missing:
+                    fetched = fetch_prices(config, session, missing)
+                    now = time.monotonic()
+                    with self._lock:
+                        for currency, price in fetched.items():
+                            self._entries[currency] = (price, now)
+                            self._entries.move_to_end(currency)
+                        while len(self._entries) > self.max_entries:
+                            self._entries.popitem(last=False)
+                    prices.update(fetched)
+                    METRICS.count("price_cache_hits", len(wanted) - len(missing))
+                    return prices
+        METRICS.count("price_cache_hits", len(wanted))
+        return prices
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+PRICES = PriceCache()
+
+
+def fetch_total_balance(
+    config: Config, session: Optional[requests.Session] = None
+) -> tuple[float, dict[str, tuple[float, float]]]:
+    """Fetch every currency of the profile and total it in the base currency.
+
+    Returns the total and, per margin currency, its ``(equity, value)`` with
+    ``value`` in ``config.base_currency``. Prices come from :data:`PRICES`.
+    """
+
+    if session is None:
+        with new_session() as own_session:
+            return fetch_total_balance(config, own_session)
+
+    base = config.base_currency
+    equities = {
+        currency: fetch_balance_shared(
+            replace(config, currency=currency, base_currency=""), session
+        )
+        for currency in config.currencies or [base]
+    }
+    foreign = [c for c in equities if c != base]
+    prices = PRICES.get_many(config, session, [*foreign, base]) if foreign else {}
+    breakdown = {
+        currency: (
+            equity,
+            equity if currency == base else equity * prices[currency] / prices[base],
+        )
+        for currency, equity in equities.items()
+    }
+    return sum(value for _, value in breakdown.values()), breakdown
+
+
+def fetch_account_balance(
+    config: Config, session: Optional[requests.Session] = None
+) -> tuple[float, Optional[dict[str, tuple[float, float]]]]:
+    """Return the profile's balance and, for base-currency totals, its breakdown."""
+
+    if config.base_currency:
+        return fetch_total_balance(config, session)
+    return fetch_balance_shared(config, session), None
+
+
+def iter_transaction_history(
+    config: Config,
+    start: datetime,
+    end: datetime,
+    session: requests.Session,
+    workers: int = 1,
+) -> Iterator[dict]:
+    """Yield futures transaction records between ``start`` and ``end``.
+
+    Records are requested in windows of :data:`HISTORY_WINDOW` and paged with
+    KuCoin's ``offset`` cursor, oldest first. The first pages of up to
+    ``workers`` windows are fetched concurrently ahead of the consumer, so at
+    most ``workers`` pages are held in memory at a time. Every request goes
+    through the shared rate limiter.
+    """
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch_page(
+        window: tuple[datetime, datetime], offset: Optional[int] = None
+    ) -> dict:
+        endpoint = (
+            f"/api/v1/transaction-history?currency={config.currency}"
+            f"&startAt={int(window[0].timestamp() * 1000)}"
+            f"&endAt={int(window[1].timestamp() * 1000)}"
+            f"&maxCount={HISTORY_PAGE_SIZE}&forward=true"
+        )
+        if offset is not None:
+            endpoint += f"&offset={offset}"
+        return request_json(config, session, endpoint).get("data") or {}
+
+    def windows() -> Iterator[tuple[datetime, datetime]]:
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + HISTORY_WINDOW, end)
+            yield window_start, window_end
+            window_start = window_end
+
+    upcoming = windows()
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        pending = deque(
+            (w, pool.submit(fetch_page, w))
+            for w in itertools.islice(upcoming, max(workers, 1))
+        )
+        while pending:
+            window, first_page = pending.popleft()
+            page = first_page.result()
+            while True:
+                records = page.get("dataList") or []
+                yield from records
+                if not page.get("hasMore") or not records:
+                    break
+                page = fetch_page(window, records[-1]["offset"])
+            for window in itertools.islice(upcoming, 1):
+                pending.append((window, pool.submit(fetch_page, window)))
+
+
+def fetch_equity_history(
+    config: Config, start_date: str, end_date: str, session: requests.Session
+) -> dict[str, float]:
+    """Return closing ``accountEquity`` per day from the transaction history.
+
+    Only days with at least one transaction appear in the result.
+    """
+
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+    equity = {}
+    for record in iter_transaction_history(config, start, end, session):
+        try:
+            day = datetime.fromtimestamp(record["time"] / 1000).strftime("%Y-%m-%d")
+            equity[day] = float(record["accountEquity"])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Skipping malformed transaction record %r: %s", record, e)
+    return equity
 
 
 # ---------------------------------------------------------------------------
 # Vault file helpers
 # ---------------------------------------------------------------------------
 
+NOTE_NAME_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.md$")
+SAMPLE_NAME_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.csv$")
+NOTE_PARSE_ERRORS = (ValueError, TypeError, AttributeError)
+VAULT_LAYOUTS = ("flat", "sharded")
+SHARD_YEAR_RE = re.compile(r"^\d{4}$")
+SHARD_MONTH_RE = re.compile(r"^\d{2}$")
 
-def read_previous_balance(config: Config, date_str: str) -> float:
-    """Read the balance for the day before ``date_str`` from the vault."""
 
-    prev_date = (datetime.strptime(date_str, "%Y-%m-%d") - timedelta(days=1)).strftime(
-        "%Y-%m-%d"
-    )
-    file_path = os.path.join(
-        config.vault_path, config.balance_folder, f"{prev_date}.md"
-    )
-    if not os.path.exists(file_path):
-        logger.info("🆕 No data for %s — creating placeholder.", prev_date)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w") as f:
-            f.write(f"---\ndate: {prev_date}\nbalance: 0.00\n---\n")
-        return 0.00
+def note_path(config: Config, date_str: str, layout: Optional[str] = None) -> str:
+    """Return where ``date_str``'s note belongs in ``layout``.
+
+    ``flat`` keeps every note directly in the balance folder; ``sharded``
+    puts it under ``YYYY/MM/``. Defaults to the configured layout.
+    """
+
+    folder = os.path.join(config.vault_path, config.balance_folder)
+    if (layout or config.vault_layout) == "sharded":
+        return os.path.join(folder, date_str[:4], date_str[5:7], f"{date_str}.md")
+    return os.path.join(folder, f"{date_str}.md")
+
+
+def locate_note(config: Config, date_str: str) -> str:
+    """Return the path of ``date_str``'s note in whichever layout holds it.
+
+    Notes that have not been migrated yet are found in the other layout and
+    keep being read and rewritten there. A date without a note maps to its
+    path in the configured layout.
+    """
+
+    path = note_path(config, date_str)
+    if not os.path.exists(path):
+        for layout in VAULT_LAYOUTS:
+            other = note_path(config, date_str, layout)
+            if other != path and os.path.exists(other):
+                return other
+    return path
+
+
+def scan_notes(
+    folder: str, name_re: re.Pattern = NOTE_NAME_RE
+) -> Iterator[tuple[str, os.DirEntry]]:
+    """Yield ``(date, entry)`` for every daily note in ``folder``.
+
+    Notes directly in the folder and in ``YYYY/MM/`` shards are both found,
+    so readers work with either layout and with half-migrated folders.
+    ``name_re`` selects other dated files, such as sample sidecars.
+    """
+
+    shards = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            match = name_re.match(entry.name)
+            if match:
+                yield match.group(1), entry
+            elif SHARD_YEAR_RE.match(entry.name) and entry.is_dir():
+                shards.append(entry.path)
+    for year in shards:
+        with os.scandir(year) as entries:
+            months = [
+                e.path for e in entries if SHARD_MONTH_RE.match(e.name) and e.is_dir()
+            ]
+        for month in months:
+            with os.scandir(month) as entries:
+                for entry in entries:
+                    match = name_re.match(entry.name)
+                    if match:
+                        yield match.group(1), entry
+
+
+NOTE_HEADER_BYTES = 128
+NOTE_HEADER_RE = re.compile(
+    rb"---\ndate: \d{4}-\d{2}-\d{2}\n"
+    rb"balance: (-?(?:0|[1-9]\d*)(?:\.\d+)?)\n"
+    rb"---(?:\n|\Z)"
+)
+
+
+def read_note_balance(file_path: str) -> float:
+    """Parse the ``balance`` field from the front matter of a vault note.
+
+    Notes in the exact shape written by :func:`write_balance` are matched
+    from their first :data:`NOTE_HEADER_BYTES` bytes without touching YAML;
+    anything richer falls back to :func:`parse_note_balance`. Raises one of
+    :data:`NOTE_PARSE_ERRORS` if the note is malformed.
+    """
+
+    with open(file_path, "rb") as f:
+        header = f.read(NOTE_HEADER_BYTES)
+    match = NOTE_HEADER_RE.match(header)
+    if match and match.end() < NOTE_HEADER_BYTES:
+        return float(match.group(1))
+    return parse_note_balance(file_path)
+
+
+def parse_note_balance(file_path: str) -> float:
+    """Parse the ``balance`` field of a note with the full YAML parser.
+
+    YAML errors are re-raised as :class:`ValueError`.
+    """
+
+    import frontmatter
+    import yaml
+
     with open(file_path, "r") as f:
         content = f.read()
     try:
         post = frontmatter.loads(content)
-        if not post.metadata:
-            raise yaml.YAMLError("missing or malformed front matter")
-        return float(post.metadata.get("balance", 0.00))
-    except (yaml.YAMLError, ValueError, TypeError, AttributeError) as e:
-        logger.warning("Failed to parse balance file %s: %s", file_path, e)
-        return 0.00
-    except Exception as e:
-        logger.exception("Unexpected error reading balance file %s: %s", file_path, e)
-        raise
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid front matter: {e}") from e
+    if not post.metadata:
+        raise ValueError("missing or malformed front matter")
+    return float(post.metadata.get("balance", 0.00))
 
 
-def write_balance(config: Config, date_str: str, balance: float) -> None:
-    """Write ``balance`` for ``date_str`` to the vault markdown file."""
+def load_balance_series(
+    config: Config, start_date: str, end_date: str
+) -> dict[str, float]:
+    """Return every readable note dated ``start_date``..``end_date``, by date.
 
-    file_path = os.path.join(config.vault_path, config.balance_folder, f"{date_str}.md")
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, "w") as f:
-        f.write(f"---\ndate: {date_str}\nbalance: {balance:.2f}\n---\n")
-    logger.info("✅ Logged balance for %s: %.2f", date_str, balance)
+    The folder's :class:`BalanceIndex` is refreshed first, so only notes that
+    are new or were edited since the last run are parsed.
+    """
 
+    if not os.path.isdir(os.path.join(config.vault_path, config.balance_folder)):
+        return {}
+    with METRICS.stage("vault_read"), BalanceIndex(config) as index:
+        index.refresh()
+        return dict(index.series(start_date, end_date))
 
-# ---------------------------------------------------------------------------
-# Cache control
-# ---------------------------------------------------------------------------
 
+def _fsync_dir(path: str) -> None:
+    """Make renames in directory ``path`` durable where the OS allows it."""
 
-def already_logged(config: Config, date_str: str) -> bool:
-    """Return ``True`` if ``date_str`` has already been logged today."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # e.g. directories cannot be opened on Windows
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
-    if date_str != config.today:
-        return False
-    lock = FileLock(config.cache_file + ".lock")
-    with lock:
-        if not os.path.exists(config.cache_file):
-            return False
-        try:
-            with open(config.cache_file, "r") as f:
-                data = json.load(f)
-            return data.get("last_logged_date") == date_str
-        except (OSError, json.JSONDecodeError, AttributeError) as e:
-            logger.warning("Failed to read cache file %s: %s", config.cache_file, e)
-            return False
-        except Exception as e:
-            logger.exception(
-                "Unexpected error accessing cache file %s: %s", config.cache_file, e
-            )
-            raise
 
+@functools.lru_cache(maxsize=None)
+def _new_file_mode() -> int:
+    """Return the mode ``open()`` would give a new file under the umask.
 
-def mark_logged(config: Config, date_str: str) -> None:
-    """Record in the cache file that ``date_str`` has been logged."""
+    The umask can only be read by setting it, so this is done once.
+    """
 
-    if date_str != config.today:
-        return
-    lock = FileLock(config.cache_file + ".lock")
-    with lock:
-        cache_dir = os.path.dirname(config.cache_file) or "."
-        os.makedirs(cache_dir, exist_ok=True)
-        tmp_file = config.cache_file + ".tmp"
-        with open(tmp_file, "w") as f:
-            json.dump({"last_logged_date": date_str}, f)
-            f.flush()
-            os.fsync(f.fileno())
-        os.replace(tmp_file, config.cache_file)
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
 
 
-# ---------------------------------------------------------------------------
-# Main entry point
-# ---------------------------------------------------------------------------
+def _stage_note(path: str, data: bytes) -> str:
+    """Write ``data`` to a hidden temporary file next to ``path``.
 
+    ``mkstemp`` creates the file owner-only, so it takes the mode of the file
+    it will replace, or the umask's default for a new file, before the rename.
+    """
 
-def main(argv: Optional[list[str]] = None) -> None:
-    """Command line entry point for balance logging."""
+    import stat
+    import tempfile
 
-    setup_logging()
+    folder, name = os.path.split(path)
+    os.makedirs(folder, exist_ok=True)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = _new_file_mode()
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=f".{name}.", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, mode)
+    return tmp
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--date", help="Override date for backfill (YYYY-MM-DD)")
-    parser.add_argument("--cache-file", help="Override cache file location")
-    args = parser.parse_args(argv)
 
-    config = load_config()
-    if args.cache_file:
-        config.cache_file = os.path.expanduser(args.cache_file)
+def note_unchanged(path: str, data: bytes) -> bool:
+    """Return ``True`` if the file at ``path`` already holds exactly ``data``."""
 
-    target_date = args.date if args.date else config.today
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except FileNotFoundError:
+        return False
 
-    if already_logged(config, target_date):
-        logger.warning("🟡 Already logged today — skipping.")
-        return
 
-    try:
-        balance = fetch_futures_balance(config)
-        previous_balance = read_previous_balance(config, target_date)
-        write_balance(config, target_date, balance)
-        mark_logged(config, target_date)
-
-        change = balance - previous_balance
-        pct = (change / previous_balance) * 100 if previous_balance != 0 else 0
-        symbol = "📈" if change > 0 else "📉" if change < 0 else "🔁"
-        logger.info(
-            "%s Change since previous day: %+0.2f (%+0.2f%%)",
-            symbol,
-            change,
-            pct,
-        )
-    except Exception as e:
-        logger.exception("❌ Error: %s", e)
-        raise
+class NoteBatch:
+    """Stage many note writes and make them durable together.
+
+    Notes are written to temporary files and only renamed into place by
+    :meth:`commit`, which fsyncs the staged files first and then each
+    directory once instead of once per note. Callbacks registered with
+    :meth:`on_commit` run after the renames. Leaving the ``with`` block on an
+    exception discards the staged files.
+    """
+
+    def __init__(self) -> None:
+        self.pending: list[tuple[str, str]] = []
+        self.callbacks: list[Callable[[], None]] = []
+
+    def __enter__(self) -> NoteBatch:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def write(self, path: str, data: bytes) -> None:
+        self.pending.append((_stage_note(path, data), path))
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        self.callbacks.append(callback)
+
+    def commit(self) -> None:
+        pending, self.pending = self.pending, []
+        callbacks, self.callbacks = self.callbacks, []
+        try:
+            for tmp, _ in pending:
+                with open(tmp, "rb") as f:
+                    os.fsync(f.fileno())
+            for tmp, path in pending:
+                os.replace(tmp, path)
+        except BaseException:
+            self.pending = pending
+            self.discard()
+            raise
+        finally:
+            _forget_note_dates(path for _, path in pending)
+        for folder in {os.path.dirname(path) for _, path in pending}:
+            _fsync_dir(folder)
+        for callback in callbacks:
+            callback()
+
+    def discard(self) -> None:
+        for tmp, _ in self.pending:
+            with suppress(FileNotFoundError):
+                os.remove(tmp)
+        self.pending = []
+        self.callbacks = []
+
+
+def write_note(path: str, data: bytes, batch: Optional[NoteBatch] = None) -> bool:
+    """Atomically replace the note at ``path`` unless it already holds ``data``.
+
+    Returns ``False`` without touching the file when the content is
+    identical, so re-runs do not trigger re-indexing or vault sync. With a
+    ``batch`` the write is staged until the batch commits.
+    """
+
+    if note_unchanged(path, data):
+        METRICS.count("notes_unchanged")
+        return False
+    METRICS.count("notes_written")
+    if batch is not None:
+        batch.write(path, data)
+        return True
+    tmp = _stage_note(path, data)
+    try:
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    _forget_note_dates([path])
+    _fsync_dir(os.path.dirname(path))
+    return True
+
+
+NOTE_LISTING_TTL = 60.0
+_NOTE_DATES: dict[str, tuple[float, list[str]]] = {}
+_NOTE_DATES_LOCK = threading.Lock()
+
+
+def note_dates(folder: str) -> list[str]:
+    """Return the sorted dates of the daily notes in ``folder``.
+
+    The listing is cached for :data:`NOTE_LISTING_TTL` seconds, so runs
+    looking up many dates list the folder once. Notes written by this
+    process drop the cached listing at once; notes created by other
+    processes show up once the entry expires. (The directory's mtime cannot
+    be used: the balance index's WAL files change it on every connection.)
+    """
+
+    now = time.monotonic()
+    with _NOTE_DATES_LOCK:
+        cached = _NOTE_DATES.get(folder)
+        if cached and now - cached[0] < NOTE_LISTING_TTL:
+            return cached[1]
+    try:
+        dates = sorted({date_str for date_str, _ in scan_notes(folder)})
+    except FileNotFoundError:
+        return []
+    with _NOTE_DATES_LOCK:
+        _NOTE_DATES[folder] = (now, dates)
+    return dates
+
+
+def _forget_note_dates(paths: Iterable[str]) -> None:
+    """Drop the cached listings of the folders holding ``paths``.
+
+    A note in a ``YYYY/MM/`` shard invalidates its balance folder's listing.
+    """
+
+    with _NOTE_DATES_LOCK:
+        for path in paths:
+            parent = os.path.dirname(path)
+            for folder in [
+                f for f in _NOTE_DATES if parent == f or parent.startswith(f + os.sep)
+            ]:
+                del _NOTE_DATES[folder]
+
+
+@METRICS.timed("vault_read")
+def read_previous_balance(config: Config, date_str: str) -> float:
+    """Return the balance of the latest note dated before ``date_str``.
+
+    The note is found by bisecting the cached folder listing, so gaps such
+    as a weekend outage are skipped without probing each day. Placeholder
+    (zero) and malformed notes are passed over. Returns ``0.00`` if there
+    is no earlier balance; no files are created.
+    """
+
+    import bisect
+
+    folder = os.path.join(config.vault_path, config.balance_folder)
+    dates = note_dates(folder)
+    yesterday = datetime.strptime(date_str, "%Y-%m-%d") - timedelta(days=1)
+    with BalanceIndex(config) as index:
+        for i in range(bisect.bisect_left(dates, date_str) - 1, -1, -1):
+            prev_date = dates[i]
+            file_path = locate_note(config, prev_date)
+            try:
+                balance = index.lookup(prev_date)
+            except NOTE_PARSE_ERRORS as e:
+                logger.warning("Failed to parse balance file %s: %s", file_path, e)
+                continue
+            except Exception as e:
+                logger.exception(
+                    "Unexpected error reading balance file %s: %s", file_path, e
+                )
+                raise
+            if balance:
+                if prev_date != yesterday.strftime("%Y-%m-%d"):
+                    logger.info("🕳 No notes since %s — comparing with it.", prev_date)
+                return balance
+    logger.info("🆕 No balance before %s.", date_str)
+    return 0.00
+
+
+@METRICS.timed("vault_write")
+def write_balance(
+    config: Config,
+    date_str: str,
+    balance: float,
+    index: Optional[BalanceIndex] = None,
+    batch: Optional[NoteBatch] = None,
+    breakdown: Optional[dict[str, tuple[float, float]]] = None,
+) -> None:
+    """Write ``balance`` for ``date_str`` to the vault markdown file.
+
+    A note that already holds this balance is left untouched. Otherwise the
+    folder's :class:`BalanceIndex` and the date's roll-up notes are updated
+    as well; pass an open ``index`` and a :class:`NoteBatch` when writing many
+    notes to reuse one connection and fsync them together, then call
+    :func:`update_rollups` once for all dates. A ``breakdown`` from
+    :func:`fetch_total_balance` adds the base currency and each currency's
+    equity and value to the front matter.
+    """
+
+    file_path = locate_note(config, date_str)
+    text = f"---\ndate: {date_str}\nbalance: {balance:.2f}\n"
+    if breakdown:
+        text += f"base_currency: {config.base_currency}\ncurrencies:\n"
+        for currency, (equity, value) in sorted(breakdown.items()):
+            text += f"  {currency}: {{equity: {equity:.8f}, value: {value:.2f}}}\n"
+    data = (text + "---\n").encode()
+    if not write_note(file_path, data, batch):
+        logger.info("✅ Balance for %s already logged: %.2f", date_str, balance)
+        return
+    index_balance(config, date_str, float(f"{balance:.2f}"), index, batch)
+    logger.info("✅ Logged balance for %s: %.2f", date_str, balance)
+
+
+def index_balance(
+    config: Config,
+    date_str: str,
+    balance: float,
+    index: Optional[BalanceIndex] = None,
+    batch: Optional[NoteBatch] = None,
+) -> None:
+    """Record a freshly written note's ``balance`` in the index and roll-ups.
+
+    With a ``batch`` this happens once the batch commits, and roll-ups are
+    left to the caller's :func:`update_rollups`.
+    """
+
+    import sqlite3
+
+    def record() -> None:
+        try:
+            if index is not None:
+                index.record(date_str, balance)
+                if batch is None:
+                    update_rollups(config, [date_str], index)
+            else:
+                with BalanceIndex(config) as own_index:
+                    own_index.record(date_str, balance)
+                    update_rollups(config, [date_str], own_index)
+        except sqlite3.Error as e:
+            logger.warning("Failed to update balance index for %s: %s", date_str, e)
+
+    if batch is not None:
+        batch.on_commit(record)
+    else:
+        record()
+
+
+# ---------------------------------------------------------------------------
+# Balance index
+# ---------------------------------------------------------------------------
+
+LEGACY_INDEX_NAME = ".balance-index.sqlite3"
+
+
+def index_path(config: Config) -> str:
+    """Return the balance index database for the profile's balance folder.
+
+    Indexes live next to the ledger, outside the vault, so sync tools never
+    copy a live SQLite file. The name pairs the folder's base name with a
+    hash of its absolute path, keeping one index per folder.
+    """
+
+    import hashlib
+
+    folder = os.path.realpath(os.path.join(config.vault_path, config.balance_folder))
+    digest = hashlib.sha256(folder.encode()).hexdigest()[:16]
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(folder))
+    return os.path.join(f"{config.cache_file}.index", f"{name}-{digest}.sqlite3")
+
+
+class BalanceIndex:
+    """SQLite index of note dates, balances and file stats for one folder.
+
+    Each row remembers the ``mtime_ns`` and size of the note it was parsed
+    from, so notes edited by hand are detected with a ``stat`` and re-parsed
+    on their own. Date lookups use the table's primary key. The index is a
+    cache kept at :func:`index_path`: deleting it only costs one full
+    re-scan.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.folder = os.path.join(config.vault_path, config.balance_folder)
+        self.path = index_path(config)
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def __enter__(self) -> BalanceIndex:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            import sqlite3
+
+            os.makedirs(self.folder, exist_ok=True)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS notes ("
+                "date TEXT PRIMARY KEY, balance REAL, "
+                "mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._conn = conn
+            # Older versions kept the index inside the balance folder.
+            for suffix in ("", "-wal", "-shm"):
+                with suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.folder, LEGACY_INDEX_NAME + suffix))
+        return self._conn
+
+    def _note_path(self, date_str: str) -> str:
+        return locate_note(self.config, date_str)
+
+    def _store(self, date_str: str, balance: Optional[float], st) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?)",
+            (date_str, balance, st.st_mtime_ns, st.st_size),
+        )
+
+    def record(self, date_str: str, balance: float) -> None:
+        """Store ``balance`` for a note that was just written."""
+
+        with self.conn:
+            self._store(date_str, balance, os.stat(self._note_path(date_str)))
+
+    def lookup(self, date_str: str) -> Optional[float]:
+        """Return the balance of the note for ``date_str``, or ``None``.
+
+        The note is re-parsed only if its file changed since it was indexed;
+        parse errors propagate as one of :data:`NOTE_PARSE_ERRORS`.
+        """
+
+        file_path = self._note_path(date_str)
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            with self.conn:
+                self.conn.execute("DELETE FROM notes WHERE date = ?", (date_str,))
+            return None
+        row = self.conn.execute(
+            "SELECT balance, mtime_ns, size FROM notes WHERE date = ?", (date_str,)
+        ).fetchone()
+        if row and row[0] is not None and row[1:] == (st.st_mtime_ns, st.st_size):
+            return row[0]
+        try:
+            balance = read_note_balance(file_path)
+        except NOTE_PARSE_ERRORS:
+            with self.conn:
+                self._store(date_str, None, st)
+            raise
+        with self.conn:
+            self._store(date_str, balance, st)
+        return balance
+
+    def refresh(self) -> None:
+        """Re-parse notes added or edited since the last refresh.
+
+        Unchanged notes cost one ``stat``; deleted notes are dropped.
+        Malformed notes are logged once and stored without a balance.
+        """
+
+        indexed = {
+            date: (mtime_ns, size)
+            for date, mtime_ns, size in self.conn.execute(
+                "SELECT date, mtime_ns, size FROM notes"
+            )
+        }
+        with self.conn:
+            for date_str, entry in scan_notes(self.folder):
+                st = entry.stat()
+                if indexed.pop(date_str, None) == (st.st_mtime_ns, st.st_size):
+                    continue
+                try:
+                    balance = read_note_balance(entry.path)
+                except NOTE_PARSE_ERRORS as e:
+                    logger.warning("Failed to parse balance file %s: %s", entry.path, e)
+                    balance = None
+                self._store(date_str, balance, st)
+            self.conn.executemany(
+                "DELETE FROM notes WHERE date = ?", [(d,) for d in indexed]
+            )
+
+    def iter_series(
+        self, start_date: str, end_date: str
+    ) -> Iterator[tuple[str, float]]:
+        """Yield indexed ``(date, balance)`` pairs in the range, by date.
+
+        Rows are read from the cursor one at a time, so memory stays
+        constant however long the history is.
+        """
+
+        yield from self.conn.execute(
+            "SELECT date, balance FROM notes WHERE date BETWEEN ? AND ? "
+            "AND balance IS NOT NULL ORDER BY date",
+            (start_date, end_date),
+        )
+
+    def series(self, start_date: str, end_date: str) -> list[tuple[str, float]]:
+        """Return indexed ``(date, balance)`` pairs in the range, by date."""
+
+        return list(self.iter_series(start_date, end_date))
+
+
+# ---------------------------------------------------------------------------
+# Cache control
+# ---------------------------------------------------------------------------
+
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+class LoggedLedger:
+    """Append-only SQLite ledger of logged ``(account, currency, date)`` keys.
+
+    The database runs in WAL mode with ``synchronous=FULL``: every insert is
+    an atomic, durable commit of just the new rows, preserving the crash
+    safety of the former temp-file-and-rename cache without rewriting it.
+    A legacy ``{"last_logged_date": ...}`` JSON cache found at ``path``, or
+    at ``legacy_path`` while ``path`` does not exist yet, is imported once
+    under ``legacy_key`` and kept as ``<cache>.legacy``. ``timeout`` is how
+    long a write waits for another writer's lock.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        legacy_key: tuple[str, str] = ("default", "USDT"),
+        timeout: float = 30.0,
+        legacy_path: Optional[str] = None,
+    ):
+        self.path = path
+        self.legacy_key = legacy_key
+        self.timeout = timeout
+        self.legacy_path = legacy_path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def __enter__(self) -> LoggedLedger:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            import sqlite3
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            legacy = self._migrate_legacy()
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS logged ("
+                "account TEXT NOT NULL, currency TEXT NOT NULL, date TEXT NOT NULL, "
+                "logged_at REAL NOT NULL, PRIMARY KEY (account, currency, date)"
+                ") WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS claims ("
+                "account TEXT NOT NULL, currency TEXT NOT NULL, date TEXT NOT NULL, "
+                "owner TEXT NOT NULL, claimed_at REAL NOT NULL, "
+                "PRIMARY KEY (account, currency, date)"
+                ") WITHOUT ROWID"
+            )
+            self._conn = conn
+            if legacy:
+                self.add(*legacy)
+        return self._conn
+
+    def _migrate_legacy(self) -> Optional[tuple[str, str, list[str]]]:
+        """Move a legacy JSON cache aside and return its entry, if any."""
+
+        source = self.path
+        if self.legacy_path and not os.path.exists(self.path):
+            source = self.legacy_path
+        try:
+            with open(source, "rb") as f:
+                header = f.read(len(SQLITE_HEADER))
+        except FileNotFoundError:
+            return None
+        if not header or header == SQLITE_HEADER:
+            return None
+
+        from filelock import FileLock
+
+        lock = FileLock(self.path + ".lock")
+        with METRICS.stage("lock_wait"):
+            lock.acquire()
+        try:
+            with open(source, "rb") as f:
+                raw = f.read()
+            if raw.startswith(SQLITE_HEADER):
+                return None
+            os.replace(source, source + ".legacy")
+        except FileNotFoundError:
+            return None  # another process migrated first
+        finally:
+            lock.release()
+        try:
+            date_str = json.loads(raw).get("last_logged_date")
+        except (ValueError, AttributeError) as e:
+            logger.warning("Failed to read cache file %s: %s", source, e)
+            return None
+        if not date_str:
+            return None
+        logger.info("Imported legacy cache entry %s from %s", date_str, source)
+        return (*self.legacy_key, [date_str])
+
+    def contains(self, account: str, currency: str, date_str: str) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM logged WHERE account = ? AND currency = ? AND date = ?",
+            (account, currency, date_str),
+        ).fetchone()
+        return row is not None
+
+    def claim(
+        self,
+        account: str,
+        currency: str,
+        date_str: str,
+        owner: str,
+        force: bool = False,
+    ) -> bool:
+        """Atomically claim a date for ``owner``; return ``False`` if taken.
+
+        A single upsert decides the race, so there is no window between
+        checking and claiming. The claim fails if the date is already logged
+        (unless ``force``) or held by another owner, except that claims older
+        than :data:`CLAIM_STALE_SECONDS` (a crashed run) are taken over.
+        """
+
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO claims (account, currency, date, owner, claimed_at) "
+            "SELECT ?, ?, ?, ?, ? WHERE ? OR NOT EXISTS ("
+            "SELECT 1 FROM logged WHERE account = ? AND currency = ? AND date = ?) "
+            "ON CONFLICT (account, currency, date) DO UPDATE SET "
+            "owner = excluded.owner, claimed_at = excluded.claimed_at "
+            "WHERE claims.claimed_at < ?",
+            (account, currency, date_str, owner, now, force)
+            + (account, currency, date_str, now - CLAIM_STALE_SECONDS),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, account: str, currency: str, date_str: str, owner: str) -> None:
+        """Drop ``owner``'s claim on a date, if it still holds it."""
+
+        self.conn.execute(
+            "DELETE FROM claims "
+            "WHERE account = ? AND currency = ? AND date = ? AND owner = ?",
+            (account, currency, date_str, owner),
+        )
+
+    def add(self, account: str, currency: str, dates: Iterable[str]) -> None:
+        """Append ``dates`` for ``account``/``currency`` in one transaction."""
+
+        now = time.time()
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO logged VALUES (?, ?, ?, ?)",
+                [(account, currency, d, now) for d in dates],
+            )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Hold the ledger's write lock; nested calls join the outer one."""
+
+        if self.conn.in_transaction:
+            yield
+            return
+        with METRICS.stage("lock_wait"):
+            self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+
+def legacy_cache_file(config: Config) -> Optional[str]:
+    """Return the old default JSON cache if ``config`` uses the default ledger.
+
+    Installs that never set a cache location kept their JSON cache at
+    :data:`LEGACY_CACHE_FILE`, not at the ledger's path, so it has to be
+    looked up separately to be imported.
+    """
+
+    if config.cache_file != os.path.expanduser(DEFAULT_CACHE_FILE):
+        return None
+    return os.path.expanduser(LEGACY_CACHE_FILE)
+
+
+def open_ledger(config: Config, timeout: float = 30.0) -> LoggedLedger:
+    """Return the ledger stored at ``config.cache_file``."""
+
+    return LoggedLedger(
+        config.cache_file,
+        (config.account, config.currency),
+        timeout,
+        legacy_cache_file(config),
+    )
+
+
+@METRICS.timed("ledger")
+def already_logged(config: Config, date_str: str) -> bool:
+    """Return ``True`` if ``date_str`` is in the ledger for this profile."""
+
+    import sqlite3
+
+    legacy = legacy_cache_file(config)
+    if not os.path.exists(config.cache_file) and not (
+        legacy and os.path.exists(legacy)
+    ):
+        return False
+    try:
+        with open_ledger(config) as ledger:
+            return ledger.contains(config.account, config.currency, date_str)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Failed to read cache file %s: %s", config.cache_file, e)
+        return False
+
+
+@METRICS.timed("ledger")
+def mark_logged(config: Config, date_str: str) -> None:
+    """Record in the ledger that ``date_str`` has been logged."""
+
+    with open_ledger(config) as ledger:
+        ledger.add(config.account, config.currency, [date_str])
+
+
+CLAIM_STALE_SECONDS = 300.0
+CLAIM_BUSY_TIMEOUT = 0.5
+CLAIM_BUSY_DEADLINE = 60.0
+CLAIM_MAX_BACKOFF = 5.0
+
+
+@contextmanager
+def claim_date(config: Config, date_str: str, force: bool = False) -> Iterator[bool]:
+    """Claim ``date_str`` for this run without waiting on other runs.
+
+    Yields ``True`` to the one run that may fetch, write and mark the date,
+    and ``False`` at once to overlapping runs. A ledger locked by another
+    writer is not a lost claim: the claim is retried with backoff for up to
+    :data:`CLAIM_BUSY_DEADLINE` seconds, then ``RuntimeError`` is raised.
+    The claim is released on exit, after the winner has marked the date.
+    """
+
+    import sqlite3
+    import uuid
+
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + CLAIM_BUSY_DEADLINE
+    delay = CLAIM_BUSY_TIMEOUT
+    while True:
+        try:
+            with METRICS.stage("ledger"), open_ledger(
+                config, CLAIM_BUSY_TIMEOUT
+            ) as ledger:
+                claimed = ledger.claim(
+                    config.account, config.currency, date_str, owner, force
+                )
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            if time.monotonic() + delay > deadline:
+                raise RuntimeError(
+                    f"Ledger {config.cache_file} stayed busy, "
+                    f"could not claim {date_str}: {e}"
+                ) from e
+            METRICS.count("claim_retries")
+            logger.info("Ledger busy, retrying claim of %s in %.1fs", date_str, delay)
+            time.sleep(delay)
+            delay = min(delay * 2, CLAIM_MAX_BACKOFF)
+    if not claimed:
+        METRICS.count("claims_lost")
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        with METRICS.stage("ledger"), open_ledger(config) as ledger:
+            ledger.release(config.account, config.currency, date_str, owner)
+
+
+# ---------------------------------------------------------------------------
+# Transaction history
+# ---------------------------------------------------------------------------
+
+TRANSACTION_LOOKBACK = timedelta(days=365)
+TRANSACTION_CHUNK = 500
+TRANSACTION_FIELDS = (
+    "offset",
+    "time",
+    "type",
+    "amount",
+    "fee",
+    "accountEquity",
+    "status",
+    "remark",
+)
+
+
+class TransactionStore:
+    """Append-only store of futures transaction records in the ledger database.
+
+    Records are keyed by account, currency and KuCoin's ``offset``, so pages
+    fetched twice are ignored. A per-profile cursor holds the time of the
+    newest stored record and is advanced in the same transaction as the
+    records, so it never points past data that was not saved.
+    """
+
+    def __init__(self, ledger: LoggedLedger):
+        self.ledger = ledger
+        self.conn = ledger.conn
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transactions ("
+            "account TEXT NOT NULL, currency TEXT NOT NULL, "
+            "offset INTEGER NOT NULL, time INTEGER NOT NULL, type TEXT, "
+            "amount REAL, fee REAL, account_equity REAL, status TEXT, remark TEXT, "
+            "PRIMARY KEY (account, currency, offset)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transaction_cursor ("
+            "account TEXT NOT NULL, currency TEXT NOT NULL, time INTEGER NOT NULL, "
+            "PRIMARY KEY (account, currency)"
+            ") WITHOUT ROWID"
+        )
+
+    def cursor(self, account: str, currency: str) -> Optional[int]:
+        """Return the time in ms of the newest stored record, if any."""
+
+        row = self.conn.execute(
+            "SELECT time FROM transaction_cursor WHERE account = ? AND currency = ?",
+            (account, currency),
+        ).fetchone()
+        return row[0] if row else None
+
+    def append(self, account: str, currency: str, records: Iterable[dict]) -> int:
+        """Store ``records`` in chunks of :data:`TRANSACTION_CHUNK`.
+
+        ``records`` may be a generator; only one chunk is held in memory.
+        Returns the number of new records.
+        """
+
+        added = 0
+        records = iter(records)
+        while True:
+            chunk = list(itertools.islice(records, TRANSACTION_CHUNK))
+            if not chunk:
+                return added
+            rows = []
+            for record in chunk:
+                try:
+                    values = [record.get(name) for name in TRANSACTION_FIELDS]
+                    values[0], values[1] = int(values[0]), int(values[1])
+                except (TypeError, ValueError) as e:
+                    logger.warning("Skipping malformed transaction %r: %s", record, e)
+                    continue
+                rows.append((account, currency, *values))
+            if not rows:
+                continue
+            with self.ledger.transaction():
+                before = self.conn.total_changes
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO transactions VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                added += self.conn.total_changes - before
+                self.conn.execute(
+                    "INSERT INTO transaction_cursor VALUES (?, ?, ?) "
+                    "ON CONFLICT (account, currency) "
+                    "DO UPDATE SET time = max(time, excluded.time)",
+                    (account, currency, max(row[3] for row in rows)),
+                )
+
+    def daily_equity(
+        self, account: str, currency: str, start_date: str, end_date: str
+    ) -> dict[str, float]:
+        """Return the closing ``accountEquity`` per local day in the range."""
+
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+        rows = self.conn.execute(
+            "SELECT time, account_equity FROM transactions "
+            "WHERE account = ? AND currency = ? AND time >= ? AND time < ? "
+            "AND account_equity IS NOT NULL ORDER BY time",
+            (
+                account,
+                currency,
+                int(start.timestamp() * 1000),
+                int(end.timestamp() * 1000),
+            ),
+        )
+        return {
+            datetime.fromtimestamp(t / 1000).strftime("%Y-%m-%d"): equity
+            for t, equity in rows
+        }
+
+    def totals(
+        self, account: str, currency: str, start_ms: int = 0
+    ) -> dict[str, float]:
+        """Return the summed ``amount`` per transaction type since ``start_ms``."""
+
+        return dict(
+            self.conn.execute(
+                "SELECT type, sum(amount) FROM transactions "
+                "WHERE account = ? AND currency = ? AND time >= ? GROUP BY type",
+                (account, currency, start_ms),
+            ).fetchall()
+        )
+
+
+def sync_transactions(
+    config: Config,
+    session: Optional[requests.Session] = None,
+    since: Optional[str] = None,
+) -> int:
+    """Fetch transaction records newer than the stored cursor.
+
+    Without a cursor, history starts at ``since`` (``YYYY-MM-DD``) or
+    :data:`TRANSACTION_LOOKBACK` ago. Records are streamed from the paged
+    API straight into the :class:`TransactionStore`. Returns the number of
+    new records.
+    """
+
+    if session is None:
+        with new_session(config.max_workers) as own_session:
+            return sync_transactions(config, own_session, since)
+
+    with open_ledger(config) as ledger:
+        store = TransactionStore(ledger)
+        cursor = store.cursor(config.account, config.currency)
+        if cursor is not None:
+            start = datetime.fromtimestamp(cursor / 1000)
+        elif since:
+            start = datetime.strptime(since, "%Y-%m-%d")
+        else:
+            start = datetime.now() - TRANSACTION_LOOKBACK
+        records = iter_transaction_history(
+            config, start, datetime.now(), session, workers=config.max_workers
+        )
+        added = store.append(config.account, config.currency, records)
+        totals = store.totals(
+            config.account, config.currency, int(start.timestamp() * 1000)
+        )
+    transfers = sum(v or 0.0 for k, v in totals.items() if k != "RealisedPNL")
+    logger.info(
+        "🧾 %s/%s: %s new transactions since %s (realised PnL %+.2f, other %+.2f)",
+        config.account,
+        config.currency,
+        added,
+        start.strftime("%Y-%m-%d"),
+        totals.get("RealisedPNL") or 0.0,
+        transfers,
+    )
+    return added
+
+
+# ---------------------------------------------------------------------------
+# Intraday sampling
+# ---------------------------------------------------------------------------
+
+SAMPLES_DIR = ".samples"
+
+
+@dataclass
+class DailySummary:
+    """Open/high/low/close and deepest drawdown of one day's samples."""
+
+    open: float
+    high: float
+    low: float
+    close: float
+    min_drawdown: float
+    samples: int
+
+
+def sample_path(config: Config, date_str: str, layout: Optional[str] = None) -> str:
+    """Return where ``date_str``'s sidecar CSV of samples belongs in ``layout``.
+
+    Sidecars live under ``.samples/`` in the balance folder, sharded into
+    ``YYYY/MM/`` like the notes when the layout is ``sharded``.
+    """
+
+    folder = os.path.join(config.vault_path, config.balance_folder, SAMPLES_DIR)
+    if (layout or config.vault_layout) == "sharded":
+        return os.path.join(folder, date_str[:4], date_str[5:7], f"{date_str}.csv")
+    return os.path.join(folder, f"{date_str}.csv")
+
+
+def locate_sample(config: Config, date_str: str) -> str:
+    """Return the path of ``date_str``'s sidecar in whichever layout holds it."""
+
+    path = sample_path(config, date_str)
+    if not os.path.exists(path):
+        for layout in VAULT_LAYOUTS:
+            other = sample_path(config, date_str, layout)
+            if other != path and os.path.exists(other):
+                return other
+    return path
+
+
+@METRICS.timed("vault_write")
+def append_sample(
+    config: Config, date_str: str, timestamp: float, equity: float
+) -> None:
+    """Append one ``timestamp,equity`` line to the day's sidecar file."""
+
+    path = locate_sample(config, date_str)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(f"{int(timestamp)},{equity:.10g}\n")
+
+
+def summarize_samples(path: str) -> Optional[DailySummary]:
+    """Stream a sidecar file into a :class:`DailySummary` in constant memory.
+
+    ``min_drawdown`` is the deepest fall from the running high, in percent
+    (``0`` or negative). Truncated lines from an interrupted write are
+    skipped. Returns ``None`` if the file holds no samples.
+    """
+
+    summary = None
+    peak = 0.0
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return None
+    with f:
+        for line in f:
+            if not line.endswith("\n"):
+                continue
+            try:
+                _, value = line.split(",")
+                equity = float(value)
+            except ValueError:
+                continue
+            if summary is None:
+                summary = DailySummary(equity, equity, equity, equity, 0.0, 0)
+                peak = equity
+            summary.high = max(summary.high, equity)
+            summary.low = min(summary.low, equity)
+            summary.close = equity
+            summary.samples += 1
+            peak = max(peak, equity)
+            if peak > 0:
+                drawdown = (equity - peak) / peak * 100
+                summary.min_drawdown = min(summary.min_drawdown, drawdown)
+    return summary
+
+
+def rollup_day(config: Config, date_str: str) -> Optional[DailySummary]:
+    """Write the day's sample summary into its note's front matter.
+
+    Existing front matter fields and note body are kept. A note is created
+    with :func:`write_balance`, with the opening equity as its balance, if
+    none exists yet; either way the balance index stays current.
+    """
+
+    import frontmatter
+    import yaml
+
+    summary = summarize_samples(locate_sample(config, date_str))
+    if summary is None:
+        return None
+    file_path = locate_note(config, date_str)
+    if not os.path.exists(file_path):
+        write_balance(config, date_str, summary.open)
+    try:
+        post = frontmatter.load(file_path)
+        balance = float(post["balance"])
+    except (yaml.YAMLError, UnicodeDecodeError, *NOTE_PARSE_ERRORS, KeyError) as e:
+        logger.warning("Skipping roll-up, cannot parse %s: %s", file_path, e)
+        return None
+    post.metadata.update(
+        open=round(summary.open, 2),
+        high=round(summary.high, 2),
+        low=round(summary.low, 2),
+        close=round(summary.close, 2),
+        min_drawdown=round(summary.min_drawdown, 2),
+        samples=summary.samples,
+    )
+    with METRICS.stage("vault_write"):
+        data = (frontmatter.dumps(post, sort_keys=False) + "\n").encode()
+        if write_note(file_path, data):
+            index_balance(config, date_str, balance)
+    logger.info(
+        "📊 Rolled up %s samples for %s: O %.2f H %.2f L %.2f C %.2f DD %.2f%%",
+        summary.samples,
+        date_str,
+        summary.open,
+        summary.high,
+        summary.low,
+        summary.close,
+        summary.min_drawdown,
+    )
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Analytics
+# ---------------------------------------------------------------------------
+
+SUMMARY_NOTE = "Summary.md"
+PERIODS_PER_YEAR = 365  # crypto futures trade every day
+ROLLING_WINDOWS = (7, 30, 90)
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SystemExit(
+            "--analytics requires NumPy: "
+            "pip install obsidian-trading-balance-fetcher[analytics]"
+        ) from None
+    return numpy
+
+
+@dataclass
+class Analytics:
+    """Statistics and chart curves computed from one balance history."""
+
+    stats: dict[str, object]
+    valid: numpy.ndarray  # mask of input balances that were used
+    drawdown: numpy.ndarray  # percent below the running peak, per used balance
+    # percent return over each of ROLLING_WINDOWS days, per used balance
+    # (NaN until the window is full)
+    rolling: dict[int, numpy.ndarray]
+
+
+def compute_analytics(balances: Iterable[float]) -> Analytics:
+    """Return performance statistics for a chronological balance series.
+
+    Every statistic is computed with whole-array NumPy operations in one pass
+    over the history. Non-positive balances (placeholders, empty accounts)
+    are dropped. Percentages are in percent; volatility, Sharpe and Sortino
+    ratios are annualised over :data:`PERIODS_PER_YEAR` daily returns.
+    Statistics that need more history than available are ``None``.
+    """
+
+    np = _import_numpy()
+
+    values = np.fromiter(balances, dtype=float)
+    valid = values > 0
+    b = values[valid]
+    peak = np.maximum.accumulate(b) if b.size else b
+    drawdown = (b / peak - 1) * 100
+    stats: dict[str, object] = {
+        "days": int(b.size),
+        "balance": float(b[-1]) if b.size else None,
+    }
+    rolling = {}
+    for window in ROLLING_WINDOWS:
+        rolling[window] = np.full(b.size, np.nan)
+        rolling[window][window:] = (b[window:] / b[:-window] - 1) * 100
+    result = Analytics(stats, valid, drawdown, rolling)
+    if b.size < 2:
+        return result
+
+    returns = b[1:] / b[:-1] - 1
+    std = returns.std(ddof=1) if returns.size > 1 else 0.0
+    downside = np.minimum(returns, 0)
+    downside_std = np.sqrt(np.mean(downside**2))
+    scale = np.sqrt(PERIODS_PER_YEAR)
+
+    signs = np.sign(returns)
+    starts = np.flatnonzero(np.r_[True, signs[1:] != signs[:-1]])
+    lengths = np.diff(np.r_[starts, signs.size])
+    run_signs = signs[starts]
+
+    def longest(sign: int) -> int:
+        runs = lengths[run_signs == sign]
+        return int(runs.max()) if runs.size else 0
+
+    stats.update(
+        total_return=float((b[-1] / b[0] - 1) * 100),
+        max_drawdown=float(drawdown.min()),
+        volatility=float(std * scale * 100),
+        sharpe=float(returns.mean() / std * scale) if std > 0 else None,
+        sortino=(
+            float(returns.mean() / downside_std * scale) if downside_std > 0 else None
+        ),
+        best_day=float(returns.max() * 100),
+        worst_day=float(returns.min() * 100),
+        longest_win_streak=longest(1),
+        longest_loss_streak=longest(-1),
+        current_streak=int(lengths[-1] * run_signs[-1]),
+    )
+    for window, returns in rolling.items():
+        stats[f"return_{window}d"] = float(returns[-1]) if b.size > window else None
+    return result
+
+
+def _yaml_value(value: object) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def _chart_block(labels: list[str], *series: tuple[str, list]) -> str:
+    """Return an Obsidian Charts line chart with one line per ``(title, data)``."""
+
+    lines = "".join(
+        f"  - title: {title}\n    data: {json.dumps(data)}\n" for title, data in series
+    )
+    return (
+        "```chart\n"
+        "type: line\n"
+        f"labels: {json.dumps(labels)}\n"
+        "series:\n"
+        f"{lines}"
+        "fill: false\n"
+        "beginAtZero: false\n"
+        "width: 100%\n"
+        "```\n"
+    )
+
+
+def write_summary(config: Config) -> Optional[dict[str, object]]:
+    """Write the performance summary note for the profile's balance history.
+
+    The note's front matter holds the statistics from
+    :func:`compute_analytics` for Dataview, and its body holds Obsidian
+    Charts blocks for the balance, drawdown and rolling-return curves.
+    Returns the statistics, or ``None`` if the folder has no balance notes
+    yet.
+    """
+
+    series = load_balance_series(config, "0000-01-01", "9999-12-31")
+    if not series:
+        return None
+    analytics = compute_analytics(series.values())
+    stats = analytics.stats
+    dates = list(series)
+    lines = ["---", f"updated: {config.today}"]
+    lines += [f"first_date: {dates[0]}", f"last_date: {dates[-1]}"]
+    lines += [f"{key}: {_yaml_value(value)}" for key, value in stats.items()]
+    lines += ["---", "", "# Performance summary", ""]
+    body = "\n".join(lines) + "\n"
+    if stats["days"]:
+        labels = [d for d, ok in zip(dates, analytics.valid.tolist()) if ok]
+        balances = [round(series[d], 2) for d in labels]
+        drawdown = analytics.drawdown.round(2).tolist()
+        # days before a window fills are null, which Charts leaves as a gap
+        rolling = [
+            (
+                f"{window}d return %",
+                [None if math.isnan(v) else v for v in returns.round(2).tolist()],
+            )
+            for window, returns in analytics.rolling.items()
+        ]
+        body += "## Balance\n\n" + _chart_block(labels, ("Balance", balances))
+        body += "\n## Drawdown %\n\n" + _chart_block(labels, ("Drawdown %", drawdown))
+        body += "\n## Rolling returns %\n\n" + _chart_block(labels, *rolling)
+
+    path = os.path.join(config.vault_path, config.balance_folder, SUMMARY_NOTE)
+    with METRICS.stage("vault_write"):
+        write_note(path, body.encode())
+    logger.info(
+        "📈 %s/%s: summary of %s days written to %s",
+        config.account,
+        config.currency,
+        stats["days"],
+        path,
+    )
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Roll-up notes
+# ---------------------------------------------------------------------------
+
+ROLLUP_FOLDER = "Rollups"
+
+
+def rollup_buckets(date_str: str) -> list[tuple[str, str, str, str]]:
+    """Return the ``(period, name, start, end)`` buckets containing a date.
+
+    Weeks are ISO weeks named ``YYYY-Www``; months are ``YYYY-MM`` and years
+    ``YYYY``.
+    """
+
+    day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    iso_year, week, weekday = day.isocalendar()
+    week_start = day - timedelta(days=weekday - 1)
+    month_start = day.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    return [
+        (
+            "week",
+            f"{iso_year}-W{week:02d}",
+            week_start.isoformat(),
+            (week_start + timedelta(days=6)).isoformat(),
+        ),
+        (
+            "month",
+            date_str[:7],
+            month_start.isoformat(),
+            (next_month - timedelta(days=1)).isoformat(),
+        ),
+        ("year", date_str[:4], f"{date_str[:4]}-01-01", f"{date_str[:4]}-12-31"),
+    ]
+
+
+def update_rollups(
+    config: Config,
+    dates: Iterable[str],
+    index: BalanceIndex,
+    batch: Optional[NoteBatch] = None,
+) -> int:
+    """Recompute the roll-up notes of the buckets containing ``dates``.
+
+    Each affected week, month and year is recomputed once from the index's
+    balances for that bucket alone, so the cost does not grow with the
+    length of the history. Non-positive balances (placeholders) are ignored
+    and a bucket without balances loses its note. Returns the number of
+    notes written or removed.
+    """
+
+    buckets = {bucket for date_str in dates for bucket in rollup_buckets(date_str)}
+    folder = os.path.join(config.vault_path, config.balance_folder, ROLLUP_FOLDER)
+    changed = 0
+    for period, name, start_date, end_date in sorted(buckets):
+        path = os.path.join(folder, f"{name}.md")
+        rows = [(d, b) for d, b in index.series(start_date, end_date) if b > 0]
+        if not rows:
+            with suppress(FileNotFoundError):
+                os.remove(path)
+                changed += 1
+            continue
+        values = [b for _, b in rows]
+        first, last = values[0], values[-1]
+        fields = {
+            "period": period,
+            "bucket": name,
+            "start": start_date,
+            "end": end_date,
+            "first_date": rows[0][0],
+            "last_date": rows[-1][0],
+            "days": len(rows),
+            "open": f"{first:.2f}",
+            "close": f"{last:.2f}",
+            "high": f"{max(values):.2f}",
+            "low": f"{min(values):.2f}",
+            "change": f"{last - first:.2f}",
+            "change_pct": f"{(last / first - 1) * 100:.2f}",
+        }
+        text = "---\n" + "".join(f"{k}: {v}\n" for k, v in fields.items()) + "---\n"
+        if write_note(path, text.encode(), batch):
+            changed += 1
+    return changed
+
+
+# ---------------------------------------------------------------------------
+# Vault check and repair
+# ---------------------------------------------------------------------------
+
+VAULT_CHECK_CHUNK = 1000
+PARALLEL_CHECK_MIN = 2000
+MALFORMED_DIR = ".malformed"
+
+
+@dataclass
+class VaultReport:
+    """Result of scanning one balance folder."""
+
+    notes: int = 0
+    valid: dict[str, float] = field(default_factory=dict)
+    malformed: dict[str, str] = field(default_factory=dict)
+    placeholders: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+
+    @property
+    def problems(self) -> list[str]:
+        """Every date that needs repair, in order."""
+
+        return sorted({*self.malformed, *self.placeholders, *self.missing})
+
+
+def _check_notes(paths: list[str]) -> list[tuple[str, Optional[float], str]]:
+    """Parse ``paths`` and return ``(date, balance, error)`` for each note.
+
+    Runs in worker processes, so it only uses module-level helpers.
+    """
+
+    results = []
+    for path in paths:
+        date_str = os.path.basename(path)[:10]
+        try:
+            results.append((date_str, read_note_balance(path), ""))
+        except (*NOTE_PARSE_ERRORS, OSError) as e:
+            results.append((date_str, None, str(e) or type(e).__name__))
+    return results
+
+
+def check_vault(config: Config, workers: Optional[int] = None) -> VaultReport:
+    """Parse every note in the balance folder and classify the days.
+
+    Folders with at least :data:`PARALLEL_CHECK_MIN` notes are parsed in
+    chunks by a process pool. A ``balance`` of exactly zero is reported as a
+    placeholder; days between the first and last note without a note are
+    reported as missing.
+    """
+
+    folder = os.path.join(config.vault_path, config.balance_folder)
+    report = VaultReport()
+    if not os.path.isdir(folder):
+        return report
+    paths = [path for _, path in sorted((d, e.path) for d, e in scan_notes(folder))]
+    report.notes = len(paths)
+    chunks = [
+        paths[i : i + VAULT_CHECK_CHUNK]
+        for i in range(0, len(paths), VAULT_CHECK_CHUNK)
+    ]
+    with METRICS.stage("vault_read"):
+        if len(paths) >= PARALLEL_CHECK_MIN:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(workers) as pool:
+                results = list(
+                    itertools.chain.from_iterable(pool.map(_check_notes, chunks))
+                )
+        else:
+            results = _check_notes(paths)
+
+    for date_str, balance, error in results:
+        if balance is None:
+            report.malformed[date_str] = error
+        elif balance == 0:
+            report.placeholders.append(date_str)
+        else:
+            report.valid[date_str] = balance
+    if paths:
+        present = {date_str for date_str, _, _ in results}
+        first, last = results[0][0], results[-1][0]
+        report.missing = [d for d in _date_range(first, last) if d not in present]
+    return report
+
+
+def log_vault_report(config: Config, report: VaultReport) -> None:
+    """Log a summary of ``report`` with the first few dates of each kind."""
+
+    def sample(dates: Iterable[str]) -> str:
+        dates = list(dates)
+        more = f" (+{len(dates) - 10} more)" if len(dates) > 10 else ""
+        return ", ".join(dates[:10]) + more
+
+    logger.info(
+        "🔎 %s/%s: %s notes, %s malformed, %s placeholders, %s missing days",
+        config.account,
+        config.currency,
+        report.notes,
+        len(report.malformed),
+        len(report.placeholders),
+        len(report.missing),
+    )
+    for date_str, error in list(report.malformed.items())[:10]:
+        logger.warning("Malformed note %s: %s", date_str, error)
+    if report.placeholders:
+        logger.warning("Placeholder days: %s", sample(report.placeholders))
+    if report.missing:
+        logger.warning("Missing days: %s", sample(report.missing))
+
+
+def repair_vault(
+    config: Config, report: VaultReport, carry_forward: bool = False
+) -> int:
+    """Rewrite or fill the problem days in ``report`` in one batch.
+
+    A day is only repaired with the closing equity recorded for it in the
+    stored transaction history. With ``carry_forward`` the remaining days
+    take the last valid balance before them instead; otherwise they are
+    logged and left as they are, so placeholders that may be real
+    zero-equity days are never overwritten with a guess. Each day is
+    written under :func:`claim_date` and left as is if another run holds
+    its claim. Malformed notes are copied to ``.malformed/`` before being
+    replaced. Returns the number of notes written.
+    """
+
+    import shutil
+
+    problems = report.problems
+    if not problems:
+        return 0
+    with open_ledger(config) as ledger:
+        known = TransactionStore(ledger).daily_equity(
+            config.account, config.currency, problems[0], problems[-1]
+        )
+
+    bad = set(problems)
+    fixes: dict[str, float] = {}
+    unknown = []
+    carried = None
+    first = min(problems[0], next(iter(report.valid), problems[0]))
+    for day in _date_range(first, problems[-1]):
+        if day in bad:
+            value = known.get(day, carried if carry_forward else None)
+            if value is None:
+                unknown.append(day)
+                continue
+            fixes[day] = value
+        else:
+            value = report.valid.get(day, carried)
+        carried = value
+    if unknown:
+        logger.warning(
+            "⚠️ No transaction data for %d day(s), left as is: %s",
+            len(unknown),
+            ", ".join(unknown),
+        )
+
+    folder = os.path.join(config.vault_path, config.balance_folder)
+    with ExitStack() as claims:
+        held = [
+            day
+            for day in fixes
+            if not claims.enter_context(claim_date(config, day, force=True))
+        ]
+        if held:
+            logger.warning(
+                "🟡 %d day(s) being logged by another run, left as is: %s",
+                len(held),
+                ", ".join(held),
+            )
+            for day in held:
+                del fixes[day]
+
+        for day in sorted(set(fixes) & set(report.malformed)):
+            os.makedirs(os.path.join(folder, MALFORMED_DIR), exist_ok=True)
+            shutil.copy2(
+                locate_note(config, day),
+                os.path.join(folder, MALFORMED_DIR, f"{day}.md"),
+            )
+
+        with BalanceIndex(config) as index:
+            with NoteBatch() as batch:
+                for day, balance in fixes.items():
+                    write_balance(config, day, balance, index, batch)
+            with NoteBatch() as batch:
+                update_rollups(config, fixes, index, batch)
+        with open_ledger(config) as ledger:
+            ledger.add(config.account, config.currency, fixes)
+    logger.info(
+        "🛠 %s/%s: repaired %s of %s problem days.",
+        config.account,
+        config.currency,
+        len(fixes),
+        len(problems),
+    )
+    return len(fixes)
+
+
+def _rewrite_note_links(config: Config, moved: dict[str, str]) -> int:
+    """Point vault-absolute links at moved notes to their new paths.
+
+    ``moved`` maps old to new vault-relative paths without ``.md``. Wiki
+    and markdown links by bare note name keep working unchanged because
+    file names do not change. Returns the number of notes rewritten.
+    """
+
+    folder = config.balance_folder.strip("/").replace(os.sep, "/")
+    pattern = re.compile(
+        rf"(?<![\w/]){re.escape(folder)}/(?:\d{{4}}/\d{{2}}/)?\d{{4}}-\d{{2}}-\d{{2}}"
+        r"(?![\w-])"
+    )
+
+    def relink(match: re.Match) -> str:
+        return moved.get(match.group(0), match.group(0))
+
+    rewritten = 0
+    for root, dirs, files in os.walk(config.vault_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if not name.endswith(".md"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+            if folder not in text:
+                continue
+            updated = pattern.sub(relink, text)
+            if updated != text and write_note(path, updated.encode("utf-8")):
+                rewritten += 1
+    return rewritten
+
+
+def migrate_layout(config: Config, layout: str) -> tuple[int, int]:
+    """Move every daily note of the balance folder into ``layout`` in bulk.
+
+    Notes and their sample sidecars are renamed in place, keeping their file
+    names, mtimes and index rows; each touched directory is fsynced once and
+    shards left empty are removed. Vault-absolute links to moved notes are
+    then rewritten. A note whose target already exists with different
+    content is left where it is. Returns ``(notes moved, notes relinked)``.
+    """
+
+    folder = os.path.join(config.vault_path, config.balance_folder)
+    if not os.path.isdir(folder):
+        return 0, 0
+
+    def vault_rel(path: str) -> str:
+        return os.path.relpath(path, config.vault_path)[:-3].replace(os.sep, "/")
+
+    moved: dict[str, str] = {}
+    touched: set[str] = set()
+    with METRICS.stage("vault_write"):
+        for date_str, entry in list(scan_notes(folder)):
+            target = note_path(config, date_str, layout)
+            if entry.path == target:
+                continue
+            if os.path.exists(target):
+                with open(entry.path, "rb") as f:
+                    if not note_unchanged(target, f.read()):
+                        logger.warning(
+                            "⚠️ %s and %s differ — left in place.", entry.path, target
+                        )
+                        continue
+                os.remove(entry.path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(entry.path, target)
+            moved[vault_rel(entry.path)] = vault_rel(target)
+            touched.update((os.path.dirname(entry.path), os.path.dirname(target)))
+        samples = os.path.join(folder, SAMPLES_DIR)
+        if os.path.isdir(samples):
+            for date_str, entry in list(scan_notes(samples, SAMPLE_NAME_RE)):
+                target = sample_path(config, date_str, layout)
+                if entry.path != target and not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(entry.path, target)
+                    touched.update(
+                        (os.path.dirname(entry.path), os.path.dirname(target))
+                    )
+        for directory in touched:
+            _fsync_dir(directory)
+        for directory in sorted(touched, reverse=True):
+            while directory != folder:
+                with suppress(OSError):
+                    os.rmdir(directory)  # only succeeds once the shard is empty
+                directory = os.path.dirname(directory)
+        _forget_note_dates(
+            os.path.join(config.vault_path, f"{path}.md") for path in moved.values()
+        )
+        relinked = _rewrite_note_links(config, moved) if moved else 0
+    logger.info(
+        "📦 %s/%s: moved %s notes to the %s layout, updated links in %s notes.",
+        config.account,
+        config.currency,
+        len(moved),
+        layout,
+        relinked,
+    )
+    return len(moved), relinked
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+EXPORT_FIELDS = ("date", "account", "currency", "balance")
+EXPORT_BATCH = 10_000
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit(
+            "Parquet export requires pyarrow: "
+            "pip install obsidian-trading-balance-fetcher[parquet]"
+        ) from None
+    return pyarrow
+
+
+class ExportCursors:
+    """Last exported date per export target and profile, in the ledger database."""
+
+    def __init__(self, ledger: LoggedLedger):
+        self.ledger = ledger
+        self.conn = ledger.conn
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS export_cursor ("
+            "target TEXT NOT NULL, account TEXT NOT NULL, currency TEXT NOT NULL, "
+            "date TEXT NOT NULL, PRIMARY KEY (target, account, currency)"
+            ") WITHOUT ROWID"
+        )
+
+    def get(self, target: str, account: str, currency: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT date FROM export_cursor "
+            "WHERE target = ? AND account = ? AND currency = ?",
+            (target, account, currency),
+        ).fetchone()
+        return row[0] if row else None
+
+    def advance(self, target: str, dates: dict[tuple[str, str], str]) -> None:
+        """Store the newest exported date of each ``(account, currency)``."""
+
+        with self.ledger.transaction():
+            self.conn.executemany(
+                "INSERT INTO export_cursor VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (target, account, currency) DO UPDATE SET "
+                "date = max(date, excluded.date)",
+                [(target, a, c, d) for (a, c), d in dates.items()],
+            )
+
+
+def iter_balance_history(
+    config: Config, start_date: str = "0000-01-01", end_date: str = "9999-12-31"
+) -> Iterator[dict[str, object]]:
+    """Yield one export row per note of the profile in the range, by date.
+
+    The folder's :class:`BalanceIndex` is refreshed first, so only new or
+    edited notes are parsed; rows are then streamed from the index.
+    """
+
+    if not os.path.isdir(os.path.join(config.vault_path, config.balance_folder)):
+        return
+    with BalanceIndex(config) as index:
+        with METRICS.stage("vault_read"):
+            index.refresh()
+        for date_str, balance in index.iter_series(start_date, end_date):
+            yield {
+                "date": date_str,
+                "account": config.account,
+                "currency": config.currency,
+                "balance": balance,
+            }
+
+
+def _write_rows(rows: Iterator[dict[str, object]], fmt: str, f, header: bool) -> None:
+    if fmt == "csv":
+        import csv
+
+        writer = csv.DictWriter(f, EXPORT_FIELDS, lineterminator="\n")
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+    else:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+
+
+def _write_parquet(rows: Iterator[dict[str, object]], path: str) -> None:
+    pa = _import_pyarrow()
+    schema = pa.schema(
+        [
+            ("date", pa.string()),
+            ("account", pa.string()),
+            ("currency", pa.string()),
+            ("balance", pa.float64()),
+        ]
+    )
+    with pa.parquet.ParquetWriter(path, schema) as writer:
+        while True:
+            batch = list(itertools.islice(rows, EXPORT_BATCH))
+            if not batch:
+                break
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def _parquet_part(folder: str, newest: str) -> str:
+    """Return an unused part file path in a Parquet dataset directory.
+
+    Parts are named after the newest exported date, so they sort in export
+    order; a numeric suffix separates exports ending on the same day.
+    """
+
+    path = os.path.join(folder, f"part-{newest}.parquet")
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"part-{newest}-{n}.parquet")
+        n += 1
+    return path
+
+
+def export_history(
+    configs: list[Config],
+    fmt: str,
+    output: Optional[str] = None,
+    start_date: str = "0000-01-01",
+    end_date: str = "9999-12-31",
+    since_last: bool = False,
+) -> int:
+    """Stream the balance history of ``configs`` to ``output`` in date order.
+
+    Profiles are merged by date one row at a time, so memory does not grow
+    with the history. CSV and JSON Lines go to ``output`` or stdout; Parquet
+    needs an ``output`` path and is written in batches of
+    :data:`EXPORT_BATCH` rows. Files are replaced atomically. With
+    ``since_last`` only days after the previous export to the same target
+    are written and the per-profile cursor in the ledger database advances
+    once the output is complete. CSV and JSON Lines are then appended to;
+    a Parquet file cannot be, so ``output`` becomes a dataset directory that
+    gains one ``part-<newest date>.parquet`` file per export with new rows.
+    Returns the number of rows written.
+    """
+
+    import heapq
+    import sys
+
+    if fmt == "parquet" and not output:
+        raise SystemExit("Parquet export needs --output")
+    if fmt == "parquet" and since_last and os.path.isfile(output):
+        raise SystemExit(
+            f"{output} is a file; --since-last Parquet exports write a dataset "
+            "directory of part files, so choose a new --output"
+        )
+    target = os.path.abspath(output) if output else "-"
+    starts = {}
+    for config in configs:
+        starts[config.account, config.currency] = start_date
+        if since_last:
+            with open_ledger(config) as ledger:
+                last = ExportCursors(ledger).get(
+                    target, config.account, config.currency
+                )
+            if last is not None:
+                next_day = datetime.strptime(last, "%Y-%m-%d") + timedelta(days=1)
+                starts[config.account, config.currency] = max(
+                    start_date, next_day.strftime("%Y-%m-%d")
+                )
+
+    newest: dict[tuple[str, str], str] = {}
+    count = 0
+
+    def track(rows: Iterator[dict[str, object]]) -> Iterator[dict[str, object]]:
+        nonlocal count
+        for row in rows:
+            newest[row["account"], row["currency"]] = row["date"]
+            count += 1
+            yield row
+
+    rows = track(
+        heapq.merge(
+            *(
+                iter_balance_history(c, starts[c.account, c.currency], end_date)
+                for c in configs
+            ),
+            key=lambda row: (row["date"], row["account"], row["currency"]),
+        )
+    )
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if fmt == "parquet" and since_last:
+        os.makedirs(output, exist_ok=True)
+        tmp = _stage_note(os.path.join(output, "part.parquet"), b"")
+        try:
+            _write_parquet(rows, tmp)
+            if count:
+                os.replace(tmp, _parquet_part(output, max(newest.values())))
+            else:
+                os.remove(tmp)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+    elif fmt == "parquet":
+        tmp = _stage_note(output, b"")
+        try:
+            _write_parquet(rows, tmp)
+            os.replace(tmp, output)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+    elif not output:
+        _write_rows(rows, fmt, sys.stdout, header=True)
+        sys.stdout.flush()
+    elif since_last:
+        new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+        with open(output, "a", newline="") as f:
+            _write_rows(rows, fmt, f, header=new_file)
+    else:
+        tmp = _stage_note(output, b"")
+        try:
+            with open(tmp, "w", newline="") as f:
+                _write_rows(rows, fmt, f, header=True)
+            os.replace(tmp, output)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+
+    if since_last and newest:
+        with open_ledger(configs[0]) as ledger:
+            ExportCursors(ledger).advance(target, newest)
+    logger.info("📤 Exported %s rows to %s.", count, output or "stdout")
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Logging runs
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class ProfileResult:
+    """Outcome of logging one account/currency profile."""
+
+    config: Config
+    balance: Optional[float] = None
+    breakdown: Optional[dict[str, tuple[float, float]]] = None
+    error: Optional[BaseException] = None
+    skipped: bool = False
+
+
+def record_balance(
+    config: Config,
+    date_str: str,
+    balance: float,
+    previous_balance: Optional[float] = None,
+    breakdown: Optional[dict[str, tuple[float, float]]] = None,
+) -> None:
+    """Write ``balance`` for ``date_str``, mark it logged and report the change.
+
+    ``previous_balance`` is read from the vault unless already known.
+    """
+
+    if previous_balance is None:
+        previous_balance = read_previous_balance(config, date_str)
+    write_balance(config, date_str, balance, breakdown=breakdown)
+    mark_logged(config, date_str)
+
+    change = balance - previous_balance
+    pct = (change / previous_balance) * 100 if previous_balance != 0 else 0
+    symbol = "📈" if change > 0 else "📉" if change < 0 else "🔁"
+    logger.info(
+        "%s Change since previous day: %+0.2f (%+0.2f%%)",
+        symbol,
+        change,
+        pct,
+    )
+
+
+def fetch_with_previous(
+    config: Config, date_str: str
+) -> tuple[float, float, Optional[dict[str, tuple[float, float]]]]:
+    """Fetch the live balance while the previous day's note is read.
+
+    Returns the balance, the previous balance and the base-currency
+    breakdown (``None`` unless the profile totals several currencies).
+
+    The signed request runs on a worker thread so the network round-trip
+    overlaps the vault read. The time saved is recorded as the
+    ``overlap_saved`` stage: the sum of both legs minus the wall-clock time.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(func: Callable, *args) -> tuple[object, float]:
+        start = time.perf_counter()
+        return func(*args), time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(1) as pool:
+        fetch = pool.submit(timed, fetch_account_balance, config)
+        previous_balance, read_seconds = timed(read_previous_balance, config, date_str)
+        (balance, breakdown), fetch_seconds = fetch.result()
+    wall = time.perf_counter() - start
+    METRICS.add("overlap_saved", max(read_seconds + fetch_seconds - wall, 0.0))
+    return balance, previous_balance, breakdown
+
+
+def _date_range(start_date: str, end_date: str) -> list[str]:
+    """Return every ``YYYY-MM-DD`` date from ``start_date`` to ``end_date``."""
+
+    day = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    dates = []
+    while day <= end:
+        dates.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return dates
+
+
+def backfill_range(
+    config: Config,
+    start_date: str,
+    end_date: str,
+    missing_only: bool = False,
+    session: Optional[requests.Session] = None,
+) -> dict[str, float]:
+    """Backfill every day from ``start_date`` to ``end_date`` in one batch.
+
+    Existing notes in the range (and the day before it) are loaded once into
+    an in-memory series. Past days take their closing equity from the paged
+    transaction history and today uses the live balance. Existing notes
+    without new data are left as they are, keeping any roll-up fields and
+    body; days with neither are logged as missing and left unwritten rather
+    than filled with a guess. All notes are then written in one batch and
+    recorded afterwards in one short ledger transaction. Today is written
+    under :func:`claim_date` and skipped if another run holds the claim.
+    Returns the balances written, by date.
+    """
+
+    if session is None:
+        with new_session() as own_session:
+            return backfill_range(
+                config, start_date, end_date, missing_only, own_session
+            )
+
+    dates = _date_range(start_date, end_date)
+    prior_day = (
+        datetime.strptime(start_date, "%Y-%m-%d") - timedelta(days=1)
+    ).strftime("%Y-%m-%d")
+    series = load_balance_series(config, prior_day, end_date)
+    targets = [d for d in dates if not (missing_only and d in series)]
+    if not targets:
+        logger.info("🟡 No days to backfill between %s and %s.", start_date, end_date)
+        return {}
+
+    try:
+        history = fetch_equity_history(config, targets[0], targets[-1], session)
+    except RuntimeError as e:
+        logger.warning("Historical equity unavailable: %s", e)
+        history = {}
+
+    balances = {}
+    missing = []
+    for day in targets:
+        if day == config.today:
+            value = fetch_balance_shared(config, session)
+        else:
+            value = history.get(day)
+        if value is not None:
+            balances[day] = value
+        elif day not in series:
+            missing.append(day)
+    if missing:
+        logger.warning(
+            "⚠️ No balance data for %d day(s), left missing: %s",
+            len(missing),
+            ", ".join(missing),
+        )
+
+    with ExitStack() as claims:
+        # Today may be logged by a scheduled or streaming run meanwhile; like
+        # those, backfill rewrites a logged day, so it claims with force.
+        if config.today in balances and not claims.enter_context(
+            claim_date(config, config.today, force=True)
+        ):
+            logger.warning(
+                "🟡 %s is being logged by another run — skipping.", config.today
+            )
+            del balances[config.today]
+        with BalanceIndex(config) as index:
+            with NoteBatch() as batch:
+                for day, balance in balances.items():
+                    write_balance(config, day, balance, index, batch)
+            with NoteBatch() as batch:
+                update_rollups(config, balances, index, batch)
+        with open_ledger(config) as ledger:
+            ledger.add(config.account, config.currency, balances)
+
+    merged = {**series, **balances}
+    previous = series.get(prior_day, 0.0)
+    for day in dates:
+        if day in balances:
+            change = balances[day] - previous
+            pct = (change / previous) * 100 if previous != 0 else 0
+            logger.info("%s %+0.2f (%+0.2f%%)", day, change, pct)
+        previous = merged.get(day, previous)
+    return balances
+
+
+def fetch_balances(
+    results: list[ProfileResult], session: Optional[requests.Session] = None
+) -> None:
+    """Fill in ``balance`` or ``error`` for each result concurrently.
+
+    Fetches run on a thread pool bounded by ``max_workers`` and share one
+    connection pool (``session`` if given). Prices for base-currency totals
+    are fetched first, in one batched request for all profiles.
+    """
+
+    if not results:
+        return
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = max(1, min(results[0].config.max_workers, len(results)))
+    shared = session if session is not None else new_session(workers)
+    try:
+        foreign = {
+            (c, r.config.base_currency)
+            for r in results
+            if r.config.base_currency
+            for c in r.config.currencies
+            if c != r.config.base_currency
+        }
+        if foreign:
+            try:
+                PRICES.get_many(
+                    results[0].config, shared, itertools.chain.from_iterable(foreign)
+                )
+            except RuntimeError as e:
+                logger.warning("Price prefetch failed: %s", e)
+        with ThreadPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(fetch_account_balance, r.config, shared) for r in results
+            ]
+            for result, future in zip(results, futures):
+                try:
+                    result.balance, result.breakdown = future.result()
+                except Exception as e:
+                    result.error = e
+    finally:
+        if session is None:
+            shared.close()
+
+
+def log_profiles(
+    configs: list[Config],
+    date_str: str,
+    session: Optional[requests.Session] = None,
+) -> list[ProfileResult]:
+    """Fetch and log ``date_str`` for every profile in ``configs``.
+
+    Balances are fetched concurrently on a bounded thread pool sharing one
+    connection pool (``session`` if given); notes are then written
+    sequentially. A failure in one profile is recorded in its
+    :class:`ProfileResult` and does not stop the others.
+    """
+
+    results = [ProfileResult(config=c) for c in configs]
+    pending = []
+    with ExitStack() as claims:
+        for result in results:
+            if already_logged(result.config, date_str):
+                result.skipped = True
+                continue
+            try:
+                claimed = claims.enter_context(claim_date(result.config, date_str))
+            except RuntimeError as e:
+                result.error = e
+                continue
+            if claimed:
+                pending.append(result)
+            else:
+                result.skipped = True
+
+        fetch_balances(pending, session)
+        for result in pending:
+            if result.error is not None:
+                continue
+            try:
+                record_balance(
+                    result.config, date_str, result.balance, breakdown=result.breakdown
+                )
+            except Exception as e:
+                result.error = e
+
+    for result in results:
+        name = f"{result.config.account}/{result.config.currency}"
+        if result.skipped:
+            logger.debug("🟡 %s: already logged — skipped.", name)
+        elif result.error is not None:
+            logger.error("❌ %s: %s", name, result.error)
+        else:
+            logger.info("✅ %s: %.2f", name, result.balance)
+    return results
+
+
+@contextmanager
+def stop_on_signals(stop: threading.Event) -> Iterator[threading.Event]:
+    """Set ``stop`` on SIGTERM/SIGINT, restoring the old handlers on exit.
+
+    Handlers can only be installed from the main thread; elsewhere ``stop``
+    must be set by the caller.
+    """
+
+    import signal
+
+    previous = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous[signum] = signal.signal(signum, lambda *_: stop.set())
+    try:
+        yield stop
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def sample_profiles(
+    configs: list[Config], date_str: str, session: Optional[requests.Session] = None
+) -> list[ProfileResult]:
+    """Fetch every profile once and append the equity to the day's sidecar.
+
+    The first sample of a day not yet in the ledger also logs the day's note,
+    unless another run holds the day's claim.
+    """
+
+    results = [ProfileResult(config=c) for c in configs]
+    fetch_balances(results, session)
+    now = time.time()
+    for result in results:
+        if result.error is not None:
+            logger.error(
+                "❌ %s/%s: %s",
+                result.config.account,
+                result.config.currency,
+                result.error,
+            )
+            continue
+        try:
+            append_sample(result.config, date_str, now, result.balance)
+            if not already_logged(result.config, date_str):
+                with claim_date(result.config, date_str) as claimed:
+                    if claimed:
+                        record_balance(result.config, date_str, result.balance)
+        except Exception as e:
+            result.error = e
+            logger.error(
+                "❌ %s/%s: %s", result.config.account, result.config.currency, e
+            )
+    return results
+
+
+def run_daemon(
+    configs: list[Config],
+    stop: Optional[threading.Event] = None,
+    sample: bool = False,
+) -> None:
+    """Poll every ``poll_interval`` seconds and log each new day once.
+
+    One pooled keep-alive session and the parsed configs are kept for the
+    lifetime of the process. With ``sample`` every poll also appends the
+    equity to the day's sidecar file, and each finished day (including
+    yesterday, at startup) is rolled up into its note. SIGTERM and SIGINT
+    set ``stop`` so the current tick finishes and the session is closed
+    cleanly.
+    """
+
+    stop = stop or threading.Event()
+    interval = configs[0].poll_interval
+    logger.info("🔄 Daemon started, polling every %ss.", interval)
+    last_day = None
+    try:
+        with stop_on_signals(stop), new_session(configs[0].max_workers) as session:
+            while not stop.is_set():
+                METRICS.reset("daemon")
+                today = _today()
+                if sample and today != last_day:
+                    closed = last_day or (
+                        datetime.strptime(today, "%Y-%m-%d") - timedelta(days=1)
+                    ).strftime("%Y-%m-%d")
+                    for config in configs:
+                        try:
+                            rollup_day(config, closed)
+                        except Exception as e:
+                            logger.exception("❌ Roll-up of %s failed: %s", closed, e)
+                last_day = today
+                for config in configs:
+                    config.today = today
+                success = False
+                try:
+                    if sample:
+                        results = sample_profiles(configs, today, session)
+                    else:
+                        results = log_profiles(configs, today, session=session)
+                    success = all(r.error is None for r in results)
+                except Exception as e:
+                    logger.exception("❌ Daemon tick failed: %s", e)
+                METRICS.export(success)
+                stop.wait(interval)
+    finally:
+        logger.info("🛑 Daemon stopped.")
+
+
+# ---------------------------------------------------------------------------
+# Balance streaming
+# ---------------------------------------------------------------------------
+
+WS_TOKEN_ENDPOINT = "/api/v1/bullet-private"
+WS_BALANCE_TOPIC = "/contractAccount/wallet"
+WS_MAX_BACKOFF = 60.0
+WS_POLL_SECONDS = 1.0
+
+
+def fetch_ws_endpoint(config: Config, session: requests.Session) -> tuple[str, float]:
+    """Return a private WebSocket URL and its ping interval in seconds."""
+
+    import uuid
+
+    data = request_json(config, session, WS_TOKEN_ENDPOINT, method="POST")
+    try:
+        token = data["data"]["token"]
+        server = data["data"]["instanceServers"][0]
+        url = f"{server['endpoint']}?token={token}&connectId={uuid.uuid4().hex}"
+        return url, float(server.get("pingInterval", 18000)) / 1000
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise RuntimeError(f"Invalid WebSocket token response: {e}") from e
+
+
+def parse_wallet_event(message: dict, currency: str) -> Optional[float]:
+    """Return the account equity carried by a wallet ``message``, if any."""
+
+    if message.get("type") != "message":
+        return None
+    if not str(message.get("topic", "")).startswith(WS_BALANCE_TOPIC):
+        return None
+    data = message.get("data")
+    if not isinstance(data, dict) or data.get("currency") != currency:
+        return None
+    for key in ("accountEquity", "equity"):
+        if key in data:
+            try:
+                return float(data[key])
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class BalanceStream:
+    """Keep one profile's equity live from KuCoin's private wallet channel.
+
+    The equity is seeded from a REST snapshot on every (re)connect and then
+    updated from pushed wallet events. Today's note is rewritten at most once
+    per ``config.stream_debounce`` seconds and only when the rounded balance
+    changed; the latest value is flushed when the stream stops. Dropped
+    connections are retried with exponential backoff capped at
+    :data:`WS_MAX_BACKOFF`.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        session: requests.Session,
+        stop: threading.Event,
+        connect: Optional[Callable] = None,
+    ) -> None:
+        self.config = config
+        self.session = session
+        self.stop = stop
+        self.connect = connect
+        self.equity: Optional[float] = None
+        self.written: Optional[tuple[str, str]] = None
+        self.last_write = float("-inf")
+
+    def update(self, equity: float) -> None:
+        self.equity = equity
+        self.flush()
+
+    def flush(self, force: bool = False) -> None:
+        """Write the live equity to today's note if due and changed."""
+
+        if self.equity is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_write < self.config.stream_debounce:
+            return
+        date_str = _today()
+        key = (date_str, f"{self.equity:.2f}")
+        if key == self.written:
+            return
+        # The stream keeps rewriting a logged day, so it claims with force;
+        # the claim still keeps it from racing a run that is logging the day.
+        with claim_date(self.config, date_str, force=True) as claimed:
+            if not claimed:
+                return  # retried on the next update
+            write_balance(self.config, date_str, self.equity)
+            mark_logged(self.config, date_str)
+        self.written = key
+        self.last_write = now
+
+    def run(self) -> None:
+        """Stream until ``stop`` is set, reconnecting on failures."""
+
+        connect = self.connect
+        if connect is None:
+            try:
+                from websockets.sync.client import connect
+            except ImportError:
+                raise SystemExit(
+                    "--stream requires the 'websockets' package: "
+                    "pip install obsidian-trading-balance-fetcher[stream]"
+                ) from None
+
+        failures = 0
+        try:
+            while not self.stop.is_set():
+                try:
+                    url, ping_interval = fetch_ws_endpoint(self.config, self.session)
+                    self.update(fetch_futures_balance(self.config, self.session))
+                    with connect(url, open_timeout=self.config.api_timeout) as ws:
+                        self._subscribe(ws)
+                        failures = 0
+                        self._consume(ws, ping_interval)
+                except Exception as e:
+                    if self.stop.is_set():
+                        break
+                    failures += 1
+                    wait = min(
+                        self.config.api_retry_wait * 2 ** (failures - 1), WS_MAX_BACKOFF
+                    )
+                    logger.warning(
+                        "%s/%s: stream disconnected (%s), reconnecting in %.1fs",
+                        self.config.account,
+                        self.config.currency,
+                        e,
+                        wait,
+                    )
+                    self.stop.wait(wait)
+        finally:
+            self.flush(force=True)
+
+    def _subscribe(self, ws) -> None:
+        welcome = json.loads(ws.recv(timeout=self.config.api_timeout))
+        if welcome.get("type") != "welcome":
+            raise RuntimeError(f"Unexpected WebSocket greeting: {welcome}")
+        ws.send(
+            json.dumps(
+                {
+                    "id": str(int(time.time() * 1000)),
+                    "type": "subscribe",
+                    "topic": WS_BALANCE_TOPIC,
+                    "privateChannel": True,
+                    "response": True,
+                }
+            )
+        )
+        logger.info(
+            "📡 %s/%s: streaming wallet updates.",
+            self.config.account,
+            self.config.currency,
+        )
+
+    def _consume(self, ws, ping_interval: float) -> None:
+        next_ping = time.monotonic() + ping_interval
+        while not self.stop.is_set():
+            try:
+                message = json.loads(ws.recv(timeout=WS_POLL_SECONDS))
+            except TimeoutError:
+                message = None
+            if message is not None:
+                if message.get("type") == "error":
+                    raise RuntimeError(f"WebSocket error: {message.get('data')}")
+                equity = parse_wallet_event(message, self.config.currency)
+                if equity is not None:
+                    self.equity = equity
+            if time.monotonic() >= next_ping:
+                ws.send(
+                    json.dumps({"id": str(int(time.time() * 1000)), "type": "ping"})
+                )
+                next_ping = time.monotonic() + ping_interval
+            self.flush()
+
+
+def stream_balances(
+    configs: list[Config],
+    stop: Optional[threading.Event] = None,
+    connect: Optional[Callable] = None,
+) -> None:
+    """Hold one private WebSocket stream per profile until stopped."""
+
+    stop = stop or threading.Event()
+    with stop_on_signals(stop), new_session(len(configs)) as session:
+        streams = [BalanceStream(c, session, stop, connect) for c in configs]
+        threads = [
+            threading.Thread(target=s.run, name=f"stream-{s.config.account}")
+            for s in streams[1:]
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            streams[0].run()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+    logger.info("🛑 Stream stopped.")
+
+
+# ---------------------------------------------------------------------------
+# Main entry point
+# ---------------------------------------------------------------------------
+
+
+def _date_arg(value: str) -> str:
+    """Validate a ``YYYY-MM-DD`` command line argument."""
+
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Command line entry point for balance logging."""
+
+    setup_logging()
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    METRICS.textfile = args.metrics_textfile
+    METRICS.json_path = args.metrics_json
+    diagnostics = {
+        "profile_dir": args.profile,
+        "alloc_dir": args.trace_alloc,
+        "top": args.trace_alloc_top,
+    }
+    if args.daemon or args.sample:
+        METRICS.reset("daemon")
+        with run_diagnostics("daemon", **diagnostics):
+            run(args, parser)  # exports once per tick
+        return
+
+    if args.command:
+        mode = args.command
+    elif args.analytics:
+        mode = "analytics"
+    elif args.sync_transactions:
+        mode = "transactions"
+    elif args.stream:
+        mode = "stream"
+    elif args.date_from:
+        mode = "backfill"
+    else:
+        mode = "profiles" if args.profiles else "single"
+    METRICS.reset(mode)
+    success = False
+    try:
+        with run_diagnostics(mode, **diagnostics):
+            run(args, parser)
+        success = True
+    finally:
+        METRICS.export(success)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the command line parser."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--date", help="Override date for backfill (YYYY-MM-DD)")
+    parser.add_argument("--cache-file", help="Override cache file location")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Log the date even if the ledger says it was already logged",
+    )
+    parser.add_argument(
+        "--profiles",
+        default=os.getenv("BALANCE_PROFILES_FILE"),
+        help="YAML file listing accounts and currencies to log in one run",
+    )
+    parser.add_argument(
+        "--from",
+        dest="date_from",
+        type=_date_arg,
+        help="Backfill every day from this date (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--to",
+        dest="date_to",
+        type=_date_arg,
+        help="Last day to backfill with --from (default today)",
+    )
+    parser.add_argument(
+        "--missing-only",
+        action="store_true",
+        help="With --from, only fill days that have no note yet",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and log each new day as the date rolls over",
+    )
+    parser.add_argument(
+        "--sample",
+        action="store_true",
+        help="Run as a daemon that also records intraday equity samples",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Keep today's note live from KuCoin's private WebSocket channel",
+    )
+    parser.add_argument(
+        "--sync-transactions",
+        action="store_true",
+        help="Store new futures transactions (PnL, deposits, transfers) locally",
+    )
+    parser.add_argument(
+        "--analytics",
+        action="store_true",
+        help="Write a performance summary note from the balance history",
+    )
+    parser.add_argument(
+        "--interval", type=float, help="Daemon poll or sample interval in seconds"
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        default=os.getenv("BALANCE_METRICS_TEXTFILE"),
+        help="Write per-stage run timings to this node_exporter textfile",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        default=os.getenv("BALANCE_METRICS_JSON"),
+        help="Append per-stage run timings as one JSON line to this file",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        default=os.getenv("BALANCE_PROFILE_DIR"),
+        help="Write a cProfile dump of the run to a per-run file in DIR",
+    )
+    parser.add_argument(
+        "--trace-alloc",
+        metavar="DIR",
+        default=os.getenv("BALANCE_TRACE_ALLOC_DIR"),
+        help="Write the run's top tracemalloc allocation sites to a file in DIR",
+    )
+    parser.add_argument(
+        "--trace-alloc-top",
+        type=int,
+        default=25,
+        metavar="N",
+        help="Allocation sites listed by --trace-alloc (default 25)",
+    )
+    commands = parser.add_subparsers(dest="command")
+    export = commands.add_parser(
+        "export", help="Stream the balance history to CSV, JSON Lines or Parquet"
+    )
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument(
+        "--output", "-o", help="File to write (default stdout; required for Parquet)"
+    )
+    export.add_argument(
+        "--from", dest="export_from", type=_date_arg, help="First date to export"
+    )
+    export.add_argument(
+        "--to", dest="export_to", type=_date_arg, help="Last date to export"
+    )
+    export.add_argument(
+        "--account",
+        action="append",
+        help="Only export this profile account (repeatable)",
+    )
+    export.add_argument(
+        "--since-last",
+        action="store_true",
+        help="Only export days after the previous export to the same output",
+    )
+    vault = commands.add_parser(
+        "vault", help="Check, repair or re-shard the balance notes"
+    )
+    vault.add_argument(
+        "action",
+        choices=("check", "repair", "migrate"),
+        help="Report malformed, placeholder and missing days, fix them, "
+        "or move the notes into another layout",
+    )
+    vault.add_argument(
+        "--workers", type=int, help="Processes used to parse large folders"
+    )
+    vault.add_argument(
+        "--carry-forward",
+        action="store_true",
+        help="Repair days without transaction data with the last valid balance",
+    )
+    vault.add_argument(
+        "--layout",
+        choices=VAULT_LAYOUTS,
+        help="Layout to migrate to (default BALANCE_VAULT_LAYOUT)",
+    )
+    return parser
+
+
+def run(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    """Execute the run described by parsed command line ``args``."""
+
+    with METRICS.stage("load_config"):
+        config = load_config(
+            require_credentials=not (args.profiles or args.analytics or args.command)
+        )
+    if args.cache_file:
+        config.cache_file = os.path.expanduser(args.cache_file)
+    if args.interval is not None:
+        config.poll_interval = args.interval
+    elif args.sample:
+        config.poll_interval = config.sample_interval
+
+    target_date = args.date if args.date else config.today
+    if config.base_currency and (
+        args.date_from or args.stream or args.sample or args.sync_transactions
+    ):
+        parser.error(
+            "BALANCE_BASE_CURRENCY totals support single, --profiles and --daemon "
+            "runs only"
+        )
+
+    if args.command == "export":
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        if args.account:
+            configs = [c for c in configs if c.account in args.account]
+            if not configs:
+                parser.error(f"no profile matches --account {', '.join(args.account)}")
+        export_history(
+            configs,
+            args.format,
+            args.output,
+            args.export_from or "0000-01-01",
+            args.export_to or "9999-12-31",
+            args.since_last,
+        )
+        return
+
+    if args.command == "vault":
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        if args.action == "migrate":
+            for cfg in configs:
+                migrate_layout(cfg, args.layout or cfg.vault_layout)
+            return
+        unresolved = 0
+        for cfg in configs:
+            report = check_vault(cfg, args.workers)
+            log_vault_report(cfg, report)
+            if args.action == "repair":
+                repair_vault(cfg, report, args.carry_forward)
+                report = check_vault(cfg, args.workers)
+            unresolved += len(report.problems)
+        if unresolved:
+            raise SystemExit(f"{unresolved} problem days in the vault")
+        return
+
+    if args.analytics:
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        for cfg in configs:
+            if write_summary(cfg) is None:
+                logger.warning(
+                    "🟡 %s/%s: no balance notes to summarise.",
+                    cfg.account,
+                    cfg.currency,
+                )
+        return
+
+    if args.sync_transactions:
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        failed = 0
+        with new_session(config.max_workers) as session:
+            for cfg in configs:
+                try:
+                    sync_transactions(cfg, session, args.date_from)
+                except Exception as e:
+                    failed += 1
+                    logger.exception(
+                        "❌ %s/%s: transaction sync failed: %s",
+                        cfg.account,
+                        cfg.currency,
+                        e,
+                    )
+        if failed:
+            raise SystemExit(f"{failed} of {len(configs)} transaction syncs failed")
+        return
+
+    if args.date_to and not args.date_from:
+        parser.error("--to requires --from")
+    if args.date_from:
+        if args.date or args.daemon or args.sample or args.stream:
+            parser.error("--from cannot be combined with --date or --daemon")
+        date_to = args.date_to or config.today
+        if args.date_from > date_to:
+            parser.error("--from must not be after --to")
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        failed = 0
+        with new_session(config.max_workers) as session:
+            for cfg in configs:
+                try:
+                    backfill_range(
+                        cfg, args.date_from, date_to, args.missing_only, session
+                    )
+                except Exception as e:
+                    failed += 1
+                    logger.exception(
+                        "❌ %s/%s: backfill failed: %s", cfg.account, cfg.currency, e
+                    )
+        if failed:
+            raise SystemExit(f"{failed} of {len(configs)} backfills failed")
+        return
+
+    if args.stream:
+        if args.date or args.daemon or args.sample:
+            parser.error("--stream cannot be combined with --date or --daemon")
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        stream_balances(configs)
+        return
+
+    if args.daemon or args.sample:
+        if args.date:
+            parser.error("--daemon cannot be combined with --date")
+        configs = load_profiles(config, args.profiles) if args.profiles else [config]
+        run_daemon(configs, sample=args.sample)
+        return
+
+    if args.profiles:
+        results = log_profiles(load_profiles(config, args.profiles), target_date)
+        failed = [r for r in results if r.error is not None]
+        if failed:
+            raise SystemExit(f"{len(failed)} of {len(results)} profiles failed")
+        return
+
+    if not args.force and already_logged(config, target_date):
+        if target_date == config.today:
+            logger.warning("🟡 Already logged today — skipping.")
+        else:
+            logger.warning("🟡 Already logged %s — skipping.", target_date)
+        return
+
+    with claim_date(config, target_date, force=args.force) as claimed:
+        if not claimed:
+            logger.warning(
+                "🟡 %s is being logged by another run — skipping.", target_date
+            )
+            return
+        try:
+            balance, previous_balance, breakdown = fetch_with_previous(
+                config, target_date
+            )
+            record_balance(config, target_date, balance, previous_balance, breakdown)
+        except Exception as e:
+            logger.exception("❌ Error: %s", e)
+            raise
 
 
 if __name__ == "__main__":  # pragma: no cover - CLI entry point
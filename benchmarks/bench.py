@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""Benchmark the fetcher against a local KuCoin stand-in and synthetic vaults.
+
+Run from the repository root::
+
+    python benchmarks/bench.py                         # 1k, 10k and 100k notes
+    python benchmarks/bench.py --sizes 1000 --output results.json
+    python benchmarks/bench.py --baseline 0.4.0             # committed release run
+    python benchmarks/bench.py --stress 32             # concurrent-run stress test
+
+The API benchmark drives the real ``fetch_futures_balance`` path (signing,
+rate limiter, retries with backoff) over HTTP against a local server that
+injects latency and errors. The vault benchmarks time ``read_previous_balance``,
+``write_balance`` and ``already_logged``/``mark_logged`` against generated
+balance folders. Results are printed as a table and can be written as JSON;
+with ``--baseline`` the run exits non-zero if any median latency regressed by
+more than ``--tolerance``. Each release's results are committed as
+``benchmarks/baselines/<version>.json``; ``--baseline <version>`` picks one.
+
+``--stress N`` instead starts N processes that run the CLI for the same day
+against one ledger and stand-in at the same moment, and fails unless exactly
+one of them fetched and wrote the note and the p99 run time stayed under
+``--p99-limit``.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from balancefetcher import start
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+BASELINES = ROOT / "benchmarks" / "baselines"
+NOISE_FLOOR_MS = 1.0
+FIRST_DAY = date(2000, 1, 1)
+
+
+@dataclass
+class Result:
+    """Latency distribution of one benchmarked operation."""
+
+    name: str
+    size: int
+    ops: int
+    errors: int
+    ops_per_s: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Return the nearest-rank percentile of already sorted values."""
+
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def measure(name: str, size: int, ops: int, func: Callable[[int], None]) -> Result:
+    """Call ``func(i)`` ``ops`` times and summarise the latencies.
+
+    Exceptions are counted as errors; their latency is still recorded.
+    """
+
+    latencies = []
+    errors = 0
+    began = time.perf_counter()
+    for i in range(ops):
+        t0 = time.perf_counter()
+        try:
+            func(i)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    return Result(
+        name=name,
+        size=size,
+        ops=ops,
+        errors=errors,
+        ops_per_s=round(ops / elapsed, 1) if elapsed else 0.0,
+        p50_ms=round(percentile(latencies, 50) * 1000, 3),
+        p95_ms=round(percentile(latencies, 95) * 1000, 3),
+        p99_ms=round(percentile(latencies, 99) * 1000, 3),
+        max_ms=round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    )
+
+
+# ---------------------------------------------------------------------------
+# KuCoin stand-in
+# ---------------------------------------------------------------------------
+
+
+class KucoinStandIn:
+    """Local HTTP server answering ``/api/v1/account-overview``.
+
+    Each request waits ``latency`` seconds (plus up to ``jitter``), then fails
+    with a 500 with probability ``error_rate`` or a 429 with probability
+    ``throttle_rate``. Unsigned requests get a 401, so the benchmark fails
+    loudly if the signing path is skipped.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.requests = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # keep-alive replies without ACK delays
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                    delay = latency + server.random.uniform(0, jitter)
+                    roll = server.random.random()
+                time.sleep(delay)
+                if not self.headers.get("KC-API-SIGN"):
+                    self.reply(401, {"code": "400001", "msg": "unsigned"})
+                elif roll < error_rate:
+                    self.reply(500, {"code": "500000", "msg": "injected"})
+                elif roll < error_rate + throttle_rate:
+                    self.reply(429, {"code": "429000", "msg": "throttled"})
+                else:
+                    self.reply(
+                        200, {"code": "200000", "data": {"accountEquity": 1234.5}}
+                    )
+
+            def reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def bench_fetch(args: argparse.Namespace, workdir: str) -> List[Result]:
+    """Time ``fetch_futures_balance`` over a pooled session to the stand-in."""
+
+    import requests
+
+    results = []
+    scenarios = [("fetch", 0.0, 0.0), ("fetch_faulty", args.error_rate, 0.02)]
+    for name, error_rate, throttle_rate in scenarios:
+        server = KucoinStandIn(
+            args.latency, args.jitter, error_rate, throttle_rate, args.seed
+        )
+        config = start.Config(
+            "bench-key",
+            "bench-secret",
+            "bench-pass",
+            cache_file=os.path.join(workdir, f"{name}.sqlite3"),
+            api_retry_wait=0.001,
+            api_max_retries=5,
+            api_rate_limit=0,
+        )
+        original_url = start.KUCOIN_FUTURES_URL
+        start.KUCOIN_FUTURES_URL = server.url
+        try:
+            with requests.Session() as session:
+                results.append(
+                    measure(
+                        name,
+                        0,
+                        args.requests,
+                        lambda i: start.fetch_futures_balance(config, session),
+                    )
+                )
+        finally:
+            start.KUCOIN_FUTURES_URL = original_url
+            server.close()
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Synthetic vaults
+# ---------------------------------------------------------------------------
+
+
+def make_vault(root: str, size: int, layout: str) -> start.Config:
+    """Write ``size`` consecutive daily notes and a matching ledger."""
+
+    config = start.Config(
+        "bench-key",
+        "bench-secret",
+        "bench-pass",
+        vault_path=root,
+        vault_layout=layout,
+        cache_file=os.path.join(root, "ledger.sqlite3"),
+    )
+    dates = [(FIRST_DAY + timedelta(days=i)).isoformat() for i in range(size)]
+    rng = random.Random(size)
+    for date_str in dates:
+        path = start.note_path(config, date_str)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        balance = rng.uniform(500, 1500)
+        with open(path, "w") as f:
+            f.write(f"---\ndate: {date_str}\nbalance: {balance:.2f}\n---\n")
+    with start.open_ledger(config) as ledger:
+        ledger.add(config.account, config.currency, dates)
+    return config
+
+
+def bench_vault(args: argparse.Namespace, size: int, workdir: str) -> List[Result]:
+    """Time the vault and ledger helpers against a ``size``-note folder."""
+
+    root = os.path.join(workdir, f"vault-{size}")
+    config = make_vault(root, size, args.layout)
+    last = FIRST_DAY + timedelta(days=size - 1)
+    rng = random.Random(args.seed)
+    probes = [
+        (FIRST_DAY + timedelta(days=rng.randrange(1, size + 30))).isoformat()
+        for _ in range(args.ops)
+    ]
+    new_days = [(last + timedelta(days=i + 1)).isoformat() for i in range(args.ops)]
+
+    def read_previous(i: int) -> None:
+        start.read_previous_balance(config, probes[i])
+
+    results = [
+        measure("read_previous_balance_cold", size, 1, read_previous),
+        measure("read_previous_balance", size, args.ops, read_previous),
+        measure(
+            "write_balance",
+            size,
+            args.ops,
+            lambda i: start.write_balance(config, new_days[i], 1000.0 + i),
+        ),
+        measure(
+            "already_logged",
+            size,
+            args.ops,
+            lambda i: start.already_logged(config, probes[i]),
+        ),
+        measure(
+            "mark_logged",
+            size,
+            args.ops,
+            lambda i: start.mark_logged(config, new_days[i]),
+        ),
+    ]
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Concurrent-run stress test
+# ---------------------------------------------------------------------------
+
+
+def _stress_worker(url, env, cache_file, go, results) -> None:
+    """Run the CLI once the ``go`` event fires and report how it went."""
+
+    os.environ.update(env)
+    start.KUCOIN_FUTURES_URL = url
+    start.logger.setLevel(logging.CRITICAL)
+    go.wait()
+    t0 = time.perf_counter()
+    error = ""
+    try:
+        start.main(["--cache-file", cache_file])
+    except BaseException as e:  # SystemExit included
+        error = repr(e)
+    wrote = start.METRICS.counters.get("notes_written", 0) > 0
+    results.put((time.perf_counter() - t0, wrote, error))
+
+
+def run_stress(args: argparse.Namespace) -> int:
+    """Race ``args.stress`` processes for one day and check the outcome."""
+
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+    server = KucoinStandIn(args.latency, args.jitter, seed=args.seed)
+    with tempfile.TemporaryDirectory(prefix="balancefetcher-stress-") as workdir:
+        env = {
+            "KUCOIN_API_KEY": "bench-key",
+            "KUCOIN_API_SECRET": "bench-secret",
+            "KUCOIN_API_PASSPHRASE": "bench-pass",
+            "OBSIDIAN_VAULT_PATH": os.path.join(workdir, "vault"),
+            "BALANCE_RESPONSE_TTL": "0",
+        }
+        cache_file = os.path.join(workdir, "ledger.sqlite3")
+        go = ctx.Event()
+        queue = ctx.Queue()
+        workers = [
+            ctx.Process(
+                target=_stress_worker, args=(server.url, env, cache_file, go, queue)
+            )
+            for _ in range(args.stress)
+        ]
+        try:
+            for worker in workers:
+                worker.start()
+            time.sleep(0.2)  # let every process reach the starting line
+            go.set()
+            outcomes = [queue.get(timeout=120) for _ in workers]
+        finally:
+            for worker in workers:
+                worker.join(timeout=10)
+            server.close()
+
+    latencies = sorted(seconds for seconds, _, _ in outcomes)
+    writers = sum(wrote for _, wrote, _ in outcomes)
+    errors = [error for _, _, error in outcomes if error]
+    p99 = percentile(latencies, 99)
+    print(
+        f"{args.stress} processes: {writers} wrote the note, {server.requests} "
+        f"balance requests, {len(errors)} errors, p50 "
+        f"{percentile(latencies, 50) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms"
+    )
+    failures = []
+    if writers != 1 or server.requests != 1:
+        failures.append("expected exactly one fetch and one write")
+    if errors:
+        failures.append(f"runs failed: {errors[0]}")
+    if p99 > args.p99_limit:
+        failures.append(f"p99 above the {args.p99_limit * 1000:.0f} ms limit")
+    for failure in failures:
+        print(f"STRESS FAILURE: {failure}")
+    return 1 if failures else 0
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+
+def project_version() -> str:
+    """Return the version declared in ``pyproject.toml``."""
+
+    text = (ROOT / "pyproject.toml").read_text()
+    match = re.search(r'^version = "([^"]+)"', text, re.MULTILINE)
+    return match.group(1) if match else "unknown"
+
+
+def print_table(results: List[Result]) -> None:
+    header = (
+        f"{'benchmark':<28}{'notes':>8}{'ops':>7}{'err':>5}"
+        f"{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r.name:<28}{r.size:>8}{r.ops:>7}{r.errors:>5}{r.ops_per_s:>10.1f}"
+            f"{r.p50_ms:>10.3f}{r.p95_ms:>10.3f}{r.p99_ms:>10.3f}{r.max_ms:>10.3f}"
+        )
+
+
+def compare(results: List[Result], baseline: dict, tolerance: float) -> List[str]:
+    """Return a description of every median that regressed past ``tolerance``.
+
+    Slowdowns of less than :data:`NOISE_FLOOR_MS` are ignored: sub-millisecond
+    medians easily double between two runs of the same code.
+    """
+
+    previous: Dict[tuple, dict] = {
+        (r["name"], r["size"]): r for r in baseline.get("results", [])
+    }
+    regressions = []
+    for r in results:
+        old = previous.get((r.name, r.size))
+        if not old or r.ops == 1 or r.p50_ms - old["p50_ms"] < NOISE_FLOOR_MS:
+            continue
+        if r.p50_ms > old["p50_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{r.name} ({r.size} notes): p50 {old['p50_ms']:.3f} ms -> "
+                f"{r.p50_ms:.3f} ms since {baseline.get('version', '?')}"
+            )
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SIZES),
+        help="Vault sizes in notes (default 1000 10000 100000)",
+    )
+    parser.add_argument("--ops", type=int, default=200, help="Calls per vault bench")
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Calls per API benchmark"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.002, help="Stand-in latency in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.002, help="Extra random stand-in latency"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.1,
+        help="Share of 500 responses in the faulty API benchmark",
+    )
+    parser.add_argument(
+        "--layout", choices=start.VAULT_LAYOUTS, default="flat", help="Vault layout"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--stress",
+        type=int,
+        metavar="N",
+        help="Race N processes logging the same day instead of benchmarking",
+    )
+    parser.add_argument(
+        "--p99-limit",
+        type=float,
+        default=2.0,
+        help="Maximum p99 run time in seconds for --stress (default 2)",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--baseline",
+        help="Compare with an earlier results file or a version in baselines/",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Allowed median slowdown against the baseline (default 0.5)",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    start.logger.setLevel(logging.CRITICAL)
+    if args.stress:
+        return run_stress(args)
+
+    with tempfile.TemporaryDirectory(prefix="balancefetcher-bench-") as workdir:
+        results = bench_fetch(args, workdir)
+        for size in args.sizes:
+            results += bench_vault(args, size, workdir)
+
+    print_table(results)
+    report = {
+        "version": project_version(),
+        "python": sys.version.split()[0],
+        "layout": args.layout,
+        "results": [asdict(r) for r in results],
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    if args.baseline:
+        path = Path(args.baseline)
+        if not path.exists():
+            path = BASELINES / f"{args.baseline}.json"
+        baseline = json.loads(path.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
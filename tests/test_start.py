@@ -4,6 +4,7 @@ import importlib.util
 import logging
 import json
 import threading
+import time
 from datetime import datetime
 import requests
 import pytest
@@ -18,6 +19,15 @@ sys.modules[spec.name] = start
 spec.loader.exec_module(start)
 
 
+def logged_rows(cache_file):
+    import sqlite3
+
+    with sqlite3.connect(cache_file) as conn:
+        return conn.execute(
+            "SELECT account, currency, date FROM logged ORDER BY 1, 2, 3"
+        ).fetchall()
+
+
 @pytest.fixture
 def config(tmp_path):
     return start.Config(
@@ -26,6 +36,7 @@ def config(tmp_path):
         api_passphrase="testpass",
         vault_path=str(tmp_path),
         cache_file=str(tmp_path / "cache.json"),
+        response_ttl=0,
     )
 
 
@@ -81,6 +92,7 @@ def test_fetch_futures_balance_retries(monkeypatch, config):
     config.api_retry_wait = 1
     waits = []
     monkeypatch.setattr(start.time, "sleep", lambda s: waits.append(s))
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
     assert start.fetch_futures_balance(config) == 123.45
     assert session.calls == 3
     assert waits == [1, 2]
@@ -138,12 +150,41 @@ def test_write_and_read_balance(config, tmp_path):
     assert start.read_previous_balance(config, "2024-01-02") == 123.45
 
 
-def test_read_previous_balance_creates_placeholder(config, tmp_path):
+def test_read_previous_balance_creates_no_placeholder(config, tmp_path):
     balance = start.read_previous_balance(config, "2024-01-02")
-    placeholder = tmp_path / config.balance_folder / "2024-01-01.md"
     assert balance == 0.0
-    assert placeholder.exists()
-    assert "balance: 0.00" in placeholder.read_text()
+    assert not (tmp_path / config.balance_folder / "2024-01-01.md").exists()
+
+
+def test_read_previous_balance_skips_gaps_and_placeholders(
+    monkeypatch, config, tmp_path
+):
+    for day, balance in [
+        ("2024-01-01", 90.0),
+        ("2024-01-05", 100.0),
+        ("2024-01-06", 0.0),
+        ("2024-01-10", 110.0),
+    ]:
+        start.write_balance(config, day, balance)
+    folder = tmp_path / config.balance_folder
+    assert start.read_previous_balance(config, "2024-01-09") == 100.0
+    assert start.read_previous_balance(config, "2024-01-05") == 90.0
+    assert start.read_previous_balance(config, "2024-01-01") == 0.0
+
+    scans = []
+    real_scandir = start.os.scandir
+    monkeypatch.setattr(
+        start.os, "scandir", lambda path: scans.append(path) or real_scandir(path)
+    )
+    for day in ["2024-01-07", "2024-01-08", "2024-01-11"]:
+        start.read_previous_balance(config, day)
+    assert scans == []
+    assert sorted(p.name for p in folder.glob("*.md")) == [
+        "2024-01-01.md",
+        "2024-01-05.md",
+        "2024-01-06.md",
+        "2024-01-10.md",
+    ]
 
 
 def test_mark_and_already_logged(config):
@@ -164,9 +205,7 @@ def test_mark_logged_thread_safe(config):
         t.start()
     for t in threads:
         t.join()
-    with open(config.cache_file) as f:
-        data = json.load(f)
-    assert data["last_logged_date"] == "2024-01-01"
+    assert logged_rows(config.cache_file) == [("default", "USDT", "2024-01-01")]
 
 
 def test_read_previous_balance_invalid_yaml(config, tmp_path, caplog):
@@ -252,9 +291,9 @@ def test_main_cache_file_cli_override(monkeypatch, tmp_path):
     }.items():
         monkeypatch.setenv(key, value)
 
-    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg: 0.0)
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg, session=None: 0.0)
     monkeypatch.setattr(start, "read_previous_balance", lambda cfg, d: 0.0)
-    monkeypatch.setattr(start, "write_balance", lambda cfg, d, b: None)
+    monkeypatch.setattr(start, "write_balance", lambda cfg, d, b, breakdown=None: None)
 
     start.main(["--cache-file", str(cache_path)])
     assert cache_path.exists()
@@ -271,7 +310,7 @@ def test_main_logs_balance_and_cache(monkeypatch, tmp_path, caplog):
     }.items():
         monkeypatch.setenv(key, value)
 
-    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg: 100.0)
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg, session=None: 100.0)
     monkeypatch.setattr(start, "read_previous_balance", lambda cfg, d: 90.0)
 
     with caplog.at_level(logging.INFO):
@@ -282,9 +321,1662 @@ def test_main_logs_balance_and_cache(monkeypatch, tmp_path, caplog):
     assert "balance: 100.00" in balance_file.read_text()
 
     assert cache_path.exists()
-    with cache_path.open() as f:
-        data = json.load(f)
-    assert data["last_logged_date"] == today
+    assert logged_rows(cache_path) == [("default", "USDT", today)]
 
     assert "Logged balance" in caplog.text
     assert "Change since previous day" in caplog.text
+
+
+def write_profiles(tmp_path, text):
+    path = tmp_path / "profiles.yaml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_profiles_expands_accounts_and_currencies(monkeypatch, config, tmp_path):
+    monkeypatch.setenv("SUB_SECRET", "subsecret")
+    path = write_profiles(
+        tmp_path,
+        "currencies: [USDT]\n"
+        "accounts:\n"
+        "  - {name: main, api_key: k1, api_secret: s1, api_passphrase: p1,\n"
+        "     currencies: [USDT, XBT]}\n"
+        "  - {name: sub, api_key: k2, api_secret: '${SUB_SECRET}',\n"
+        "     api_passphrase: p2, balance_folder: Custom/Sub}\n",
+    )
+    configs = start.load_profiles(config, path)
+    assert [(c.account, c.currency) for c in configs] == [
+        ("main", "USDT"),
+        ("main", "XBT"),
+        ("sub", "USDT"),
+    ]
+    assert configs[1].balance_folder == "Trading/Balances/KuCoin/main/XBT"
+    assert configs[2].balance_folder == "Custom/Sub"
+    assert configs[2].api_secret == "subsecret"
+    assert {c.cache_file for c in configs} == {config.cache_file}
+
+
+def test_load_profiles_uppercases_currency_lists(config, tmp_path):
+    path = write_profiles(
+        tmp_path,
+        "currencies: [usdt]\n"
+        "accounts:\n"
+        "  - {name: main, api_key: k1, api_secret: s1, api_passphrase: p1,\n"
+        "     currencies: [usdt, ' xbt']}\n"
+        "  - {name: sub, api_key: k2, api_secret: s2, api_passphrase: p2}\n",
+    )
+    configs = start.load_profiles(config, path)
+    assert [(c.account, c.currency) for c in configs] == [
+        ("main", "USDT"),
+        ("main", "XBT"),
+        ("sub", "USDT"),
+    ]
+    assert configs[1].balance_folder == "Trading/Balances/KuCoin/main/XBT"
+
+    config.base_currency = "USDT"
+    (total, _) = start.load_profiles(config, path)
+    assert total.currencies == ["USDT", "XBT"]
+
+
+def test_load_profiles_missing_credentials(config, tmp_path):
+    path = write_profiles(tmp_path, "accounts:\n  - {name: main, api_key: k}\n")
+    with pytest.raises(SystemExit) as exc:
+        start.load_profiles(config, path)
+    assert "api_secret" in str(exc.value)
+
+
+def test_log_profiles_isolates_failures(monkeypatch, config, tmp_path):
+    config.today = "2024-01-01"
+    path = write_profiles(
+        tmp_path,
+        "accounts:\n"
+        "  - {name: good, api_key: k1, api_secret: s1, api_passphrase: p1}\n"
+        "  - {name: bad, api_key: k2, api_secret: s2, api_passphrase: p2}\n",
+    )
+    configs = start.load_profiles(config, path)
+    sessions = set()
+
+    def fake_fetch(cfg, session):
+        sessions.add(id(session))
+        if cfg.account == "bad":
+            raise RuntimeError("invalid key")
+        return 42.0
+
+    monkeypatch.setattr(start, "fetch_futures_balance", fake_fetch)
+    results = start.log_profiles(configs, "2024-01-01")
+    assert [r.balance for r in results] == [42.0, None]
+    assert isinstance(results[1].error, RuntimeError)
+    assert len(sessions) == 1
+    note = tmp_path / "Trading/Balances/KuCoin/good/USDT/2024-01-01.md"
+    assert "balance: 42.00" in note.read_text()
+
+    # A second run skips the profile that already succeeded.
+    results = start.log_profiles(configs, "2024-01-01")
+    assert results[0].skipped and not results[1].skipped
+
+
+def test_main_profiles_reports_failures(monkeypatch, tmp_path):
+    monkeypatch.setenv("OBSIDIAN_VAULT_PATH", str(tmp_path))
+    for var in ["KUCOIN_API_KEY", "KUCOIN_API_SECRET", "KUCOIN_API_PASSPHRASE"]:
+        monkeypatch.delenv(var, raising=False)
+    path = write_profiles(
+        tmp_path,
+        "accounts:\n  - {name: bad, api_key: k, api_secret: s, api_passphrase: p}\n",
+    )
+
+    def fail(cfg, session):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(start, "fetch_futures_balance", fail)
+    with pytest.raises(SystemExit) as exc:
+        start.main(["--profiles", path, "--cache-file", str(tmp_path / "c.json")])
+    assert "1 of 1 profiles failed" in str(exc.value)
+
+
+def test_run_daemon_logs_each_new_day(monkeypatch, config, tmp_path):
+    days = iter(["2024-01-01", "2024-01-01", "2024-01-02"])
+    stop = threading.Event()
+
+    def fake_today():
+        try:
+            return next(days)
+        except StopIteration:
+            stop.set()
+            return "2024-01-02"
+
+    sessions = []
+
+    def fake_fetch(cfg, session):
+        sessions.append(session)
+        return 10.0 * len(sessions)
+
+    monkeypatch.setattr(start, "_today", fake_today)
+    monkeypatch.setattr(start, "fetch_futures_balance", fake_fetch)
+    config.poll_interval = 0
+    start.run_daemon([config], stop)
+
+    folder = tmp_path / config.balance_folder
+    assert "balance: 10.00" in (folder / "2024-01-01.md").read_text()
+    assert "balance: 20.00" in (folder / "2024-01-02.md").read_text()
+    assert len(sessions) == 2 and sessions[0] is sessions[1]
+
+
+def test_run_daemon_stops_on_sigterm(monkeypatch, config):
+    import os
+    import signal
+
+    def fake_fetch(cfg, session):
+        os.kill(os.getpid(), signal.SIGTERM)
+        return 1.0
+
+    monkeypatch.setattr(start, "fetch_futures_balance", fake_fetch)
+    previous = signal.getsignal(signal.SIGTERM)
+    config.poll_interval = 60
+    start.run_daemon([config])
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+class RoutedResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class RoutedSession:
+    """Fake session answering KuCoin endpoints from a routing function."""
+
+    def __init__(self, route):
+        self.route = route
+        self.urls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def close(self):
+        pass
+
+    def get(self, url, headers=None, timeout=None):
+        self.urls.append(url)
+        return RoutedResponse(self.route(url))
+
+    post = get
+
+
+def ms(day, hour=12):
+    return int(datetime.strptime(f"{day} {hour}", "%Y-%m-%d %H").timestamp() * 1000)
+
+
+def test_iter_transaction_history_pages_with_offset(config):
+    def route(url):
+        if "offset=2" in url:
+            return {"data": {"hasMore": False, "dataList": [{"offset": 3}]}}
+        return {"data": {"hasMore": True, "dataList": [{"offset": 1}, {"offset": 2}]}}
+
+    session = RoutedSession(route)
+    start_day = datetime(2024, 1, 1)
+    records = list(
+        start.iter_transaction_history(
+            config, start_day, start_day + start.HISTORY_WINDOW, session
+        )
+    )
+    assert [r["offset"] for r in records] == [1, 2, 3]
+    assert len(session.urls) == 2
+
+
+def test_backfill_range_batches_writes(monkeypatch, config, tmp_path):
+    config.today = "2024-01-10"
+    folder = tmp_path / config.balance_folder
+    folder.mkdir(parents=True)
+    (folder / "2023-12-31.md").write_text("---\ndate: 2023-12-31\nbalance: 90\n---\n")
+    (folder / "2024-01-02.md").write_text("---\ndate: 2024-01-02\nbalance: 5\n---\n")
+    history = [
+        {"time": ms("2024-01-01", 9), "accountEquity": 99, "offset": 1},
+        {"time": ms("2024-01-01", 20), "accountEquity": 100, "offset": 2},
+        {"time": ms("2024-01-03"), "accountEquity": 103, "offset": 3},
+    ]
+    session = RoutedSession(
+        lambda url: {"data": {"hasMore": False, "dataList": history}}
+    )
+    locks = []
+    real_transaction = start.LoggedLedger.transaction
+
+    def counting_transaction(self):
+        if not self.conn.in_transaction:
+            locks.append(1)
+        return real_transaction(self)
+
+    monkeypatch.setattr(start.LoggedLedger, "transaction", counting_transaction)
+    # other runs can still claim days while the notes are being written
+    monkeypatch.setattr(start, "CLAIM_BUSY_DEADLINE", 0)
+    real_write = start.write_balance
+
+    def probing_write(cfg, day, *args, **kwargs):
+        with start.claim_date(cfg, "2030-01-01") as claimed:
+            assert claimed
+        return real_write(cfg, day, *args, **kwargs)
+
+    monkeypatch.setattr(start, "write_balance", probing_write)
+
+    written = start.backfill_range(
+        config, "2024-01-01", "2024-01-04", missing_only=True, session=session
+    )
+    assert written == {"2024-01-01": 100.0, "2024-01-03": 103.0}
+    assert len(locks) == 1
+    assert "balance: 5" in (folder / "2024-01-02.md").read_text()
+    assert not (folder / "2024-01-04.md").exists()
+    assert not start.already_logged(config, "2024-01-04")
+
+
+def test_backfill_range_keeps_notes_it_has_no_new_data_for(config, tmp_path):
+    config.today = "2024-01-10"
+    folder = tmp_path / config.balance_folder
+    for ts, equity in [(1, 100.0), (2, 90.0), (3, 105.0)]:
+        start.append_sample(config, "2024-01-01", ts, equity)
+    start.rollup_day(config, "2024-01-01")
+    note = folder / "2024-01-01.md"
+    note.write_text(note.read_text() + "Journal entry.\n")
+    before = note.read_text()
+    history = [{"time": ms("2024-01-02"), "accountEquity": 102, "offset": 1}]
+    session = RoutedSession(
+        lambda url: {"data": {"hasMore": False, "dataList": history}}
+    )
+
+    written = start.backfill_range(config, "2024-01-01", "2024-01-02", session=session)
+    assert written == {"2024-01-02": 102.0}
+    assert note.read_text() == before
+
+
+def test_backfill_range_uses_live_balance_for_today(monkeypatch, config, tmp_path):
+    config.today = "2024-01-02"
+    session = RoutedSession(lambda url: {"data": {"hasMore": False, "dataList": []}})
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg, s: 55.0)
+    written = start.backfill_range(config, "2024-01-01", "2024-01-02", session=session)
+    assert written == {"2024-01-02": 55.0}
+    assert start.already_logged(config, "2024-01-02")
+
+
+def test_main_rejects_to_without_from(monkeypatch, tmp_path):
+    for key in ["KUCOIN_API_KEY", "KUCOIN_API_SECRET", "KUCOIN_API_PASSPHRASE"]:
+        monkeypatch.setenv(key, "x")
+    monkeypatch.setenv("OBSIDIAN_VAULT_PATH", str(tmp_path))
+    with pytest.raises(SystemExit):
+        start.main(["--to", "2024-01-02"])
+
+
+def test_balance_index_skips_parsing_unchanged_notes(monkeypatch, config, tmp_path):
+    start.write_balance(config, "2024-01-01", 10.0)
+    start.write_balance(config, "2024-01-03", 30.0)
+
+    def no_parse(path):
+        raise AssertionError(f"unexpected parse of {path}")
+
+    monkeypatch.setattr(start, "read_note_balance", no_parse)
+    assert start.read_previous_balance(config, "2024-01-02") == 10.0
+    with start.BalanceIndex(config) as index:
+        index.refresh()
+        assert index.series("2024-01-01", "2024-01-31") == [
+            ("2024-01-01", 10.0),
+            ("2024-01-03", 30.0),
+        ]
+
+
+def test_balance_index_lives_outside_the_vault(config, tmp_path):
+    import os
+
+    folder = tmp_path / config.balance_folder
+    folder.mkdir(parents=True)
+    (folder / start.LEGACY_INDEX_NAME).write_bytes(b"old index")
+    start.write_balance(config, "2024-01-01", 10.0)
+
+    index_file = start.index_path(config)
+    assert os.path.dirname(index_file) == config.cache_file + ".index"
+    assert os.path.exists(index_file)
+    assert not any(p.name.startswith(".") for p in folder.iterdir())
+
+    other = start.replace(config, balance_folder="Other/Balances")
+    assert start.index_path(other) != index_file
+
+
+def test_balance_index_rescans_hand_edited_and_deleted_notes(config, tmp_path):
+    import os
+
+    start.write_balance(config, "2024-01-01", 10.0)
+    start.write_balance(config, "2024-01-02", 20.0)
+    folder = tmp_path / config.balance_folder
+    edited = folder / "2024-01-01.md"
+    edited.write_text("---\ndate: 2024-01-01\nbalance: 11.5\ntags: [edited]\n---\n")
+    st = edited.stat()
+    os.utime(edited, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    (folder / "2024-01-02.md").unlink()
+
+    assert start.load_balance_series(config, "2024-01-01", "2024-01-31") == {
+        "2024-01-01": 11.5
+    }
+    assert start.read_previous_balance(config, "2024-01-02") == 11.5
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "---\ndate: 2024-01-01\nbalance: 123.45\n---\n",
+        "---\ndate: 2024-01-01\nbalance: -5.00\n---\n# Notes\nbody text\n",
+        "---\ndate: 2024-01-01\nbalance: 0.00\n---",
+        "---\ndate: 2024-01-01\nbalance: 100\n---\n",
+        "---\ndate: 2024-01-01\nbalance: 010\n---\n",
+        "---\ndate: 2024-01-01\nbalance: 1_000.5\n---\n",
+        "---\ndate: 2024-01-01\nbalance: 12.5\ntags: [edited]\n---\n",
+        "---\nbalance: 7.25\ndate: 2024-01-01\n---\n",
+        "---\r\ndate: 2024-01-01\r\nbalance: 3.5\r\n---\r\n",
+        "---\ndate: 2024-01-01\nbalance: 9.99  # corrected\n---\n",
+    ],
+)
+def test_read_note_balance_fast_path_matches_yaml(tmp_path, content):
+    path = tmp_path / "note.md"
+    path.write_bytes(content.encode())
+    assert start.read_note_balance(str(path)) == start.parse_note_balance(str(path))
+
+
+def test_read_note_balance_fast_path_skips_yaml(monkeypatch, tmp_path):
+    path = tmp_path / "note.md"
+    path.write_text("---\ndate: 2024-01-01\nbalance: 123.45\n---\n")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("YAML parser used for canonical note")
+
+    monkeypatch.setattr(start.frontmatter, "loads", fail)
+    assert start.read_note_balance(str(path)) == 123.45
+
+
+def test_read_note_balance_handles_long_headers(tmp_path):
+    path = tmp_path / "note.md"
+    digits = "9" * start.NOTE_HEADER_BYTES
+    path.write_text(f"---\ndate: 2024-01-01\nbalance: {digits}\n---\n")
+    assert start.read_note_balance(str(path)) == float(digits)
+
+
+SKIP_PATH_BUDGET_MS = 50
+HEAVY_MODULES = ("requests", "yaml", "frontmatter", "filelock")
+
+
+def _import_ms_after_startup(stderr):
+    """Sum top-level ``-X importtime`` entries recorded after ``site``."""
+
+    total, started = 0, False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == "site" and not name.startswith("  "):
+            started = True
+        elif started and not name.startswith("  "):
+            total += int(cumulative)
+    return total / 1000
+
+
+def test_already_logged_skip_path_cold_start(tmp_path):
+    import os
+    import subprocess
+
+    cache = tmp_path / "cache.json"
+    today = datetime.today().strftime("%Y-%m-%d")
+    with start.LoggedLedger(str(cache)) as ledger:
+        ledger.add("default", "USDT", [today])
+    script = "\n".join(
+        [
+            "import sys",
+            f"sys.path.insert(0, {str(Path(start.__file__).parent)!r})",
+            "import start",
+            f"start.main(['--cache-file', {str(cache)!r}])",
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+        ]
+    )
+    env = {
+        **os.environ,
+        "KUCOIN_API_KEY": "k",
+        "KUCOIN_API_SECRET": "s",
+        "KUCOIN_API_PASSPHRASE": "p",
+        "OBSIDIAN_VAULT_PATH": str(tmp_path),
+        "PYTHONPYCACHEPREFIX": str(tmp_path / "pycache"),
+    }
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    timings = []
+    for _ in range(3):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert "Already logged today" in proc.stderr
+        assert proc.stdout.strip() == "", f"heavy modules imported: {proc.stdout}"
+        timings.append(_import_ms_after_startup(proc.stderr))
+    assert min(timings) < SKIP_PATH_BUDGET_MS, timings
+
+
+def test_ledger_imports_legacy_json_cache(config, tmp_path):
+    cache = tmp_path / "cache.json"
+    cache.write_text(json.dumps({"last_logged_date": "2024-01-01"}))
+    config.currency = "XBT"
+    assert start.already_logged(config, "2024-01-01")
+    assert (tmp_path / "cache.json.legacy").exists()
+    assert logged_rows(cache) == [("default", "XBT", "2024-01-01")]
+
+
+def test_default_ledger_imports_old_default_json_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".kucoin_balance_log.json").write_text(
+        json.dumps({"last_logged_date": "2024-01-01"})
+    )
+    config = start.Config("k", "s", "p", vault_path=str(tmp_path))
+    assert config.cache_file == str(tmp_path / ".kucoin_balance_log.sqlite3")
+
+    assert start.already_logged(config, "2024-01-01")
+    assert (tmp_path / ".kucoin_balance_log.json.legacy").exists()
+    assert not (tmp_path / ".kucoin_balance_log.json").exists()
+    assert logged_rows(config.cache_file) == [("default", "USDT", "2024-01-01")]
+
+
+def test_ledger_tracks_any_date_per_account(config):
+    import sqlite3
+
+    config.today = "2024-03-01"
+    start.mark_logged(config, "2024-01-01")
+    assert start.already_logged(config, "2024-01-01")
+    assert not start.already_logged(config, "2024-01-02")
+    other = start.replace(config, account="sub")
+    assert not start.already_logged(other, "2024-01-01")
+    with sqlite3.connect(config.cache_file) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_main_backfill_date_dedupes_unless_forced(monkeypatch, tmp_path, caplog):
+    for key, value in {
+        "KUCOIN_API_KEY": "k",
+        "KUCOIN_API_SECRET": "s",
+        "KUCOIN_API_PASSPHRASE": "p",
+        "OBSIDIAN_VAULT_PATH": str(tmp_path),
+    }.items():
+        monkeypatch.setenv(key, value)
+    fetches = []
+    monkeypatch.setattr(
+        start, "fetch_futures_balance", lambda cfg, session=None: fetches.append(1)
+    )
+    monkeypatch.setattr(
+        start, "record_balance", lambda cfg, d, b, prev=None, breakdown=None: None
+    )
+    args = ["--date", "2024-01-01", "--cache-file", str(tmp_path / "c.sqlite3")]
+    config = start.Config("k", "s", "p", cache_file=str(tmp_path / "c.sqlite3"))
+    start.mark_logged(config, "2024-01-01")
+
+    with caplog.at_level(logging.WARNING):
+        start.main(args)
+    assert "Already logged 2024-01-01" in caplog.text
+    assert fetches == []
+    start.main(args + ["--force"])
+    assert fetches == [1]
+
+
+def set_env(monkeypatch, tmp_path):
+    for key, value in {
+        "KUCOIN_API_KEY": "k",
+        "KUCOIN_API_SECRET": "s",
+        "KUCOIN_API_PASSPHRASE": "p",
+        "OBSIDIAN_VAULT_PATH": str(tmp_path),
+    }.items():
+        monkeypatch.setenv(key, value)
+
+
+def test_main_exports_stage_metrics(monkeypatch, tmp_path):
+    set_env(monkeypatch, tmp_path)
+    calls = []
+
+    def route(url):
+        calls.append(url)
+        if len(calls) == 1:
+            raise requests.exceptions.ConnectionError("boom")
+        return {"data": {"accountEquity": "10"}}
+
+    monkeypatch.setattr(start.requests, "Session", lambda: RoutedSession(route))
+    monkeypatch.setattr(start.time, "sleep", lambda s: None)
+    textfile = tmp_path / "metrics" / "balancefetcher.prom"
+    json_path = tmp_path / "runs.jsonl"
+    start.main(
+        [
+            "--cache-file",
+            str(tmp_path / "cache.sqlite3"),
+            "--metrics-textfile",
+            str(textfile),
+            "--metrics-json",
+            str(json_path),
+        ]
+    )
+
+    run = json.loads(json_path.read_text().splitlines()[-1])
+    assert run["mode"] == "single" and run["success"] is True
+    # the note and its three roll-up notes
+    assert run["counters"] == {"notes_written": 4, "requests": 2, "retries": 1}
+    for stage in [
+        "load_config",
+        "sign",
+        "http",
+        "retry_sleep",
+        "ledger",
+        "vault_write",
+    ]:
+        assert stage in run["stages"]
+    prom = textfile.read_text()
+    assert 'balancefetcher_events{mode="single",event="retries"} 1' in prom
+    assert 'balancefetcher_run_success{mode="single"} 1' in prom
+
+
+def test_main_exports_failed_run(monkeypatch, tmp_path):
+    set_env(monkeypatch, tmp_path)
+
+    def fail(cfg, session=None):
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(start, "fetch_futures_balance", fail)
+    json_path = tmp_path / "runs.jsonl"
+    with pytest.raises(RuntimeError):
+        start.main(
+            [
+                "--cache-file",
+                str(tmp_path / "c.sqlite3"),
+                "--metrics-json",
+                str(json_path),
+            ]
+        )
+    assert json.loads(json_path.read_text())["success"] is False
+
+
+def test_summarize_samples_computes_ohlc_and_drawdown(tmp_path):
+    path = tmp_path / "2024-01-01.csv"
+    path.write_text("1,100\n2,120\nbad line\n3,90\n4,110\n5,1")
+    summary = start.summarize_samples(path)
+    assert (summary.open, summary.high, summary.low, summary.close) == (
+        100.0,
+        120.0,
+        90.0,
+        110.0,
+    )
+    assert summary.min_drawdown == pytest.approx(-25.0)
+    assert summary.samples == 4
+    assert start.summarize_samples(tmp_path / "missing.csv") is None
+
+
+def test_rollup_day_keeps_existing_note_fields(config, tmp_path):
+    folder = tmp_path / config.balance_folder
+    start.write_balance(config, "2024-01-01", 100.0)
+    note = folder / "2024-01-01.md"
+    note.write_text(note.read_text() + "Notes about the day.\n")
+    for ts, equity in [(1, 100.0), (2, 95.0), (3, 105.0)]:
+        start.append_sample(config, "2024-01-01", ts, equity)
+
+    start.rollup_day(config, "2024-01-01")
+    text = note.read_text()
+    assert text.startswith("---\ndate: 2024-01-01\nbalance: 100.0\n")
+    for field_line in ["high: 105.0", "low: 95.0", "close: 105.0", "samples: 3"]:
+        assert field_line in text
+    assert "min_drawdown: -5.0" in text
+    assert text.rstrip().endswith("Notes about the day.")
+    assert start.read_previous_balance(config, "2024-01-02") == 100.0
+
+
+def test_sharded_samples_roll_up_into_indexed_notes(monkeypatch, config, tmp_path):
+    config.vault_layout = "sharded"
+    folder = tmp_path / config.balance_folder
+    for ts, equity in [(1, 100.0), (2, 95.0), (3, 105.0)]:
+        start.append_sample(config, "2024-01-01", ts, equity)
+    assert (folder / ".samples" / "2024" / "01" / "2024-01-01.csv").exists()
+
+    start.rollup_day(config, "2024-01-01")
+    note = folder / "2024" / "01" / "2024-01-01.md"
+    assert "samples: 3" in note.read_text()
+
+    def no_parse(path):
+        raise AssertionError(f"unexpected parse of {path}")
+
+    # the index already holds the rolled-up note, so nothing is re-parsed
+    monkeypatch.setattr(start, "read_note_balance", no_parse)
+    assert start.read_previous_balance(config, "2024-01-02") == 100.0
+
+    monkeypatch.undo()
+    config.vault_layout = "flat"
+    start.migrate_layout(config, "flat")
+    assert (folder / ".samples" / "2024-01-01.csv").exists()
+    assert not (folder / ".samples" / "2024").exists()
+
+
+def test_run_daemon_samples_and_rolls_up_on_rollover(monkeypatch, config, tmp_path):
+    days = iter(["2024-01-01", "2024-01-01", "2024-01-02"])
+    stop = threading.Event()
+
+    def fake_today():
+        try:
+            return next(days)
+        except StopIteration:
+            stop.set()
+            return "2024-01-02"
+
+    equities = iter([100.0, 90.0, 110.0])
+    monkeypatch.setattr(start, "_today", fake_today)
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda c, s: next(equities))
+    config.poll_interval = 0
+    start.run_daemon([config], stop, sample=True)
+
+    folder = tmp_path / config.balance_folder
+    assert (folder / ".samples" / "2024-01-01.csv").read_text().count("\n") == 2
+    first = (folder / "2024-01-01.md").read_text()
+    assert "balance: 100.0\n" in first
+    assert "low: 90.0" in first and "close: 90.0" in first
+    assert "samples:" not in (folder / "2024-01-02.md").read_text()
+    assert logged_rows(config.cache_file) == [
+        ("default", "USDT", "2024-01-01"),
+        ("default", "USDT", "2024-01-02"),
+    ]
+
+
+def test_balance_stream_debounces_note_writes(monkeypatch, config):
+    writes = []
+    monkeypatch.setattr(
+        start, "write_balance", lambda cfg, day, value: writes.append(value)
+    )
+    config.stream_debounce = 60
+    stream = start.BalanceStream(config, None, threading.Event())
+    for equity in [1.0, 2.0, 3.0]:
+        stream.update(equity)
+    assert writes == [1.0]
+    stream.flush(force=True)
+    stream.flush(force=True)
+    assert writes == [1.0, 3.0]
+
+
+def test_stream_balances_against_local_server(monkeypatch, config, tmp_path):
+    server_mod = pytest.importorskip("websockets.sync.server")
+    connections = []
+    pings = []
+
+    def event(currency, equity):
+        return json.dumps(
+            {
+                "type": "message",
+                "topic": "/contractAccount/wallet",
+                "subject": "walletBalance.change",
+                "data": {"currency": currency, "equity": str(equity)},
+            }
+        )
+
+    def handler(ws):
+        connections.append(ws)
+        ws.send(json.dumps({"id": "1", "type": "welcome"}))
+        subscribe = json.loads(ws.recv())
+        assert subscribe["topic"] == "/contractAccount/wallet"
+        ws.send(json.dumps({"id": subscribe["id"], "type": "ack"}))
+        if len(connections) == 1:
+            ws.send(event("USDT", 101.5))
+            return  # drop the connection to force a reconnect
+        ws.send(event("XBT", 5))
+        ws.send(event("USDT", 102.25))
+        for message in ws:
+            if json.loads(message)["type"] == "ping":
+                pings.append(message)
+
+    server = server_mod.serve(handler, "127.0.0.1", 0)
+    port = server.socket.getsockname()[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def route(url):
+        if "bullet-private" in url:
+            endpoint = f"ws://127.0.0.1:{port}"
+            return {
+                "data": {
+                    "token": "t",
+                    "instanceServers": [{"endpoint": endpoint, "pingInterval": 50}],
+                }
+            }
+        return {"data": {"accountEquity": 100}}
+
+    session = RoutedSession(route)
+    monkeypatch.setattr(start, "new_session", lambda pool_size=1: session)
+    monkeypatch.setattr(start, "WS_POLL_SECONDS", 0.05)
+    config.stream_debounce = 0
+    config.api_retry_wait = 0.01
+    stop = threading.Event()
+    worker = threading.Thread(target=start.stream_balances, args=([config], stop))
+    worker.start()
+
+    note = tmp_path / config.balance_folder / f"{config.today}.md"
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if note.exists() and "balance: 102.25" in note.read_text() and pings:
+            break
+        time.sleep(0.02)
+    stop.set()
+    worker.join(5)
+    server.shutdown()
+
+    assert not worker.is_alive()
+    assert "balance: 102.25" in note.read_text()
+    assert len(connections) == 2
+    assert sum("bullet-private" in url for url in session.urls) == 2
+    assert logged_rows(config.cache_file) == [("default", "USDT", config.today)]
+
+
+def test_write_balance_skips_identical_content(monkeypatch, config, tmp_path):
+    start.write_balance(config, "2024-01-01", 100.0)
+    note = tmp_path / config.balance_folder / "2024-01-01.md"
+    before = note.stat().st_mtime_ns
+    replaced = []
+    real_replace = start.os.replace
+    monkeypatch.setattr(
+        start.os, "replace", lambda a, b: replaced.append(b) or real_replace(a, b)
+    )
+
+    start.write_balance(config, "2024-01-01", 100.001)
+    assert replaced == [] and note.stat().st_mtime_ns == before
+
+    start.write_balance(config, "2024-01-01", 101.0)
+    assert [p for p in replaced if "Rollups" not in p] == [str(note)]
+    assert "balance: 101.00" in note.read_text()
+    assert [p.name for p in note.parent.iterdir() if p.suffix == ".tmp"] == []
+
+
+def test_backfill_range_rerun_rewrites_nothing(monkeypatch, config, tmp_path):
+    history = {f"2024-01-0{d}": 100.0 + d for d in range(1, 6)}
+    monkeypatch.setattr(
+        start, "fetch_equity_history", lambda cfg, s, e, session: dict(history)
+    )
+    fsyncs = []
+    real_fsync = start.os.fsync
+    monkeypatch.setattr(
+        start.os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd)
+    )
+
+    start.backfill_range(config, "2024-01-01", "2024-01-05", session=object())
+    # five notes and three roll-ups, plus one directory barrier per batch
+    assert len(fsyncs) == 10
+
+    start.METRICS.reset("backfill")
+    fsyncs.clear()
+    start.backfill_range(config, "2024-01-01", "2024-01-05", session=object())
+    assert fsyncs == []
+    assert start.METRICS.counters.get("notes_unchanged") == 8
+    assert "notes_written" not in start.METRICS.counters
+
+
+def test_note_batch_discards_staged_files_on_error(tmp_path):
+    target = tmp_path / "2024-01-01.md"
+    with pytest.raises(RuntimeError):
+        with start.NoteBatch() as batch:
+            start.write_note(str(target), b"data", batch)
+            raise RuntimeError("boom")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_note_keeps_file_modes(tmp_path):
+    import os
+    import stat
+
+    def mode(path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+
+    old_umask = os.umask(0o022)
+    start._new_file_mode.cache_clear()
+    try:
+        new = tmp_path / "2024-01-01.md"
+        start.write_note(str(new), b"first")
+        assert mode(new) == 0o644
+
+        shared = tmp_path / "journal.md"
+        shared.write_bytes(b"old")
+        os.chmod(shared, 0o664)
+        start.write_note(str(shared), b"new")
+        assert mode(shared) == 0o664
+    finally:
+        os.umask(old_umask)
+        start._new_file_mode.cache_clear()
+
+
+def _shared_fetch_worker(config, counter):
+    def slow_fetch(cfg, session=None):
+        with open(counter, "a") as f:
+            f.write("x")
+        time.sleep(0.3)
+        return 42.0
+
+    start.fetch_futures_balance = slow_fetch
+    assert start.fetch_balance_shared(config) == 42.0
+
+
+def test_fetch_balance_shared_coalesces_processes(config, tmp_path):
+    import multiprocessing
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs fork to share the patched fetch")
+    ctx = multiprocessing.get_context("fork")
+    config.response_ttl = 30
+    counter = tmp_path / "fetches"
+    workers = [
+        ctx.Process(target=_shared_fetch_worker, args=(config, counter))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+    assert [w.exitcode for w in workers] == [0] * 4
+    assert counter.read_text() == "x"
+
+
+def test_fetch_balance_shared_refetches_after_ttl(monkeypatch, config):
+    config.response_ttl = 30
+    values = iter([1.0, 2.0])
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda c, s: next(values))
+    assert start.fetch_balance_shared(config) == 1.0
+    assert start.fetch_balance_shared(config) == 1.0
+
+    path = start.response_cache_path(config)
+    with open(path, "w") as f:
+        json.dump({"balance": 1.0, "fetched_at": time.time() - 31}, f)
+    assert start.fetch_balance_shared(config) == 2.0
+
+
+class StatusResponse:
+    def __init__(self, status, headers=None, payload=None):
+        self.status_code = status
+        self.headers = headers or {}
+        self.payload = payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code), response=self)
+
+    def json(self):
+        return self.payload
+
+
+class ScriptedSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def fake_clock(monkeypatch):
+    """Make ``time.sleep`` advance ``time.time``/``monotonic`` instantly."""
+
+    waits = []
+    real_time, real_monotonic = time.time, time.monotonic
+    offset = lambda: sum(waits)  # noqa: E731
+    monkeypatch.setattr(start.time, "sleep", lambda s: waits.append(s))
+    monkeypatch.setattr(start.time, "time", lambda: real_time() + offset())
+    monkeypatch.setattr(start.time, "monotonic", lambda: real_monotonic() + offset())
+    return waits
+
+
+def test_request_json_waits_for_rate_limit_reset(monkeypatch, config):
+    waits = fake_clock(monkeypatch)
+    monkeypatch.setattr("random.uniform", lambda low, high: 0)
+    limited = {"gw-ratelimit-remaining": "0", "gw-ratelimit-reset": "2000"}
+    session = ScriptedSession(
+        [StatusResponse(429, limited), StatusResponse(200, payload={"ok": 1})]
+    )
+    assert start.request_json(config, session, "/x") == {"ok": 1}
+    # the retry waits for the quota reset announced by the headers
+    assert 1.9 < sum(waits) <= 2.0
+    state = json.loads(open(config.cache_file + ".ratelimit.json").read())
+    assert state["default"]["failures"] == 0
+
+
+def test_request_json_ignores_malformed_rate_limit_headers(monkeypatch, config):
+    monkeypatch.setattr(start.time, "sleep", lambda s: None)
+    headers = {"gw-ratelimit-remaining": "n/a", "gw-ratelimit-reset": "soon"}
+    session = ScriptedSession([StatusResponse(200, headers, payload={"ok": 1})])
+    assert start.request_json(config, session, "/x") == {"ok": 1}
+
+
+def test_request_json_does_not_retry_client_errors(monkeypatch, config):
+    monkeypatch.setattr(start.time, "sleep", lambda s: None)
+    session = ScriptedSession([StatusResponse(401), StatusResponse(200)])
+    with pytest.raises(RuntimeError):
+        start.request_json(config, session, "/x")
+    assert session.calls == 1
+
+
+def test_request_json_circuit_breaker_fails_fast(monkeypatch, config):
+    monkeypatch.setattr(start.time, "sleep", lambda s: None)
+    config.api_max_retries = 2
+    config.circuit_threshold = 2
+    session = ScriptedSession([StatusResponse(503)] * 3)
+    with pytest.raises(RuntimeError, match="503"):
+        start.request_json(config, session, "/x")
+    with pytest.raises(RuntimeError, match="circuit open"):
+        start.request_json(config, session, "/x")
+    assert session.calls == 2
+
+
+def test_request_json_respects_deadline(monkeypatch, config):
+    monkeypatch.setattr(start.time, "sleep", lambda s: None)
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    config.api_retry_wait = 10
+    config.api_deadline = 5
+    session = ScriptedSession([StatusResponse(503)] * 3)
+    with pytest.raises(RuntimeError):
+        start.request_json(config, session, "/x")
+    assert session.calls == 1
+
+
+def test_rate_limiter_shares_bucket_across_threads(monkeypatch, config):
+    slept = []
+    monkeypatch.setattr(start.time, "sleep", lambda s: slept.append(s))
+    config.api_rate_limit = 4
+    limiter = start.rate_limiter(config)
+    deadline = time.monotonic() + 60
+    threads = [
+        threading.Thread(target=limiter.acquire, args=(config, deadline))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert slept == []
+    with pytest.raises(RuntimeError, match="deadline"):
+        limiter.acquire(config, time.monotonic())
+
+
+def test_main_overlaps_fetch_with_previous_note_read(monkeypatch, tmp_path):
+    set_env(monkeypatch, tmp_path)
+    # Each leg waits at the barrier for the other, which only returns if both
+    # are running at the same time; run sequentially the barrier breaks.
+    both_running = threading.Barrier(2, timeout=5)
+    events = []
+
+    def fetch(cfg, session=None):
+        events.append("fetch started")
+        both_running.wait()
+        events.append("fetch done")
+        return 110.0
+
+    def read(cfg, date_str):
+        events.append("read started")
+        both_running.wait()
+        events.append("read done")
+        return 100.0
+
+    monkeypatch.setattr(start, "fetch_futures_balance", fetch)
+    monkeypatch.setattr(start, "read_previous_balance", read)
+    json_path = tmp_path / "runs.jsonl"
+    start.main(
+        ["--cache-file", str(tmp_path / "c.sqlite3"), "--metrics-json", str(json_path)]
+    )
+
+    assert set(events[:2]) == {"fetch started", "read started"}
+    assert set(events[2:]) == {"fetch done", "read done"}
+    run = json.loads(json_path.read_text())
+    assert run["success"]
+    assert "overlap_saved" in run["stages"]
+
+
+def test_passphrase_signature_is_computed_once(config):
+    start._signed_passphrase.cache_clear()
+    first = start.kucoin_futures_headers(config, "/a")
+    second = start.kucoin_futures_headers(config, "/b", "POST")
+    assert first["KC-API-PASSPHRASE"] == second["KC-API-PASSPHRASE"]
+    assert start._signed_passphrase.cache_info().misses == 1
+
+
+def test_compute_analytics_matches_loop(config):
+    pytest.importorskip("numpy")
+    balances = [0.0, 100.0, 110.0, 99.0, 99.0, 120.0, 130.0, 117.0]
+    stats = start.compute_analytics(balances).stats
+
+    used = balances[1:]  # the placeholder is dropped
+    returns = [b / a - 1 for a, b in zip(used, used[1:])]
+    peak, worst = used[0], 0.0
+    for b in used:
+        peak = max(peak, b)
+        worst = min(worst, b / peak - 1)
+    mean = sum(returns) / len(returns)
+    std = (sum((r - mean) ** 2 for r in returns) / (len(returns) - 1)) ** 0.5
+
+    assert stats["days"] == 7 and stats["balance"] == 117.0
+    assert stats["total_return"] == pytest.approx(17.0)
+    assert stats["max_drawdown"] == pytest.approx(worst * 100)
+    assert stats["sharpe"] == pytest.approx(mean / std * 365**0.5)
+    assert stats["longest_win_streak"] == 2
+    assert stats["longest_loss_streak"] == 1
+    assert stats["current_streak"] == -1
+    assert stats["return_7d"] is None
+
+
+def test_compute_analytics_rolling_return_series():
+    np = pytest.importorskip("numpy")
+    balances = [100.0 + 5 * i for i in range(10)]
+    analytics = start.compute_analytics(balances)
+
+    weekly = analytics.rolling[7]
+    assert weekly.shape == (10,) and np.isnan(weekly[:7]).all()
+    assert weekly[7:].tolist() == pytest.approx(
+        [(balances[i] / balances[i - 7] - 1) * 100 for i in range(7, 10)]
+    )
+    assert analytics.stats["return_7d"] == pytest.approx(weekly[-1])
+    assert np.isnan(analytics.rolling[30]).all()
+    assert analytics.stats["return_30d"] is None
+
+
+def test_main_analytics_writes_summary_note(monkeypatch, tmp_path):
+    pytest.importorskip("numpy")
+    monkeypatch.setenv("OBSIDIAN_VAULT_PATH", str(tmp_path))
+    monkeypatch.delenv("KUCOIN_API_KEY", raising=False)
+    cache_file = str(tmp_path / "c.sqlite3")
+    config = start.Config(
+        "k", "s", "p", vault_path=str(tmp_path), cache_file=cache_file
+    )
+    for day, balance in [("2024-01-01", 100.0), ("2024-01-02", 90.0)]:
+        start.write_balance(config, day, balance)
+
+    start.main(["--analytics", "--cache-file", cache_file])
+    text = (tmp_path / config.balance_folder / "Summary.md").read_text()
+    assert "max_drawdown: -10.00" in text and "last_date: 2024-01-02" in text
+    assert '```chart\ntype: line\nlabels: ["2024-01-01", "2024-01-02"]' in text
+    assert "data: [0.0, -10.0]" in text
+    assert "## Rolling returns %" in text
+    assert "  - title: 7d return %\n    data: [null, null]\n" in text
+    assert start.load_balance_series(config, "2024-01-01", "2024-12-31") == {
+        "2024-01-01": 100.0,
+        "2024-01-02": 90.0,
+    }
+
+
+def test_rollup_buckets_use_iso_weeks():
+    assert start.rollup_buckets("2024-12-30") == [
+        ("week", "2025-W01", "2024-12-30", "2025-01-05"),
+        ("month", "2024-12", "2024-12-01", "2024-12-31"),
+        ("year", "2024", "2024-01-01", "2024-12-31"),
+    ]
+
+
+def test_write_balance_updates_only_affected_rollups(monkeypatch, config, tmp_path):
+    for day, balance in [("2024-01-30", 100.0), ("2024-01-31", 90.0)]:
+        start.write_balance(config, day, balance)
+    start.write_balance(config, "2024-02-01", 120.0)
+    rollups = tmp_path / config.balance_folder / "Rollups"
+    assert sorted(p.name for p in rollups.iterdir()) == [
+        "2024-01.md",
+        "2024-02.md",
+        "2024-W05.md",
+        "2024.md",
+    ]
+    week = (rollups / "2024-W05.md").read_text()
+    for line in ["days: 3", "open: 100.00", "low: 90.00", "close: 120.00"]:
+        assert line in week
+    assert "change_pct: 20.00" in week
+    assert "close: 90.00" in (rollups / "2024-01.md").read_text()
+
+    queried = []
+    real_series = start.BalanceIndex.series
+    monkeypatch.setattr(
+        start.BalanceIndex,
+        "series",
+        lambda self, s, e: queried.append((s, e)) or real_series(self, s, e),
+    )
+    start.write_balance(config, "2024-02-01", 80.0)
+    assert sorted(queried) == [
+        ("2024-01-01", "2024-12-31"),
+        ("2024-01-29", "2024-02-04"),
+        ("2024-02-01", "2024-02-29"),
+    ]
+    assert "low: 80.00" in (rollups / "2024-W05.md").read_text()
+
+
+class FakeKucoinHistory:
+    """Local HTTP stand-in for KuCoin's paged transaction-history endpoint."""
+
+    def __init__(self, records):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlparse
+
+        self.records = records
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = {
+                    k: int(v[0]) if v[0].isdigit() else v[0]
+                    for k, v in parse_qs(urlparse(self.path).query).items()
+                }
+                server.requests.append(query)
+                matches = [
+                    r
+                    for r in server.records
+                    if query["startAt"] <= r["time"] < query["endAt"]
+                    and r["offset"] > query.get("offset", 0)
+                ]
+                page = matches[: query["maxCount"]]
+                body = json.dumps(
+                    {"data": {"hasMore": len(matches) > len(page), "dataList": page}}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def tx(offset, day, kind="RealisedPNL", amount=1.0):
+    return {
+        "offset": offset,
+        "time": ms(day),
+        "type": kind,
+        "amount": amount,
+        "fee": 0.0,
+        "accountEquity": 100.0 + offset,
+        "status": "Completed",
+        "remark": "",
+        "currency": "USDT",
+    }
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 22)
+
+
+def test_sync_transactions_streams_pages_and_resumes(monkeypatch, config):
+    days = [f"2024-01-{d:02d}" for d in range(1, 21)]
+    records = [tx(i + 1, day) for i, day in enumerate(days)]
+    records[4] = tx(5, days[4], "TransferIn", 50.0)
+    server = FakeKucoinHistory(records)
+    monkeypatch.setattr(start, "KUCOIN_FUTURES_URL", server.url)
+    monkeypatch.setattr(start, "HISTORY_PAGE_SIZE", 2)
+    monkeypatch.setattr(start, "TRANSACTION_CHUNK", 3)
+    monkeypatch.setattr(start, "datetime", FrozenDatetime)
+    config.api_rate_limit = 0
+    config.max_workers = 3
+    try:
+        assert start.sync_transactions(config, since="2024-01-01") == 20
+        # pages after the first follow each window's offset cursor
+        assert any("offset" in q for q in server.requests)
+
+        server.records.append(tx(21, "2024-01-21", "Withdrawal", -10.0))
+        server.requests.clear()
+        assert start.sync_transactions(config) == 1
+        assert min(q["startAt"] for q in server.requests) == ms("2024-01-20")
+    finally:
+        server.close()
+
+    with start.open_ledger(config) as ledger:
+        store = start.TransactionStore(ledger)
+        assert store.cursor("default", "USDT") == ms("2024-01-21")
+        assert store.totals("default", "USDT") == {
+            "RealisedPNL": 19.0,
+            "TransferIn": 50.0,
+            "Withdrawal": -10.0,
+        }
+
+
+def make_damaged_vault(config, tmp_path):
+    folder = tmp_path / config.balance_folder
+    start.write_balance(config, "2024-01-01", 100.0)
+    start.write_balance(config, "2024-01-02", 0.0)
+    (folder / "2024-01-03.md").write_text("---\nbalance: [oops\n---\nmy notes\n")
+    start.write_balance(config, "2024-01-05", 120.0)
+    return folder
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_check_vault_reports_problem_days(monkeypatch, config, tmp_path, parallel):
+    make_damaged_vault(config, tmp_path)
+    if parallel:
+        monkeypatch.setattr(start, "PARALLEL_CHECK_MIN", 1)
+        monkeypatch.setattr(start, "VAULT_CHECK_CHUNK", 2)
+    report = start.check_vault(config, workers=2)
+    assert report.notes == 4
+    assert report.valid == {"2024-01-01": 100.0, "2024-01-05": 120.0}
+    assert list(report.malformed) == ["2024-01-03"]
+    assert report.placeholders == ["2024-01-02"]
+    assert report.missing == ["2024-01-04"]
+
+
+def test_main_vault_repair_fills_from_known_data(monkeypatch, tmp_path):
+    set_env(monkeypatch, tmp_path)
+    cache_file = str(tmp_path / "c.sqlite3")
+    config = start.Config(
+        "k", "s", "p", vault_path=str(tmp_path), cache_file=cache_file
+    )
+    folder = make_damaged_vault(config, tmp_path)
+    with start.open_ledger(config) as ledger:
+        start.TransactionStore(ledger).append(
+            "default", "USDT", [tx(1, "2024-01-04", amount=50.0)]
+        )
+
+    with pytest.raises(SystemExit, match="3 problem days"):
+        start.main(["--cache-file", cache_file, "vault", "check"])
+    # only the day the transaction history covers is repaired
+    with pytest.raises(SystemExit, match="2 problem days"):
+        start.main(["--cache-file", cache_file, "vault", "repair"])
+
+    assert "balance: 0.00" in (folder / "2024-01-02.md").read_text()
+    assert "my notes" in (folder / "2024-01-03.md").read_text()
+    assert not (folder / ".malformed").exists()
+    assert "balance: 101.00" in (folder / "2024-01-04.md").read_text()
+    rows = logged_rows(cache_file)
+    assert ("default", "USDT", "2024-01-04") in rows
+    assert ("default", "USDT", "2024-01-03") not in rows
+
+    start.main(["--cache-file", cache_file, "vault", "repair", "--carry-forward"])
+    assert "balance: 100.00" in (folder / "2024-01-02.md").read_text()
+    assert "balance: 100.00" in (folder / "2024-01-03.md").read_text()
+    assert "my notes" in (folder / ".malformed" / "2024-01-03.md").read_text()
+    start.main(["--cache-file", cache_file, "vault", "check"])
+
+
+def test_backfill_and_repair_skip_days_claimed_by_another_run(
+    monkeypatch, config, tmp_path
+):
+    folder = make_damaged_vault(config, tmp_path)
+    config.today = "2024-01-05"
+    today = folder / "2024-01-05.md"
+    placeholder = folder / "2024-01-02.md"
+    before = today.read_text(), placeholder.read_text()
+    with start.open_ledger(config) as ledger:
+        assert ledger.claim("default", "USDT", "2024-01-05", "other run")
+        assert ledger.claim("default", "USDT", "2024-01-02", "other run")
+    session = RoutedSession(lambda url: {"data": {"hasMore": False, "dataList": []}})
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg, s: 55.0)
+
+    written = start.backfill_range(config, "2024-01-05", "2024-01-05", session=session)
+    assert written == {}
+    report = start.check_vault(config)
+    assert start.repair_vault(config, report, carry_forward=True) == 2
+    assert (today.read_text(), placeholder.read_text()) == before
+    assert "balance: 100.00" in (folder / "2024-01-03.md").read_text()
+    assert not start.already_logged(config, "2024-01-02")
+    assert not start.already_logged(config, "2024-01-05")
+
+
+def test_sharded_layout_reads_and_writes_transparently(config, tmp_path):
+    folder = tmp_path / config.balance_folder
+    start.write_balance(config, "2024-01-30", 90.0)
+    config.vault_layout = "sharded"
+    start.write_balance(config, "2024-02-01", 100.0)
+    start.write_balance(config, "2024-01-30", 95.0)  # unmigrated note stays put
+
+    assert (folder / "2024" / "02" / "2024-02-01.md").exists()
+    assert "balance: 95.00" in (folder / "2024-01-30.md").read_text()
+    assert not (folder / "2024" / "01").exists()
+    assert start.read_previous_balance(config, "2024-02-03") == 100.0
+    assert start.read_previous_balance(config, "2024-02-01") == 95.0
+    assert start.load_balance_series(config, "2024-01-01", "2024-12-31") == {
+        "2024-01-30": 95.0,
+        "2024-02-01": 100.0,
+    }
+    report = start.check_vault(config)
+    assert report.notes == 2
+    assert report.missing == ["2024-01-31"]
+
+
+def test_main_vault_migrate_moves_notes_and_keeps_links(monkeypatch, tmp_path):
+    set_env(monkeypatch, tmp_path)
+    cache_file = str(tmp_path / "c.sqlite3")
+    config = start.Config(
+        "k", "s", "p", vault_path=str(tmp_path), cache_file=cache_file
+    )
+    folder = tmp_path / config.balance_folder
+    for day, balance in (("2024-01-31", 90.0), ("2024-02-01", 100.0)):
+        start.write_balance(config, day, balance)
+    journal = tmp_path / "Journal.md"
+    journal.write_text(
+        "[[Trading/Balances/KuCoin/2024-02-01|Feb]] and [[2024-01-31]]\n"
+        "[md](Trading/Balances/KuCoin/2024-01-31.md) "
+        "Trading/Balances/KuCoin/2024-01-310\n"
+    )
+
+    start.main(["--cache-file", cache_file, "vault", "migrate", "--layout", "sharded"])
+
+    assert not list(folder.glob("*.md"))
+    assert (folder / "2024" / "01" / "2024-01-31.md").exists()
+    assert (folder / "2024" / "02" / "2024-02-01.md").exists()
+    assert journal.read_text() == (
+        "[[Trading/Balances/KuCoin/2024/02/2024-02-01|Feb]] and [[2024-01-31]]\n"
+        "[md](Trading/Balances/KuCoin/2024/01/2024-01-31.md) "
+        "Trading/Balances/KuCoin/2024-01-310\n"
+    )
+    assert start.read_previous_balance(config, "2024-02-02") == 100.0
+
+    start.main(["--cache-file", cache_file, "vault", "migrate", "--layout", "flat"])
+
+    assert (folder / "2024-01-31.md").exists()
+    assert not (folder / "2024").exists()
+    assert "[[Trading/Balances/KuCoin/2024-02-01|Feb]]" in journal.read_text()
+
+
+def test_benchmark_suite_smoke(tmp_path, capsys):
+    spec = importlib.util.spec_from_file_location(
+        "bench", Path(__file__).resolve().parent.parent / "benchmarks" / "bench.py"
+    )
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+    output = tmp_path / "results.json"
+    argv = ["--sizes", "20", "--ops", "5", "--requests", "5", "--latency", "0.005"]
+
+    assert bench.main(argv + ["--output", str(output)]) == 0
+    results = json.loads(output.read_text())["results"]
+    names = {r["name"] for r in results}
+    assert {"fetch", "fetch_faulty", "write_balance", "mark_logged"} <= names
+    assert all(r["errors"] == 0 for r in results if r["name"] != "fetch_faulty")
+
+    for r in results:
+        r["p50_ms"] /= 100
+    output.write_text(json.dumps({"version": "0.0.1", "results": results}))
+    assert bench.main(argv + ["--baseline", str(output)]) == 1
+    assert "REGRESSION: fetch " in capsys.readouterr().out
+
+    release = json.loads((bench.BASELINES / "0.4.0.json").read_text())
+    covered = {(r["name"], r["size"]) for r in release["results"]}
+    assert {("write_balance", size) for size in bench.DEFAULT_SIZES} <= covered
+
+
+def test_price_cache_batches_expires_and_evicts(monkeypatch, config):
+    batches = []
+
+    def fake_prices(cfg, session, currencies):
+        batches.append(sorted(currencies))
+        return {c: 2.0 for c in currencies}
+
+    monkeypatch.setattr(start, "fetch_prices", fake_prices)
+    clock = [0.0]
+    monkeypatch.setattr(start.time, "monotonic", lambda: clock[0])
+    cache = start.PriceCache(max_entries=2)
+
+    assert cache.get_many(config, None, ["XBT", "USDT", "XBT"]) == {
+        "USDT": 2.0,
+        "XBT": 2.0,
+    }
+    cache.get_many(config, None, ["USDT"])
+    cache.get_many(config, None, ["ETH"])  # evicts XBT, the least recently used
+    cache.get_many(config, None, ["USDT", "XBT"])
+    clock[0] = config.price_ttl
+    cache.get_many(config, None, ["ETH"])
+    assert batches == [["USDT", "XBT"], ["ETH"], ["XBT"], ["ETH"]]
+
+
+def test_main_profiles_total_in_base_currency(monkeypatch, tmp_path):
+    monkeypatch.setenv("OBSIDIAN_VAULT_PATH", str(tmp_path))
+    monkeypatch.setenv("BALANCE_BASE_CURRENCY", "usdt")
+    monkeypatch.setenv("KUCOIN_BALANCE_CURRENCIES", "USDT,XBT")
+    monkeypatch.setenv("BALANCE_RESPONSE_TTL", "0")
+    path = write_profiles(
+        tmp_path,
+        "accounts:\n"
+        "  - {name: a, api_key: k1, api_secret: s1, api_passphrase: p1}\n"
+        "  - {name: b, api_key: k2, api_secret: s2, api_passphrase: p2}\n",
+    )
+
+    def route(url):
+        if "/api/v1/prices" in url:
+            assert "currencies=BTC,USDT" in url
+            return {"data": {"BTC": "60000", "USDT": "1.0"}}
+        return {"data": {"accountEquity": "0.01" if "XBT" in url else "100"}}
+
+    session = RoutedSession(route)
+    monkeypatch.setattr(start, "new_session", lambda pool_size=1: session)
+    start.PRICES.clear()
+    start.main(["--profiles", path, "--cache-file", str(tmp_path / "c.sqlite3")])
+
+    assert sum("/api/v1/prices" in url for url in session.urls) == 1
+    note = tmp_path / "Trading/Balances/KuCoin/b" / f"{start._today()}.md"
+    assert note.read_text().endswith(
+        "balance: 700.00\n"
+        "base_currency: USDT\n"
+        "currencies:\n"
+        "  USDT: {equity: 100.00000000, value: 100.00}\n"
+        "  XBT: {equity: 0.01000000, value: 600.00}\n"
+        "---\n"
+    )
+    assert start.read_note_balance(str(note)) == 700.0
+    assert logged_rows(str(tmp_path / "c.sqlite3")) == [
+        ("a", "USDT", start._today()),
+        ("b", "USDT", start._today()),
+    ]
+
+
+def test_claim_date_admits_one_run(monkeypatch, config):
+    with start.claim_date(config, "2024-01-01") as first:
+        with start.claim_date(config, "2024-01-01") as second:
+            assert (first, second) == (True, False)
+        start.mark_logged(config, "2024-01-01")
+    with start.claim_date(config, "2024-01-01") as again:
+        assert again is False
+    with start.claim_date(config, "2024-01-01", force=True) as forced:
+        assert forced is True
+
+    with start.open_ledger(config) as ledger:
+        assert ledger.claim("default", "USDT", "2024-01-02", "crashed")
+    with start.claim_date(config, "2024-01-02") as live:
+        assert live is False
+    monkeypatch.setattr(start, "CLAIM_STALE_SECONDS", -1.0)
+    with start.claim_date(config, "2024-01-02") as stale:
+        assert stale is True
+
+
+def test_claim_date_retries_a_busy_ledger(monkeypatch, config):
+    monkeypatch.setattr(start, "CLAIM_BUSY_TIMEOUT", 0.01)
+    start.mark_logged(config, "2023-12-31")  # create the ledger
+    start.METRICS.reset()
+
+    # a writer holding the ledger briefly only delays the claim: it commits
+    # while the claim backs off
+    holder = start.open_ledger(config)
+    holder.conn.execute("BEGIN IMMEDIATE")
+    monkeypatch.setattr(start.time, "sleep", lambda s: holder.conn.execute("COMMIT"))
+    try:
+        with start.claim_date(config, "2024-01-03") as claimed:
+            assert claimed is True
+    finally:
+        holder.close()
+        monkeypatch.undo()
+    assert start.METRICS.counters["claim_retries"] == 1
+    assert "claims_lost" not in start.METRICS.counters
+
+    # a ledger that stays locked is an error, not another run's claim
+    monkeypatch.setattr(start, "CLAIM_BUSY_TIMEOUT", 0.01)
+    monkeypatch.setattr(start, "CLAIM_BUSY_DEADLINE", 0.05)
+    with start.open_ledger(config) as ledger, ledger.transaction():
+        with pytest.raises(RuntimeError, match="stayed busy"):
+            with start.claim_date(config, "2024-01-04"):
+                pass
+
+
+def test_sample_and_stream_writes_respect_claims(monkeypatch, config, tmp_path):
+    note = tmp_path / config.balance_folder / "2024-01-01.md"
+    monkeypatch.setattr(start, "_today", lambda: "2024-01-01")
+    monkeypatch.setattr(start, "fetch_futures_balance", lambda cfg, s: 100.0)
+    with start.open_ledger(config) as ledger:
+        assert ledger.claim("default", "USDT", "2024-01-01", "other run")
+
+    start.sample_profiles([config], "2024-01-01", session=object())
+    stream = start.BalanceStream(config, None, threading.Event())
+    stream.update(101.0)
+    assert not note.exists()
+    assert not start.already_logged(config, "2024-01-01")
+
+    with start.open_ledger(config) as ledger:
+        ledger.release("default", "USDT", "2024-01-01", "other run")
+    stream.flush(force=True)
+    assert "balance: 101.00" in note.read_text()
+    assert start.already_logged(config, "2024-01-01")
+
+
+def test_benchmark_stress_mode_smoke(capsys):
+    spec = importlib.util.spec_from_file_location(
+        "bench", Path(__file__).resolve().parent.parent / "benchmarks" / "bench.py"
+    )
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    assert bench.main(["--stress", "4", "--latency", "0.05", "--p99-limit", "30"]) == 0
+    assert "1 wrote the note, 1 balance requests, 0 errors" in capsys.readouterr().out
+
+
+def test_main_profile_and_trace_alloc_write_per_run_files(monkeypatch, tmp_path):
+    import pstats
+
+    monkeypatch.setenv("OBSIDIAN_VAULT_PATH", str(tmp_path))
+    path = write_profiles(
+        tmp_path,
+        "accounts:\n"
+        "  - {name: a, api_key: k1, api_secret: s1, api_passphrase: p1}\n"
+        "  - {name: b, api_key: k2, api_secret: s2, api_passphrase: p2}\n",
+    )
+
+    def fake_fetch_in_worker(cfg, session=None):
+        return 42.0
+
+    monkeypatch.setattr(start, "fetch_futures_balance", fake_fetch_in_worker)
+    diagnostics = tmp_path / "diagnostics"
+    start.main(
+        [
+            "--profiles",
+            path,
+            "--cache-file",
+            str(tmp_path / "c.sqlite3"),
+            "--profile",
+            str(diagnostics),
+            "--trace-alloc",
+            str(diagnostics),
+            "--trace-alloc-top",
+            "5",
+        ]
+    )
+
+    (profile,) = diagnostics.glob("balancefetcher-profiles-*.pstats")
+    (alloc,) = diagnostics.glob("balancefetcher-profiles-*.alloc.txt")
+    assert profile.name[:-7] == alloc.name[:-10]
+    functions = {func for _, _, func in pstats.Stats(str(profile)).stats}
+    assert {"run", "record_balance", "fake_fetch_in_worker"} <= functions
+    lines = alloc.read_text().splitlines()
+    assert lines[1].startswith("# traced memory: current")
+    assert len(lines) == 3 + 5
+
+
+def test_main_export_streams_history_in_date_order(monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("OBSIDIAN_VAULT_PATH", str(tmp_path))
+    path = write_profiles(
+        tmp_path,
+        "accounts:\n"
+        "  - {name: a, api_key: k1, api_secret: s1, api_passphrase: p1}\n"
+        "  - {name: b, api_key: k2, api_secret: s2, api_passphrase: p2}\n",
+    )
+    cache_file = str(tmp_path / "c.sqlite3")
+    base = start.Config(
+        "k", "s", "p", vault_path=str(tmp_path), cache_file=cache_file
+    )
+    a, b = start.load_profiles(base, path)
+    for cfg, day, value in [
+        (a, "2024-01-01", 10.0),
+        (a, "2024-01-03", 30.0),
+        (b, "2024-01-02", 20.0),
+    ]:
+        start.write_balance(cfg, day, value)
+    common = ["--profiles", path, "--cache-file", cache_file]
+    out = tmp_path / "export" / "history.csv"
+
+    start.main(common + ["export", "-o", str(out), "--since-last"])
+    assert out.read_text() == (
+        "date,account,currency,balance\n"
+        "2024-01-01,a,USDT,10.0\n"
+        "2024-01-02,b,USDT,20.0\n"
+        "2024-01-03,a,USDT,30.0\n"
+    )
+    start.write_balance(b, "2024-01-04", 40.0)
+    start.main(common + ["export", "-o", str(out), "--since-last"])
+    assert out.read_text().splitlines()[-2:] == [
+        "2024-01-03,a,USDT,30.0",
+        "2024-01-04,b,USDT,40.0",
+    ]
+
+    capsys.readouterr()
+    start.main(
+        common
+        + ["export", "--format", "jsonl", "--account", "a", "--from", "2024-01-02"]
+    )
+    assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+        {"date": "2024-01-03", "account": "a", "currency": "USDT", "balance": 30.0}
+    ]
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(start, "EXPORT_BATCH", 2)
+    parquet = tmp_path / "history.parquet"
+    start.main(common + ["export", "--format", "parquet", "-o", str(parquet)])
+    table = pq.read_table(parquet)
+    assert table.column("date").to_pylist() == [
+        "2024-01-01",
+        "2024-01-02",
+        "2024-01-03",
+        "2024-01-04",
+    ]
+    assert table.column("balance").to_pylist() == [10.0, 20.0, 30.0, 40.0]
+
+
+def test_main_export_parquet_since_last_keeps_every_row(monkeypatch, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    cache_file = str(tmp_path / "c.sqlite3")
+    config = start.Config(
+        "k", "s", "p", vault_path=str(tmp_path), cache_file=cache_file
+    )
+    start.write_balance(config, "2024-01-01", 10.0)
+    start.write_balance(config, "2024-01-02", 20.0)
+    set_env(monkeypatch, tmp_path)
+    dataset = tmp_path / "history.parquet"
+    argv = ["--cache-file", cache_file, "export"]
+    argv += ["--format", "parquet", "-o", str(dataset), "--since-last"]
+
+    start.main(argv)
+    start.write_balance(config, "2024-01-03", 30.0)
+    start.main(argv)
+    start.main(argv)  # nothing new, so no empty part
+
+    assert sorted(p.name for p in dataset.iterdir()) == [
+        "part-2024-01-02.parquet",
+        "part-2024-01-03.parquet",
+    ]
+    table = pq.read_table(dataset).sort_by("date")
+    assert table.column("date").to_pylist() == [
+        "2024-01-01",
+        "2024-01-02",
+        "2024-01-03",
+    ]
+    assert table.column("balance").to_pylist() == [10.0, 20.0, 30.0]
+
+    single = tmp_path / "single.parquet"
+    start.main(argv[:-3] + ["-o", str(single)])
+    with pytest.raises(SystemExit, match="dataset directory"):
+        start.main(argv[:-3] + ["-o", str(single), "--since-last"])